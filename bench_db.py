@@ -0,0 +1,728 @@
+# -----------------------------------------------------------------------
+# bench_db.py
+# -----------------------------------------------------------------------
+# micro benchmarks of the storage and index modules
+# each benchmark works on files in a temporary directory, run it with
+#       python bench_db.py
+# -----------------------------------------------------------------------
+
+import bisect
+import contextlib
+import io
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+
+import ply.lex as lex
+import ply.yacc as yacc
+
+import catalog_db
+import common_db
+import index_db
+import lex_db
+import parser_db
+import query_plan_db
+import schema_db
+import storage_db
+from common_db import BLOCK_SIZE
+
+
+# ------------------------------------------------
+# to write block 0 of a new table file, instead of asking for the fields with input()
+# input:
+#       tablename: bytes
+#       field_list: each element is (field name, field type, field length)
+# ------------------------------------------------
+def create_table_file(tablename, field_list):
+    dir_buf = bytearray(BLOCK_SIZE)
+    struct.pack_into('!iii', dir_buf, 0, 0, 0, len(field_list))
+    for i, (field_name, field_type, field_length) in enumerate(field_list):
+        field_name = field_name.rjust(10)
+        struct.pack_into('!10sii', dir_buf, struct.calcsize('!iii') + i * struct.calcsize('!10sii'),
+                         field_name, field_type, field_length)
+    with open(tablename + b'.dat', 'wb') as f_handle:
+        f_handle.write(dir_buf)
+
+
+# ------------------------------------------------
+# how many records like the given one fill a data block
+# input:
+#       codec: the RecordCodec of the table
+#       record: list of field values as strings
+# ------------------------------------------------
+def records_per_block(codec, record):
+    return (BLOCK_SIZE - codec.block_head_struct.size) // codec.record_space(codec.encode_record(record))
+
+
+# ------------------------------------------------
+# the decoding loop used by Storage before RecordCodec, kept to compare with
+# ------------------------------------------------
+def legacy_decode_block(field_name_list, data_block, block_id):
+    record_head_len = struct.calcsize('!ii10si')
+    record_content_len = sum(map(lambda x: x[2], field_name_list))
+
+    result = []
+    Number_of_Records = struct.unpack_from('!ii', data_block, 0)[1]
+    for i in range(Number_of_Records):
+        offset = struct.unpack_from('!i', data_block, struct.calcsize('!ii') + i * struct.calcsize('!i'))[0]
+        is_deleted = struct.unpack_from('!ii10si', data_block, offset)[3]
+        if is_deleted:
+            continue
+        record = struct.unpack_from('!' + str(record_content_len) + 's', data_block, offset + record_head_len)[0]
+        tmp = 0
+        tmpList = []
+        for field in field_name_list:
+            t = record[tmp:tmp + field[2]].strip()
+            tmp = tmp + field[2]
+            if field[1] == 2:
+                t = int(t)
+            if field[1] == 3:
+                t = bool(t)
+            tmpList.append(t)
+        result.append(((block_id, i), tuple(tmpList)))
+    return result
+
+
+# ------------------------------------------------
+# decode throughput of the records of a table, before and after RecordCodec
+# input:
+#       num_of_blocks: the size of the table
+# ------------------------------------------------
+def bench_record_decode(num_of_blocks=4000):
+    print('--- record decode, %d blocks ---' % num_of_blocks)
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            create_table_file(b'bench', [(b'name', 0, 10), (b'age', 2, 10), (b'flag', 3, 5)])
+            storage = storage_db.Storage(b'bench')
+            per_block = records_per_block(storage.codec, ['name0', '0', 'True'])
+            rows = [['name%d' % i, str(i), 'True'] for i in range(per_block * num_of_blocks)]
+            storage.insert_records(rows)
+
+            with open(b'bench.dat', 'rb') as f_handle:
+                f_handle.seek(BLOCK_SIZE)
+                blocks = [f_handle.read(BLOCK_SIZE) for i in range(num_of_blocks)]
+
+            for name, decode in [('per field loop', lambda block, block_id, storage=storage:
+                                  legacy_decode_block(storage.field_name_list, block, block_id)),
+                                 ('RecordCodec', storage.codec.decode_block)]:
+                begin = time.perf_counter()
+                num_of_records = 0
+                for block_id, block in enumerate(blocks, 1):
+                    num_of_records += len(decode(block, block_id))
+                seconds = time.perf_counter() - begin
+                print('%-16s %8.3f s  %10.0f blocks/s  %12.0f records/s' % (
+                    name, seconds, num_of_blocks / seconds, num_of_records / seconds))
+            del storage
+        finally:
+            os.chdir(old_dir)
+
+
+# ------------------------------------------------
+# time to build an index on a table, inserting the entries one by one or loading them bottom-up
+# input:
+#       num_of_records: the size of the table
+# ------------------------------------------------
+def bench_index_build(num_of_records=100000):
+    print('--- index build, %d records ---' % num_of_records)
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            create_table_file(b'bench', [(b'name', 0, 10), (b'age', 2, 10)])
+            registry = catalog_db.get_table_registry()
+            rows = [['name%d' % random.randrange(num_of_records), str(i)] for i in range(num_of_records)]
+            registry.acquire(b'bench').insert_records(rows)
+            registry.release(b'bench')
+
+            def insert_one_by_one(index):
+                for (block_id, slot_id), record in registry.acquire(b'bench').scan():
+                    index.insert_index_entry(record[0], block_id, slot_id)
+                registry.release(b'bench')
+
+            for name, build in [('one by one', insert_one_by_one),
+                                ('bulk load', lambda index: index.create_index(b'name'))]:
+                if os.path.exists(b'bench_name.ind'):
+                    os.remove(b'bench_name.ind')
+                with contextlib.redirect_stdout(io.StringIO()):  # the index module prints a lot
+                    index = index_db.Index(b'bench', b'name')
+                    begin = time.perf_counter()
+                    build(index)
+                    seconds = time.perf_counter() - begin
+                    num_of_blocks = index.pool.block_count(index.file_name)
+                    num_of_levels = index.num_of_levels
+                    del index
+                print('%-16s %8.3f s  %10.0f entries/s  %6d blocks  %d levels' % (
+                    name, seconds, num_of_records / seconds, num_of_blocks, num_of_levels))
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+
+# ------------------------------------------------
+# the node search used by Index before the keys were decoded on demand, kept to compare with
+# each node on the way is unpacked into lists of all its keys and ptrs
+# ------------------------------------------------
+def legacy_index_search(index, field_value):
+    def read_node(block_id):
+        block = index.pool.fetch_page(index.file_name, block_id)
+        try:
+            node_type, num_of_keys = struct.unpack_from('!iii', block, 0)[1:]
+            entry_struct = index_db.LEAF_ENTRY_STRUCT if node_type == index_db.LEAF_NODE_TYPE \
+                else index_db.INTERNAL_ENTRY_STRUCT
+            begin = struct.calcsize('!iii')
+            entries = list(entry_struct.iter_unpack(bytes(block[begin:begin + num_of_keys * entry_struct.size])))
+            last_ptr = struct.unpack_from('!i', block, index_db.LAST_PTR_OFFSET)[0]
+        finally:
+            index.pool.unpin_page(index.file_name, block_id)
+        key_list = [entry[0] for entry in entries]
+        ptr_list = [entry[1:] if len(entry) == 3 else entry[1] for entry in entries]
+        return key_list, ptr_list, last_ptr
+
+    search_key = index_db.make_key(field_value, index.key_type)
+    next_node_ptr = index.root_node_ptr
+    for level in range(index.num_of_levels - 1):
+        key_list, ptr_list, last_ptr = read_node(next_node_ptr)
+        next_node_ptr = (ptr_list + [last_ptr])[bisect.bisect_left(key_list, search_key)]
+    result = []
+    while next_node_ptr != index_db.SPECIAL_INDEX_BLOCK_PTR:
+        key_list, ptr_list, last_ptr = read_node(next_node_ptr)
+        i = bisect.bisect_left(key_list, search_key)
+        while i < len(key_list) and key_list[i] == search_key:
+            result.append(ptr_list[i])
+            i += 1
+        if i < len(key_list):
+            break
+        next_node_ptr = last_ptr
+    return result
+
+
+# ------------------------------------------------
+# latency of an index probe, for trees of 1, 2 and 3 levels
+# the nodes are cached in the buffer pool, so it is the cost of searching the nodes
+# input:
+#       num_of_probes: how many keys are searched for each tree
+# ------------------------------------------------
+def bench_index_probe(num_of_probes=20000):
+    print('--- index probe, %d probes ---' % num_of_probes)
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            registry = catalog_db.get_table_registry()
+            for num_of_records in (150, 20000, 200000):
+                tablename = b'probe%d' % num_of_records
+                create_table_file(tablename, [(b'id', 2, 10)])
+                registry.acquire(tablename).insert_records([[str(i)] for i in range(num_of_records)])
+                registry.release(tablename)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    index = index_db.Index(tablename, b'id')
+                    index.create_index(b'id')
+                values = [random.randrange(num_of_records) for i in range(num_of_probes)]
+                assert all(index.search(value) == legacy_index_search(index, value) for value in values[:100])
+
+                for name, search in [('unpack all keys', lambda value, index=index: legacy_index_search(index, value)),
+                                     ('bisect on view', index.search)]:
+                    begin = time.perf_counter()
+                    for value in values:
+                        search(value)
+                    seconds = time.perf_counter() - begin
+                    print('%7d keys %d levels  %-16s %7.2f us/probe  %7.2f us/level' % (
+                        num_of_records, index.num_of_levels, name, seconds / num_of_probes * 1e6,
+                        seconds / num_of_probes / index.num_of_levels * 1e6))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    del index
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+
+# ------------------------------------------------
+# block reads of index probes and inserts when table scans keep pushing the index out of the pool,
+# with and without the upper levels of the index pinned
+# input:
+#       num_of_rounds: each round scans the big table, then does the probes and the inserts
+#       num_of_probes: probes and inserts of each round
+# ------------------------------------------------
+def bench_index_pinning(num_of_rounds=40, num_of_probes=10):
+    print('--- index pinning, %d rounds of a table scan and %d probes and inserts ---' % (num_of_rounds, num_of_probes))
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            registry = catalog_db.get_table_registry()
+            create_table_file(b'keys', [(b'id', 2, 10)])
+            create_table_file(b'big', [(b'name', 0, 10), (b'age', 2, 10)])
+            num_of_keys = 200000
+            registry.acquire(b'keys').insert_records([[str(i)] for i in range(num_of_keys)])
+            big = registry.acquire(b'big')  # twice as many blocks as the frames of the pool
+            big.insert_records([['name%d' % i, str(i)] for i in range(2 * 256 * records_per_block(big.codec, ['name0', '0']))])
+            with contextlib.redirect_stdout(io.StringIO()):
+                index = index_db.Index(b'keys', b'id')
+                index.create_index(b'id', 0.7)
+                del index
+
+            pinned_levels = index_db.PINNED_LEVELS
+            for name, levels in [('nothing pinned', 0), ('upper levels', pinned_levels)]:
+                index_db.PINNED_LEVELS = levels
+                with contextlib.redirect_stdout(io.StringIO()):
+                    index = index_db.Index(b'keys', b'id')
+                    pool = index.pool
+                    search_reads = insert_reads = 0
+                    for i in range(num_of_rounds):
+                        for position, record in big.scan():
+                            pass
+                        misses = pool.num_of_misses
+                        for value in random.sample(range(num_of_keys), num_of_probes):
+                            index.search(value)
+                        search_reads += pool.num_of_misses - misses
+                        misses = pool.num_of_misses
+                        for value in random.sample(range(num_of_keys), num_of_probes):
+                            index.insert_index_entry(value, 1, 0)
+                        insert_reads += pool.num_of_misses - misses
+                    num_of_levels = index.num_of_levels
+                    del index
+                print('%-16s %d levels  %5.2f block reads/search  %5.2f block reads/insert' % (
+                    name, num_of_levels, search_reads / (num_of_rounds * num_of_probes),
+                    insert_reads / (num_of_rounds * num_of_probes)))
+            index_db.PINNED_LEVELS = pinned_levels
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+
+# ------------------------------------------------
+# equality lookups with the B+ tree and the hash index on the same field
+# the blocks fetched from the buffer pool are counted, the pinned nodes of the tree are not fetched
+# input:
+#       num_of_probes: how many keys are searched for each table
+# ------------------------------------------------
+def bench_hash_probe(num_of_probes=20000):
+    print('--- equality probe, B+ tree and hash index, %d probes ---' % num_of_probes)
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            registry = catalog_db.get_table_registry()
+            for num_of_records in (20000, 200000, 1000000):
+                tablename = b'kv%d' % num_of_records
+                create_table_file(tablename, [(b'k', 2, 10)])
+                registry.acquire(tablename).insert_records([[str(i)] for i in range(num_of_records)])
+                registry.release(tablename)
+                values = [random.randrange(num_of_records) for i in range(num_of_probes)]
+                for kind in (index_db.INDEX_KIND_BTREE, index_db.INDEX_KIND_HASH):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        index = index_db.open_index(tablename, b'k', kind)
+                        index.create_index(b'k')
+                        pool = index.pool
+                        fetches = pool.num_of_hits + pool.num_of_misses
+                        begin = time.perf_counter()
+                        for value in values:
+                            index.search(value)
+                        seconds = time.perf_counter() - begin
+                        fetches = pool.num_of_hits + pool.num_of_misses - fetches
+                        del index
+                    print('%8d keys  %-6s %7.2f us/probe  %5.2f blocks/probe' % (
+                        num_of_records, kind.decode('utf-8'), seconds / num_of_probes * 1e6, fetches / num_of_probes))
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+
+# ------------------------------------------------
+# select name from t where dept = ? with an index on dept, read through the data blocks
+# (IndexScan) or from the leaf entries of the index made again to include name (IndexOnlyScan)
+# the blocks fetched from the buffer pool are counted, those of the index and of the table
+# input:
+#       num_of_records
+#       num_of_queries: how many departments are looked up
+# ------------------------------------------------
+def bench_index_only_scan(num_of_records=200000, num_of_queries=50):
+    print('--- select name where dept = ?, %d records, %d queries ---' % (num_of_records, num_of_queries))
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            registry = catalog_db.get_table_registry()
+            create_table_file(b'emp', [(b'name', 0, 10), (b'dept', 0, 10), (b'age', 2, 10), (b'bio', 0, 40)])
+            storage = registry.acquire(b'emp')
+            storage.insert_records([['n%d' % i, 'd%d' % random.randrange(1000), str(random.randrange(18, 70)),
+                                     'bio of n%d' % i] for i in range(num_of_records)])
+            departments = ['d%d' % random.randrange(1000) for i in range(num_of_queries)]
+
+            def index_scan(index, dept):
+                positions = list(index.range_scan(dept, dept))
+                return [record[0] for position, record in storage.fetch_records(positions)]
+
+            def index_only_scan(index, dept):
+                return [values[1] for position, values in index.covered_scan(dept, dept)]
+
+            results = []
+            for name, include_fields, scan in [('IndexScan', [], index_scan), ('IndexOnlyScan', [b'name'], index_only_scan)]:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    index = index_db.Index(b'emp', b'dept', include_fields)
+                    index.create_index(b'dept')
+                pool = index.pool
+                fetches = pool.num_of_hits + pool.num_of_misses
+                begin = time.perf_counter()
+                rows = [sorted(scan(index, dept)) for dept in departments]
+                seconds = time.perf_counter() - begin
+                fetches = pool.num_of_hits + pool.num_of_misses - fetches
+                results.append(rows)
+                print('%-14s %8.3f ms/query  %7.1f blocks/query  %d rows' % (
+                    name, seconds / num_of_queries * 1e3, fetches / num_of_queries, sum(map(len, rows))))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    index.close()
+            assert results[0] == results[1]
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+
+# ------------------------------------------------
+# fixed-length keys against prefix-compressed nodes with variable-length keys, on a long str field
+# whose first 10 bytes tell few values apart, on a composite key and on an int key
+# input:
+#       num_of_records
+#       num_of_probes: how many keys are searched for each index
+# ------------------------------------------------
+def bench_compressed_index(num_of_records=100000, num_of_probes=5000):
+    print('--- fixed vs prefix-compressed nodes, %d records, %d probes ---' % (num_of_records, num_of_probes))
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            registry = catalog_db.get_table_registry()
+            create_table_file(b'orders', [(b'ref', 1, 60), (b'dept', 0, 10), (b'age', 2, 10)])
+            storage = registry.acquire(b'orders')
+            records = [['cust%06d/order/%07d' % (random.randrange(5000), i), 'd%d' % random.randrange(1000),
+                        str(random.randrange(18, 70))] for i in range(num_of_records)]
+            storage.insert_records(records)
+            ref_probes = [random.choice(records)[0] for i in range(num_of_probes)]
+            composite_probes = [tuple(random.choice(records)[1:]) for i in range(num_of_probes)]
+            age_probes = [int(random.choice(records)[2]) for i in range(num_of_probes // 10)]  # each matches many records
+
+            def count_leaves(index):
+                block_id = index.root_node_ptr
+                for level in range(index.num_of_levels - 1):
+                    block_id = index.child_node_ptr(block_id, None, False, level)[1]
+                num_of_leaves = 0
+                while block_id != index_db.SPECIAL_INDEX_BLOCK_PTR:
+                    block_id = index.read_node(block_id)[3]
+                    num_of_leaves += 1
+                return num_of_leaves
+
+            for index_field, probes in [(b'ref', ref_probes), (b'dept,age', composite_probes),
+                                        (b'age', age_probes)]:
+                for compressed in (False, True):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        index = index_db.Index(b'orders', index_field, None, compressed)
+                        begin = time.perf_counter()
+                        num_of_entries = index.create_index(index_field)
+                        build_seconds = time.perf_counter() - begin
+                        num_of_leaves = count_leaves(index)
+                        num_of_nodes = index.pool.block_count(index.file_name) - 1
+                        begin = time.perf_counter()
+                        num_of_candidates = sum(len(index.search(value)) for value in probes)
+                        probe_seconds = time.perf_counter() - begin
+                        index.close()
+                    print('%-9s %-10s build %6.3f s  %5d nodes  %d levels  %6.1f entries/leaf  '
+                          '%7.1f us/probe  %6.1f candidates/probe' % (
+                              index_field.decode(), 'compressed' if compressed else 'fixed', build_seconds,
+                              num_of_nodes, index.num_of_levels, num_of_entries / num_of_leaves,
+                              probe_seconds / len(probes) * 1e6, num_of_candidates / len(probes)))
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+# ------------------------------------------------
+# to check the structure of a B+ tree: the keys of each node are in order and within the
+# separator keys of the parent node, all the leaf nodes are at the same level and the chain of the
+# leaf nodes visits them in key order
+# output:
+#       the entries of the leaf nodes, each is (key, ptr)
+# ------------------------------------------------
+def check_index_tree(index):
+    if not index.has_root:
+        return []
+    leaves = []
+
+    def check_node(block_id, level, low, high):
+        node_type, key_list, ptr_list, last_ptr = index.read_node(block_id)
+        assert key_list == sorted(key_list), 'the keys of node %d are not in order' % block_id
+        assert all((low is None or low <= key) and (high is None or key <= high) for key in key_list), \
+            'the keys of node %d are beyond the separator keys' % block_id
+        if level == index.num_of_levels - 1:
+            assert node_type == index_db.LEAF_NODE_TYPE, 'node %d should be a leaf node' % block_id
+            leaves.append((block_id, key_list, ptr_list, last_ptr))
+            return
+        assert node_type == index_db.INTERNAL_NODE_TYPE and key_list, 'node %d should be an internal node' % block_id
+        bounds = [low] + key_list + [high]
+        for i, child_ptr in enumerate(ptr_list + [last_ptr]):
+            check_node(child_ptr, level + 1, bounds[i], bounds[i + 1])
+
+    check_node(index.root_node_ptr, 0, None, None)
+    for i, (block_id, key_list, ptr_list, last_ptr) in enumerate(leaves):
+        next_ptr = leaves[i + 1][0] if i + 1 < len(leaves) else index_db.SPECIAL_INDEX_BLOCK_PTR
+        assert last_ptr == next_ptr, 'the leaf chain is broken after node %d' % block_id
+    return [entry for block_id, key_list, ptr_list, last_ptr in leaves for entry in zip(key_list, ptr_list)]
+
+
+# ------------------------------------------------
+# lookups and inserts on one B+ tree from several threads, the nodes are latch-coupled
+# the lookups are timed first with the threads only searching, then some of the threads insert new keys
+# while the others search, and the tree is checked with check_index_tree() at the end.
+# the threads share the interpreter lock, so the throughput shows how little the latches cost
+# rather than a speedup
+# input:
+#       num_of_keys: the keys in the tree at the beginning
+#       num_of_lookups: the lookups of each round, shared by the threads
+# ------------------------------------------------
+def bench_index_concurrency(num_of_keys=100000, num_of_lookups=40000, thread_counts=(1, 2, 4, 8)):
+    print('--- latch-coupled B+ tree, %d keys, %d lookups per round ---' % (num_of_keys, num_of_lookups))
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            create_table_file(b'keys', [(b'id', 2, 10)])
+            with contextlib.redirect_stdout(io.StringIO()):
+                index = index_db.Index(b'keys', b'id')
+                index.create_index(b'id')
+                for value in random.sample(range(0, 2 * num_of_keys, 2), num_of_keys):  # even keys
+                    index.insert_index_entry(value, value // 2 + 1, 0, False)
+            probes = [2 * random.randrange(num_of_keys) for i in range(num_of_lookups)]
+            odd_values = random.sample(range(1, 2 * num_of_keys, 2), num_of_lookups // 4 * len(thread_counts))
+            failures = []
+            report = []
+
+            def run_threads(targets):
+                threads = [threading.Thread(target=target, args=args) for target, args in targets]
+                begin = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                return time.perf_counter() - begin
+
+            def look_up(values):
+                for value in values:
+                    if index.search(value) != [(value // 2 + 1, value % 2)]:
+                        failures.append(value)
+
+            def insert(values):
+                for value in values:
+                    index.insert_index_entry(value, value // 2 + 1, value % 2, False)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                for num_of_threads in thread_counts:
+                    seconds = run_threads([(look_up, (probes[i::num_of_threads],)) for i in range(num_of_threads)])
+                    report.append('%d threads searching        %9.0f lookups/s' % (num_of_threads, num_of_lookups / seconds))
+
+                # odd keys go in while the other threads search, each writer has its own keys
+                num_of_inserts = 0
+                for num_of_threads in thread_counts[1:]:
+                    num_of_writers = num_of_threads // 2
+                    new_values = odd_values[num_of_inserts:num_of_inserts + num_of_lookups // 4]
+                    targets = [(insert, (new_values[i::num_of_writers],)) for i in range(num_of_writers)]
+                    num_of_readers = num_of_threads - num_of_writers
+                    targets += [(look_up, (probes[i::num_of_readers],)) for i in range(num_of_readers)]
+                    seconds = run_threads(targets)
+                    num_of_inserts += len(new_values)
+                    report.append('%d threads, %d inserting    %9.0f lookups/s  %9.0f inserts/s  %d levels' % (
+                        num_of_threads, num_of_writers, num_of_lookups / seconds, len(new_values) / seconds,
+                        index.num_of_levels))
+                    probes += new_values[:num_of_lookups // 10]
+                    probes = probes[-num_of_lookups:]
+
+                entries = check_index_tree(index)
+                index.close()
+            print('\n'.join(report))
+            assert not failures, '%d lookups went wrong' % len(failures)
+            assert len(entries) == num_of_keys + num_of_inserts, 'entries are lost'
+            print('the tree is sound, %d entries' % len(entries))
+            catalog_db.get_table_registry().close_all()
+        finally:
+            os.chdir(old_dir)
+
+# ------------------------------------------------
+# inserts into a table with a primary key, the key is checked with one probe of its index,
+# compared with checking it by a scan of the table before each insert
+# input:
+#       num_of_records: the records in the table at the beginning
+#       num_of_inserts: the records inserted with each way of checking
+# ------------------------------------------------
+def bench_key_check(num_of_records=50000, num_of_inserts=200):
+    print('--- primary key check, %d records, %d inserts ---' % (num_of_records, num_of_inserts))
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            open(schema_db.Schema.fileName, 'wb').close()
+            create_table_file(b'people', [(b'id', 2, 10), (b'name', 0, 10)])
+            with contextlib.redirect_stdout(io.StringIO()):
+                schema = schema_db.Schema()
+                storage = catalog_db.get_table_registry().acquire(b'people')
+                storage.insert_records([[str(i), 'name%d' % i] for i in range(num_of_records)])
+
+                begin = time.perf_counter()
+                for i in range(num_of_records, num_of_records + num_of_inserts):
+                    if all(record[0] != i for record in storage.getRecord()):
+                        storage.insert_record([str(i), 'name%d' % i])
+                scan_seconds = time.perf_counter() - begin
+
+                schema.appendTable(b'people', storage.getFieldList(), 'id')
+                storage.create_key_indexes()
+                begin = time.perf_counter()
+                for i in range(num_of_records + num_of_inserts, num_of_records + 2 * num_of_inserts):
+                    storage.insert_record([str(i), 'name%d' % i])
+                probe_seconds = time.perf_counter() - begin
+                is_rejected = not storage.insert_record([str(num_of_records), 'again'])
+                del schema
+            print('scan before insert   %8.3f ms/insert' % (scan_seconds / num_of_inserts * 1e3))
+            print('index probe          %8.3f ms/insert  duplicate rejected: %s' % (
+                probe_seconds / num_of_inserts * 1e3, is_rejected))
+            catalog_db.get_table_registry().close_all()
+        finally:
+            os.chdir(old_dir)
+
+# ------------------------------------------------
+# the cost of parsing a query, when the lexer and the parser are made for every query as before,
+# and when they are made once and only the lexer is reset between the queries.
+# the startup, namely making the parser the first time, is timed with the tables read from
+# parsetab.py and with the tables made from the grammar
+# input:
+#       num_of_rounds: how many times the queries are parsed
+# ------------------------------------------------
+def bench_sql_parse(num_of_rounds=100):
+    queries = ["select * from emp",
+               "select name, age from emp where age = 42",
+               "select emp.name, dept.title from emp, dept where emp.age > 30 and dept.title = 'sales'",
+               "select name from emp where active = true"]
+    print('--- parsing %d queries, %d rounds ---' % (len(queries), num_of_rounds))
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            def parse_all(make_handles, tokenize):
+                begin = time.perf_counter()
+                for i in range(num_of_rounds):
+                    for sql in queries:
+                        lexer, parser = make_handles()
+                        tokenize(sql)
+                        common_db.global_parser = parser
+                        if parser.parse(sql, lexer=lexer) is None:
+                            raise ValueError('wrong query ' + sql)
+                return (time.perf_counter() - begin) / (num_of_rounds * len(queries))
+
+            def old_handles():  # the tables are made and parser.out is written for every query
+                return lex.lex(module=lex_db), yacc.yacc(module=parser_db, write_tables=0, outputdir=work_dir,
+                                                         errorlog=yacc.NullLogger())
+
+            def old_tokenize(sql):
+                lexer = lex.lex(module=lex_db)
+                lexer.input(sql)
+                for tok in lexer:
+                    pass
+
+            def new_handles():
+                lex_db.set_lex_handle()
+                parser_db.set_handle()
+                return common_db.global_lexer, common_db.global_parser
+
+            def make_parser(**kwargs):
+                begin = time.perf_counter()
+                for i in range(num_of_rounds):
+                    yacc.yacc(module=parser_db, debug=False, errorlog=yacc.NullLogger(), **kwargs)
+                return (time.perf_counter() - begin) / num_of_rounds
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                common_db.global_lexer = common_db.global_parser = None
+                begin = time.perf_counter()
+                new_handles()
+                startup_seconds = time.perf_counter() - begin
+                read_seconds = make_parser(write_tables=False, tabmodule=parser_db.PARSE_TABLE_MODULE)
+                generate_seconds = make_parser(write_tables=False, tabmodule='no_such_parsetab')
+                old_seconds = parse_all(old_handles, old_tokenize)
+                new_seconds = parse_all(new_handles, lex_db.tokenize_sql)
+            print('first lexer and parser       %8.3f ms' % (startup_seconds * 1e3))
+            print('parser, tables from %-9s %8.3f ms' % (parser_db.PARSE_TABLE_MODULE, read_seconds * 1e3))
+            print('parser, tables made          %8.3f ms' % (generate_seconds * 1e3))
+            print('made for every query         %8.3f ms/query' % (old_seconds * 1e3))
+            print('made once, lexer reset       %8.3f ms/query' % (new_seconds * 1e3))
+        finally:
+            os.chdir(old_dir)
+
+# ------------------------------------------------
+# planning the same shapes of queries with different literals, each query is lexed, parsed and
+# planned, or its plan is found in the plan cache of query_plan_db. the queries are not executed
+# input:
+#       num_of_records: the records of the table, which has an index on age
+#       num_of_queries: the queries planned each way
+# ------------------------------------------------
+def bench_plan_cache(num_of_records=20000, num_of_queries=2000):
+    print('--- planning %d queries, with and without the plan cache ---' % num_of_queries)
+    shapes = ["select * from emp where age = %d",
+              "select name from emp where age >= %d and age < %d",
+              "select * from emp where name = 'n%05d'"]
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            registry = catalog_db.get_table_registry()
+            create_table_file(b'emp', [(b'name', 0, 10), (b'age', 2, 10)])
+            registry.acquire(b'emp').insert_records(
+                [['n%05d' % random.randrange(num_of_records), str(random.randrange(100))] for i in range(num_of_records)])
+            queries = []
+            for i in range(num_of_queries):
+                shape = random.choice(shapes)
+                queries.append(shape % tuple(random.randrange(100) for j in range(shape.count('%'))))
+
+            def plan(sql, use_cache):
+                if use_cache and query_plan_db.use_cached_plan(sql):
+                    return
+                lex_db.tokenize_sql(sql)
+                common_db.global_syn_tree = common_db.global_parser.parse(sql, lexer=common_db.global_lexer)
+                query_plan_db.construct_logical_tree()
+                if use_cache:
+                    query_plan_db.cache_plan(sql)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                index = index_db.Index(b'emp', b'age')
+                index.create_index(b'age')
+                index.close()
+                catalog_db.get_index_catalog().add_index(b'emp', b'age')
+                lex_db.set_lex_handle()
+                parser_db.set_handle()
+                cache = query_plan_db.get_plan_cache()
+                cache.clear()
+                hits, misses = cache.num_of_hits, cache.num_of_misses
+                results = []
+                for use_cache in (False, True):
+                    begin = time.perf_counter()
+                    for sql in queries:
+                        plan(sql, use_cache)
+                    results.append((time.perf_counter() - begin) / num_of_queries)
+            print('parsed and planned     %8.3f ms/query' % (results[0] * 1e3))
+            print('plan cache             %8.3f ms/query  %d hits  %d misses' % (
+                results[1] * 1e3, cache.num_of_hits - hits, cache.num_of_misses - misses))
+            registry.close_all()
+        finally:
+            os.chdir(old_dir)
+
+
+if __name__ == '__main__':
+    bench_record_decode()
+    bench_index_build()
+    bench_index_probe()
+    bench_index_pinning()
+    bench_hash_probe()
+    bench_index_only_scan()
+    bench_compressed_index()
+    bench_index_concurrency()
+    bench_key_check()
+    bench_sql_parse()
+    bench_plan_cache()
@@ -0,0 +1,271 @@
+# -----------------------------------------------------------------------
+# buffer_db.py
+# -----------------------------------------------------------------------
+# the module implements the buffer pool which is shared by all open files
+# each frame caches one block (BLOCK_SIZE bytes) of a file
+#
+# a page is identified by (file_name, block_id)
+# callers pin a page with fetch_page(), change the frame in place and then
+# unpin it with unpin_page(), telling the pool whether the frame is dirty.
+# dirty frames are written back in batches by flush_file(), or one by one
+# when the clock algorithm chooses them as victims
+# -----------------------------------------------------------------------
+
+import os
+import threading
+
+import common_db
+from common_db import BLOCK_SIZE
+
+DEFAULT_NUM_OF_FRAMES = 256  # 256 frames, namely 1MB of cached blocks
+
+
+class BufferPool(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       num_of_frames: how many blocks can be cached at the same time
+    # -------------------------------------
+    def __init__(self, num_of_frames=DEFAULT_NUM_OF_FRAMES):
+        self.num_of_frames = num_of_frames
+        self.frames = [bytearray(BLOCK_SIZE) for i in range(num_of_frames)]
+        self.frame_page = [None] * num_of_frames  # the (file_name, block_id) held by each frame
+        self.pin_count = [0] * num_of_frames
+        self.dirty = [False] * num_of_frames
+        self.ref_bit = [False] * num_of_frames  # second chance bit of the clock algorithm
+        self.page_table = {}  # (file_name, block_id) -> frame id
+        self.free_frames = list(range(num_of_frames - 1, -1, -1))
+        self.clock_hand = 0
+
+        self.files = {}  # file_name -> [f_handle, ref_count]
+
+        self.num_of_hits = 0
+        self.num_of_misses = 0
+
+        self._lock = threading.RLock()
+
+    # ------------------------------
+    # open a file through the pool, the file must exist
+    # input:
+    #       file_name
+    # output:
+    #       the file handle shared by every user of the file
+    # -------------------------------------
+    def open_file(self, file_name):
+        with self._lock:
+            if file_name in self.files:
+                self.files[file_name][1] += 1
+            else:
+                self.files[file_name] = [open(file_name, 'rb+'), 1]
+            return self.files[file_name][0]
+
+    # ------------------------------
+    # release a file, the last user writes back its dirty pages and closes it
+    # -------------------------------------
+    def close_file(self, file_name):
+        with self._lock:
+            if file_name not in self.files:
+                return
+            self.files[file_name][1] -= 1
+            if self.files[file_name][1] > 0:
+                return
+            self.flush_file(file_name)
+            self._drop_pages(file_name)
+            self.files.pop(file_name)[0].close()
+
+    # ------------------------------
+    # forget a file without writing back its pages, e.g. before it is removed
+    # -------------------------------------
+    def discard_file(self, file_name):
+        with self._lock:
+            self._drop_pages(file_name)
+            if file_name in self.files:
+                self.files.pop(file_name)[0].close()
+
+    # ------------------------------
+    # the number of blocks of a file, including cached blocks not yet written
+    # -------------------------------------
+    def block_count(self, file_name):
+        with self._lock:
+            f_handle = self.files[file_name][0]
+            num_of_blocks = (os.fstat(f_handle.fileno()).st_size + BLOCK_SIZE - 1) // BLOCK_SIZE
+            for (name, block_id) in self.page_table:
+                if name == file_name and block_id >= num_of_blocks:
+                    num_of_blocks = block_id + 1
+            return num_of_blocks
+
+    # ------------------------------
+    # pin a page in the pool, reading it from the file if it is not cached
+    # a block beyond the end of the file is returned as zeros
+    # input:
+    #       file_name, block_id
+    # output:
+    #       the frame (bytearray), which stays valid until the page is unpinned
+    # -------------------------------------
+    def fetch_page(self, file_name, block_id):
+        with self._lock:
+            page = (file_name, block_id)
+            frame_id = self.page_table.get(page)
+            if frame_id is not None:
+                self.num_of_hits += 1
+            else:
+                self.num_of_misses += 1
+                frame_id = self._allocate_frame()
+                frame = self.frames[frame_id]
+
+                f_handle = self.files[file_name][0]
+                f_handle.seek(block_id * BLOCK_SIZE)
+                data = f_handle.read(BLOCK_SIZE)
+                frame[:len(data)] = data
+                frame[len(data):] = bytes(BLOCK_SIZE - len(data))
+
+                self.frame_page[frame_id] = page
+                self.dirty[frame_id] = False
+                self.page_table[page] = frame_id
+
+            self.pin_count[frame_id] += 1
+            self.ref_bit[frame_id] = True
+            return self.frames[frame_id]
+
+    # ------------------------------
+    # unpin a page
+    # input:
+    #       file_name, block_id
+    #       is_dirty: whether the caller has changed the frame
+    # -------------------------------------
+    def unpin_page(self, file_name, block_id, is_dirty=False):
+        with self._lock:
+            frame_id = self.page_table[(file_name, block_id)]
+            if self.pin_count[frame_id] > 0:
+                self.pin_count[frame_id] -= 1
+            if is_dirty:
+                self.dirty[frame_id] = True
+
+    # ------------------------------
+    # whether a frame still holds a page, e.g. a frame kept pinned by its user,
+    # which is given to another page if the file is truncated or discarded
+    # -------------------------------------
+    def holds_page(self, file_name, block_id, frame):
+        with self._lock:
+            frame_id = self.page_table.get((file_name, block_id))
+            return frame_id is not None and self.frames[frame_id] is frame
+
+    # ------------------------------
+    # write a whole block to the file with one write, without taking a frame for it
+    # a cached copy of the block is replaced so that later fetches see the new content
+    # input:
+    #       file_name, block_id
+    #       data: BLOCK_SIZE bytes
+    # -------------------------------------
+    def write_page(self, file_name, block_id, data):
+        with self._lock:
+            frame_id = self.page_table.get((file_name, block_id))
+            if frame_id is not None:
+                self.frames[frame_id][:] = data
+                self.dirty[frame_id] = False
+
+            f_handle = self.files[file_name][0]
+            f_handle.seek(block_id * BLOCK_SIZE)
+            f_handle.write(data)
+
+    # ------------------------------
+    # write all dirty pages of a file back in block order
+    # adjacent blocks are written with one write call and the file is flushed once
+    # input:
+    #       file_name
+    #       sync: whether to fsync the file after writing
+    # -------------------------------------
+    def flush_file(self, file_name, sync=False):
+        with self._lock:
+            if file_name not in self.files:
+                return
+            dirty_pages = sorted((page[1], frame_id) for page, frame_id in self.page_table.items()
+                                 if page[0] == file_name and self.dirty[frame_id])
+            f_handle = self.files[file_name][0]
+
+            i = 0
+            while i < len(dirty_pages):
+                # find the run of adjacent blocks beginning at dirty_pages[i]
+                j = i + 1
+                while j < len(dirty_pages) and dirty_pages[j][0] == dirty_pages[j - 1][0] + 1:
+                    j += 1
+                f_handle.seek(dirty_pages[i][0] * BLOCK_SIZE)
+                f_handle.write(b''.join(self.frames[frame_id] for block_id, frame_id in dirty_pages[i:j]))
+                for block_id, frame_id in dirty_pages[i:j]:
+                    self.dirty[frame_id] = False
+                i = j
+
+            f_handle.flush()
+            if sync:
+                os.fsync(f_handle.fileno())
+
+    # ------------------------------
+    # cut a file down to its first blocks, the cached blocks beyond them are thrown away
+    # input:
+    #       file_name
+    #       num_of_blocks: how many blocks are kept
+    # -------------------------------------
+    def truncate_file(self, file_name, num_of_blocks):
+        with self._lock:
+            self._drop_pages(file_name, num_of_blocks)
+            self.flush_file(file_name)
+            f_handle = self.files[file_name][0]
+            f_handle.truncate(num_of_blocks * BLOCK_SIZE)
+
+    # ------------------------------
+    # write the dirty pages of all open files back
+    # -------------------------------------
+    def flush_all(self):
+        with self._lock:
+            for file_name in list(self.files):
+                self.flush_file(file_name)
+
+    # ------------------------------
+    # find a frame for a new page, evicting an unpinned page with the clock algorithm
+    # -------------------------------------
+    def _allocate_frame(self):
+        if self.free_frames:
+            return self.free_frames.pop()
+
+        for i in range(2 * self.num_of_frames):
+            frame_id = self.clock_hand
+            self.clock_hand = (self.clock_hand + 1) % self.num_of_frames
+
+            if self.pin_count[frame_id] > 0:
+                continue
+            if self.ref_bit[frame_id]:  # give the page a second chance
+                self.ref_bit[frame_id] = False
+                continue
+
+            # the victim is found
+            file_name, block_id = self.frame_page[frame_id]
+            if self.dirty[frame_id]:
+                f_handle = self.files[file_name][0]
+                f_handle.seek(block_id * BLOCK_SIZE)
+                f_handle.write(self.frames[frame_id])
+                self.dirty[frame_id] = False
+            del self.page_table[(file_name, block_id)]
+            self.frame_page[frame_id] = None
+            return frame_id
+
+        raise BufferError('all the frames in the buffer pool are pinned')
+
+    def _drop_pages(self, file_name, first_block_id=0):
+        for page in [page for page in self.page_table if page[0] == file_name and page[1] >= first_block_id]:
+            frame_id = self.page_table.pop(page)
+            self.frame_page[frame_id] = None
+            self.pin_count[frame_id] = 0
+            self.dirty[frame_id] = False
+            self.ref_bit[frame_id] = False
+            self.free_frames.append(frame_id)
+
+
+# ------------------------------------------
+# to get the buffer pool shared by the whole program
+# the pool is created at the first call and stored in common_db.py
+# -------------------------------------------
+def get_buffer_pool():
+    if common_db.global_buffer_pool is None:
+        common_db.global_buffer_pool = BufferPool()
+    return common_db.global_buffer_pool
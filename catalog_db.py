@@ -0,0 +1,247 @@
+# -----------------------------------------------------------------------
+# catalog_db.py
+# -----------------------------------------------------------------------
+# the module keeps the tables which are open in the program
+# each table is opened once and its Storage object is shared by all the users,
+# e.g. the main loop, the query plan and the recovery.
+#
+# a user gets the Storage object of a table with acquire() and gives it back with release().
+# a table stays open when nobody uses it, so the next user finds block 0 and the cached
+# blocks of the table ready. it is closed when it is dropped, invalidated or the program ends
+#
+# the module also keeps the index catalog, namely which fields of the tables are indexed.
+# Storage keeps the indexes in the catalog up to date when the records of a table change
+# -----------------------------------------------------------------------
+
+import atexit
+import os
+import threading
+
+import buffer_db
+import common_db
+import index_db
+import storage_db
+import tool
+
+# the index catalog is a text file, each line of which is "table_name field_name kind",
+# where kind is index_db.INDEX_KIND_BTREE or index_db.INDEX_KIND_HASH, a line without kind is a B+ tree.
+# the field_name of a composite index is its key fields joined by index_db.FIELD_LIST_SEPARATOR, e.g. "dept,name",
+# the fields included in the leaf entries of an index are kept in the index file only
+INDEX_CATALOG_FILE = 'index.cat'.encode('utf-8')
+
+
+class TableRegistry(object):
+
+    # ------------------------------
+    # constructor of the class
+    # -------------------------------------
+    def __init__(self):
+        self.tables = {}  # table name (bytes) -> [Storage object, ref_count]
+        self._lock = threading.RLock()
+
+    # ------------------------------
+    # to get the Storage object of a table, the table is opened at the first call
+    # input:
+    #       tablename
+    #       log_manager: the log manager to record the log, it replaces the one of the open table
+    # output:
+    #       the Storage object, which is not kept if the table cannot be opened.
+    #       it is shared, so a user wanting a memory map asks for it in scan()
+    # -------------------------------------
+    def acquire(self, tablename, log_manager=None):
+        tablename = tool.tryToBytes(tablename).strip()
+        with self._lock:
+            if tablename not in self.tables:
+                storage = storage_db.Storage(tablename, log_manager)
+                if not storage.open:
+                    return storage
+                self.tables[tablename] = [storage, 0]
+
+            entry = self.tables[tablename]
+            entry[1] += 1
+            if log_manager is not None:
+                entry[0].log_manager = log_manager
+            return entry[0]
+
+    # ------------------------------
+    # to give back the Storage object got by acquire(), the table stays open
+    # -------------------------------------
+    def release(self, tablename):
+        tablename = tool.tryToBytes(tablename).strip()
+        with self._lock:
+            if tablename in self.tables and self.tables[tablename][1] > 0:
+                self.tables[tablename][1] -= 1
+
+    # ------------------------------
+    # to close a table, e.g. before its file is replaced
+    # the next acquire() opens the table again
+    # -------------------------------------
+    def invalidate(self, tablename):
+        tablename = tool.tryToBytes(tablename).strip()
+        with self._lock:
+            entry = self.tables.pop(tablename, None)
+            if entry is not None:
+                entry[0].close()
+
+    # ------------------------------
+    # to drop the data of a table, the table is closed and its file is removed
+    # output:
+    #       True or False
+    # -------------------------------------
+    def drop(self, tablename):
+        tablename = tool.tryToBytes(tablename).strip()
+        with self._lock:
+            entry = self.tables.pop(tablename, None)
+            if entry is None and not os.path.exists(tablename + '.dat'.encode('utf-8')):
+                return True  # there is no data
+            storage = entry[0] if entry is not None else storage_db.Storage(tablename)
+            result = storage.delete_table_data(tablename)
+            get_index_catalog().drop_indexes(tablename)
+            return result
+
+    # ------------------------------
+    # to close all the tables, when the program ends
+    # -------------------------------------
+    def close_all(self):
+        with self._lock:
+            for storage, ref_count in self.tables.values():
+                storage.close()
+            self.tables.clear()
+
+
+class IndexCatalog(object):
+
+    # ------------------------------
+    # constructor of the class, the catalog file is read if it exists
+    # input:
+    #       file_name: the catalog file
+    # -------------------------------------
+    def __init__(self, file_name=INDEX_CATALOG_FILE):
+        self.file_name = file_name
+        self.indexes = {}  # table name (bytes) -> list of the indexed field names (bytes)
+        self.kinds = {}  # (table name, field name) -> the kind of the index
+        self.version = 0  # changed whenever an index is added or removed, see Storage._get_indexes()
+        self._lock = threading.RLock()
+        if os.path.exists(self.file_name):
+            with open(self.file_name, 'rb') as f_handle:
+                for line in f_handle.read().split(b'\n'):
+                    if line.strip():
+                        words = line.split()
+                        tablename, field_name = words[:2]
+                        self.indexes.setdefault(tablename, []).append(field_name)
+                        self.kinds[(tablename, field_name)] = words[2] if len(words) > 2 else index_db.INDEX_KIND_BTREE
+
+    # ------------------------------
+    # to write the catalog into a temporary file, which then replaces the catalog file,
+    # so that a crash leaves either the old catalog or the new one
+    # -------------------------------------
+    def _save(self):
+        tmp_file_name = self.file_name + '.tmp'.encode('utf-8')
+        with open(tmp_file_name, 'wb') as f_handle:
+            f_handle.write(b''.join(tablename + b' ' + field_name + b' ' + self.kinds[(tablename, field_name)] + b'\n'
+                                    for tablename in sorted(self.indexes) for field_name in self.indexes[tablename]))
+            f_handle.flush()
+            os.fsync(f_handle.fileno())
+        os.replace(tmp_file_name, self.file_name)
+        self.version += 1
+
+    # ------------------------------
+    # the indexed fields of a table
+    # output:
+    #       list of field names (bytes)
+    # -------------------------------------
+    def indexed_fields(self, tablename):
+        with self._lock:
+            return list(self.indexes.get(tool.tryToBytes(tablename).strip(), []))
+
+    # ------------------------------
+    # the kind of the index on a field
+    # output:
+    #       index_db.INDEX_KIND_BTREE or index_db.INDEX_KIND_HASH, or None if the field is not indexed
+    # -------------------------------------
+    def index_kind(self, tablename, field_name):
+        with self._lock:
+            return self.kinds.get((tool.tryToBytes(tablename).strip(), _index_name(field_name)))
+
+    # ------------------------------
+    # to record an index on a field, the index file should have been made with create_index()
+    # an index of the other kind on the field is replaced and its file is removed
+    # input:
+    #       tablename, field_name
+    #       kind: index_db.INDEX_KIND_BTREE or index_db.INDEX_KIND_HASH
+    # output:
+    #       True, or False if the field is indexed already, namely the index has been made again
+    # -------------------------------------
+    def add_index(self, tablename, field_name, kind=index_db.INDEX_KIND_BTREE):
+        tablename = tool.tryToBytes(tablename).strip()
+        field_name = _index_name(field_name)
+        with self._lock:
+            if field_name in self.indexes.get(tablename, []):
+                old_kind = self.kinds[(tablename, field_name)]
+                if old_kind == kind:
+                    self.version += 1  # the open indexes of the table are opened again
+                    return False
+                self.kinds[(tablename, field_name)] = kind
+                self._save()
+                self._remove_index_file(tablename, field_name, old_kind)
+                return False
+            self.indexes.setdefault(tablename, []).append(field_name)
+            self.kinds[(tablename, field_name)] = kind
+            self._save()
+            return True
+
+    # ------------------------------
+    # to remove the indexes of a table and their files, e.g. when the table is dropped
+    # input:
+    #       tablename
+    #       field_name: the index to remove, None for all the indexes of the table
+    # -------------------------------------
+    def drop_indexes(self, tablename, field_name=None):
+        tablename = tool.tryToBytes(tablename).strip()
+        with self._lock:
+            fields = self.indexes.get(tablename, [])
+            dropped = [name for name in fields if field_name is None or name == _index_name(field_name)]
+            if not dropped:
+                return
+            self.indexes[tablename] = [name for name in fields if name not in dropped]
+            if not self.indexes[tablename]:
+                del self.indexes[tablename]
+            for name in dropped:
+                kind = self.kinds.pop((tablename, name))
+                self._remove_index_file(tablename, name, kind)
+            self._save()
+
+    def _remove_index_file(self, tablename, field_name, kind):
+        index_file_name = index_db.index_file_name(tablename, field_name, kind)
+        buffer_db.get_buffer_pool().discard_file(index_file_name)
+        if os.path.exists(index_file_name):
+            os.remove(index_file_name)
+
+
+# ------------------------------------------
+# the name of an index in the catalog, namely its key fields joined by index_db.FIELD_LIST_SEPARATOR
+# -------------------------------------------
+def _index_name(field_name):
+    return index_db.FIELD_LIST_SEPARATOR.join(index_db.index_field_names(field_name))
+
+
+# ------------------------------------------
+# to get the table registry shared by the whole program
+# the registry is created at the first call and stored in common_db.py
+# -------------------------------------------
+def get_table_registry():
+    if common_db.global_table_registry is None:
+        common_db.global_table_registry = TableRegistry()
+        # the tables are closed before the files of the buffer pool go away
+        atexit.register(common_db.global_table_registry.close_all)
+    return common_db.global_table_registry
+
+
+# ------------------------------------------
+# to get the index catalog shared by the whole program
+# the catalog is read at the first call and stored in common_db.py
+# -------------------------------------------
+def get_index_catalog():
+    if common_db.global_index_catalog is None:
+        common_db.global_index_catalog = IndexCatalog()
+    return common_db.global_index_catalog
@@ -12,6 +12,12 @@ global_lexer = None  # the global lex, which is filled in the module lex_db.py
 global_parser = None  # the global yacc, which is filled in the module yacc_db.py
 global_syn_tree = None  # the global syntax tree, which is filled in parser_db.py
 global_logical_tree = None  # global variable, which is to store the logical query plan tree
+global_buffer_pool = None  # the buffer pool shared by all table files, which is filled in the module buffer_db.py
+global_table_registry = None  # the tables open in the program, which is filled in the module catalog_db.py
+global_index_catalog = None  # the indexed fields of the tables, which is filled in the module catalog_db.py
+global_uncommitted_deletes = {}  # (file_name, block_id, slot_id) -> id of the transaction which deleted the record, see storage_db.py
+global_schema_version = 0  # changed whenever the table schemas change, which is done in the module schema_db.py
+global_plan_cache = None  # the plans of the latest queries, which is filled in the module query_plan_db.py
 
 
 # -----------------------------
@@ -18,8 +18,10 @@ class Header(object):
     #                    a list of fields and each field is a tuple(fieldname,fieldtype,fieldlength
     #   inLen       : number of tables
     #   off         : where the free space begins in body of the schema file
+    #   keyDict     : key dictionary for the tables with key fields and each element is (tablename, (primaryKey, uniqueFields))
+    #                    where primaryKey is the number of the primary key field and uniqueFields is a list of field numbers
     #---------------------------------------------------------------
-    def __init__(self,nameList,fieldDict,inistored, inLen, off):
+    def __init__(self,nameList,fieldDict,inistored, inLen, off, keyDict=None):
         'constructor of Header'
         print ('__init__ of Header')
           
@@ -28,6 +30,7 @@ class Header(object):
         self.offsetOfBody=off
         self.tableNames=nameList
         self.tableFields=fieldDict
+        self.tableKeys=keyDict if keyDict is not None else {}
 
         print ("isStore is ",self.isStored," tableNum is ",self.lenOfTableNum," offset is ",self.offsetOfBody)
         
@@ -7,10 +7,31 @@ import struct
 
 # The 0 block stores the meta information of the tree
 '''
-block_id|has_root|num_of_levels|root_node_ptr
+block_id|has_root|num_of_levels|root_node_ptr|key_type|key_len|num_of_key_fields|num_of_include_fields|field_0|...
 # note: the root_node_ptr is a block id
+#       key_type is the type of the indexed field (0->str,1->varstr,2->int,3->bool), see make_key()
+#       key_len is 0 in the index files made before the key types, whose keys are KEY_TYPE_LEGACY
+#       key_len is VARIABLE_KEY_LEN in a prefix-compressed index, whose keys have variable lengths
+#       field_i is (field name,field type,field length), the key fields come first and the included fields follow.
+#       the index files made before the composite indexes have no fields, they index one field
 '''
 MAX_NUM_OF_KEYS=200#the number of keys in each block
+LEN_OF_KEY=10 # a key takes 10 bytes, a shorter key is padded with zeros and a longer one is cut
+
+# the keys are compared as bytes, so a key is made from the value by the type of the field,
+# in such a way that the keys are in the same order as the values
+#   str and varstr: the bytes of the value
+#   int: 8 bytes big-endian, with the sign bit flipped so that the negative values come first
+#   bool: one byte, 0 or 1
+# KEY_TYPE_LEGACY keys are made by turning the value into str, which keeps the order of str values only
+KEY_TYPE_LEGACY=-1
+INT_KEY_BIAS=1<<63 # added to an int value to flip its sign bit
+
+# an index may have several key fields, its key is the keys of the fields one after another,
+# LEN_OF_KEY bytes each, so the entries are in the order of the first field, then the second one...
+# it may also include the values of other fields in its leaf entries, so that a query reading only
+# the fields of the index is answered from the leaf nodes without the data blocks, see covered_fields()
+FIELD_LIST_SEPARATOR=','.encode('utf-8') # the key fields of a composite index are written as 'field_1,field_2'
 
 
 
@@ -18,44 +39,370 @@ MAX_NUM_OF_KEYS=200#the number of keys in each block
 '''
 block_id|node_type|number_of_keys|key_0|ptr_0|...|key_i|ptr_i|...|key_n|ptr_n|...free space...|last_ptr
 note: for leaf node, ptr is a block id+entry id (8 bytes) except for the last one
+      the last one is the block id of the next leaf node, so the leaf nodes make a chain in key order
+      the ptr of an index with included fields is followed by their values, packed as RECORD_FORMAT_BINARY
 '''
 LEAF_NODE_TYPE=1
-LEN_OF_LEAF_NODE=10+4+4  # key takes 10 bytes, block_id takes 4 bytes and offset takes 4 bytes
+LEN_OF_LEAF_NODE=10+4+4  # key takes 10 bytes, block_id takes 4 bytes and offset takes 4 bytes, for one key field
 
 
 # structure of internal node
 '''
 block_id|node_type|number_of_keys|key_0|ptr_0|key_1|ptr_1|...|key_n|ptr_n|...free space...|last_ptr|
-note: For internal node, ptr is just a block id( 4 bytes) 
+note: For internal node, ptr is just a block id( 4 bytes)
+      ptr_i points to the node of the keys before key_i, and last_ptr to the node of the keys from key_n on.
+      when a node is split, the first key of the new right node goes up as the key between them,
+      equal keys may lie on both sides of it
 '''
 INTERNAL_NODE_TYPE=0
+LEN_OF_INTERNAL_NODE=10+4  # key takes 10 bytes and block_id takes 4 bytes, for one key field
+
+
+# structure of the nodes of a prefix-compressed index, both leaf and internal ones
+'''
+block_id|node_type|number_of_keys|anchor_len|entries_begin|anchor|slot_0|...|slot_n|...free space...|entry_n|...|entry_0|last_ptr
+entry: suffix_len|suffix|ptr
+note: the keys have variable lengths, see make_key(), and all the keys of a node begin with its anchor,
+      the common prefix of the first key and the last one, so only the rest of a key (suffix) is kept.
+      slot_i is the offset of entry i in the block, the slots are in key order so a key is found by
+      binary search over them. the entries are put from the end of the block towards the slots,
+      entries_begin is the offset of the lowest one. a deleted entry leaves a hole, which is given back
+      when the node is packed again. the ptrs are the same as those of the other nodes
+'''
+VARIABLE_KEY_LEN=-1 # the key_len in block 0 of a prefix-compressed index
+MAX_LEN_OF_VAR_KEY=200 # a str value takes at most 200 bytes of a variable-length key, a longer one is cut
 
 
 SPECIAL_INDEX_BLOCK_PTR=-1 # this is the last ptr for last leaf node when the next node is unknown
 
+DEFAULT_FILL_FACTOR=0.9 # how full create_index() makes the nodes, the space left is for later inserts
+SORT_RUN_SIZE=200000 # how many index entries create_index() sorts in main memory at a time
+MERGE_FAN_IN=64 # how many sorted runs are merged at a time, so that few temporary files are open
+
+# the internal nodes of the upper levels of an open index stay pinned in the buffer pool,
+# so that a search or an insert only has to read the lower nodes, usually just the leaf node.
+# the meta information of block 0 is kept in the Index object
+PINNED_LEVELS=2 # the root is level 0
+MAX_PINNED_NODES=32 # the most frames pinned by one index, the pool has to keep room for the others
+
+# several threads may use one Index object at the same time, each node has a read/write latch, see NodeLatch.
+# a thread going down the tree takes the latch of a child before it gives back that of the parent
+# (latch crabbing), so a node cannot be split between the two. readers and the inserts which fit in
+# their leaf node latch the internal nodes for read. an insert which splits nodes goes down again with
+# write latches, and gives back the latches above a node as soon as the node has room for one more entry,
+# so the split cannot go up beyond it. the meta information has a latch too, it is taken before the root.
+# the latches are taken from the root down and from left to right in the leaf chain, so there is no deadlock.
+# create_index() and close() are not run together with the other operations
+
+
+# the kinds of index on a field, they are kept in different files, see index_file_name()
+INDEX_KIND_BTREE='btree'.encode('utf-8')
+INDEX_KIND_HASH='hash'.encode('utf-8')
+
+# structure of the hash index file, see HashIndex
+'''
+block 0: block_id|global_depth|number_of_blocks|free_block_ptr|key_type|key_len|number_of_dir_blocks|dir_block_ptr_0|...
+directory block: bucket_ptr_0|bucket_ptr_1|...
+bucket: block_id|local_depth|number_of_entries|key_0|ptr_0|...|key_n|ptr_n|...free space...|overflow_ptr
+note: the directory has 2**global_depth bucket ptrs, a key goes to the bucket of the low global_depth bits
+      of its hash. the entries of a bucket are the same as those of a leaf node, but they are not in order.
+      a full bucket whose keys cannot be told apart by more bits gets an overflow bucket, and the
+      overflow buckets follow it in a chain through overflow_ptr. the freed blocks make a chain from free_block_ptr
+'''
+MAX_GLOBAL_DEPTH=18 # the directory has at most 2**18 bucket ptrs, namely 256 directory blocks
+
 
 
 import os
+import bisect
+import heapq
+import tempfile
+import threading
+import zlib
 import common_db
-import ctypes
+import buffer_db
+import catalog_db
+import storage_db
+import tool
+
+META_STRUCT=struct.Struct('!i?iiii') # block_id,has_root,number of levels,root_node_ptr(block_id),key_type,key_len
+META_FIELDS_STRUCT=struct.Struct('!ii') # number of key fields,number of included fields
+META_FIELD_STRUCT=struct.Struct('!10sii') # field name,field type,field length, the same as in the schema
+INT_KEY_STRUCT=struct.Struct('!Q')
+NODE_HEAD_STRUCT=struct.Struct('!iii') # block_id,node_type,number_of_keys
+LEAF_ENTRY_STRUCT=struct.Struct('!'+str(LEN_OF_KEY)+'sii')
+INTERNAL_ENTRY_STRUCT=struct.Struct('!'+str(LEN_OF_KEY)+'si')
+LAST_PTR_STRUCT=struct.Struct('!i')
+LAST_PTR_OFFSET=common_db.BLOCK_SIZE-LAST_PTR_STRUCT.size
+KEY_STRUCT=struct.Struct('!'+str(LEN_OF_KEY)+'s')
+COMPRESSED_HEAD_STRUCT=struct.Struct('!iiiHH') # block_id,node_type,number_of_keys,anchor_len,entries_begin
+SLOT_STRUCT=struct.Struct('!H')
+SUFFIX_LEN_STRUCT=struct.Struct('!H') # also the length of a key in the sorted runs of a prefix-compressed index
+CHILD_PTR_STRUCT=struct.Struct('!i')
+ENTRIES_STRUCTS={} # (format of one entry,number of entries) -> struct of the entries, see entries_struct()
+HASH_META_STRUCT=struct.Struct('!iiiiiii') # block_id,global_depth,number_of_blocks,free_block_ptr,key_type,key_len,number_of_dir_blocks
+DIR_PTR_STRUCT=struct.Struct('!i')
+DIR_PTRS_PER_BLOCK=common_db.BLOCK_SIZE//DIR_PTR_STRUCT.size
+BUCKET_CAPACITY=(common_db.BLOCK_SIZE-NODE_HEAD_STRUCT.size-LAST_PTR_STRUCT.size)//LEN_OF_LEAF_NODE
+
+
+#------------------------------------
+# the struct of the entries of a node, so that they are packed or unpacked in one call
+# the values are key_0,ptr_0,key_1,ptr_1,... and a leaf ptr takes two values, block_id and offset,
+# or three values if the index has included fields
+# input
+#       entry_struct: the struct of one entry, e.g. LEAF_ENTRY_STRUCT
+#       num_of_entries
+#-----------------------------------------
+def entries_struct(entry_struct,num_of_entries):
+    entries=ENTRIES_STRUCTS.get((entry_struct.format,num_of_entries))
+    if entries is None:
+        entries=ENTRIES_STRUCTS[(entry_struct.format,num_of_entries)]=struct.Struct('!'+entry_struct.format[1:]*num_of_entries)
+    return entries
+
+
+#------------------------------------
+# the read/write latch of a node, many readers or one writer hold it at a time.
+# a waiting writer keeps new readers out, so that the inserts are not starved by the searches
+#-----------------------------------------
+class NodeLatch(object):
+    def __init__(self):
+        self.condition=threading.Condition(threading.Lock())
+        self.num_of_readers=0
+        self.num_of_waiting_writers=0
+        self.writing=False
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writing or self.num_of_waiting_writers>0:
+                self.condition.wait()
+            self.num_of_readers+=1
+
+    def release_read(self):
+        with self.condition:
+            self.num_of_readers-=1
+            if self.num_of_readers==0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.num_of_waiting_writers+=1
+            while self.writing or self.num_of_readers>0:
+                self.condition.wait()
+            self.num_of_waiting_writers-=1
+            self.writing=True
+
+    def release_write(self):
+        with self.condition:
+            self.writing=False
+            self.condition.notify_all()
+
+
+#------------------------------------
+# the keys of a node in a pinned block, a key is decoded only when it is asked for,
+# so that bisect decodes only the keys it compares, about log2(number of keys) of them
+#-----------------------------------------
+class NodeKeys(object):
+    def __init__(self,node_block,num_of_keys,entry_size,key_struct=KEY_STRUCT):
+        self.node_block=node_block
+        self.num_of_keys=num_of_keys
+        self.entry_size=entry_size
+        self.key_struct=key_struct
+
+    def __len__(self):
+        return self.num_of_keys
+
+    def __getitem__(self,i):
+        return self.key_struct.unpack_from(self.node_block,NODE_HEAD_STRUCT.size+i*self.entry_size)[0]
+
+
+#------------------------------------
+# the keys of a node of a prefix-compressed index, for bisect like NodeKeys.
+# they are the suffixes of the keys, so the key searched for should begin with the anchor
+#-----------------------------------------
+class CompressedNodeKeys(object):
+    def __init__(self,node_block,num_of_keys):
+        self.node_block=node_block
+        self.num_of_keys=num_of_keys
+        anchor_len=COMPRESSED_HEAD_STRUCT.unpack_from(node_block,0)[3]
+        self.anchor=bytes(node_block[COMPRESSED_HEAD_STRUCT.size:COMPRESSED_HEAD_STRUCT.size+anchor_len])
+        # the slots are unpacked in one call, the suffixes only when they are asked for
+        self.slots=entries_struct(SLOT_STRUCT,num_of_keys).unpack_from(node_block,COMPRESSED_HEAD_STRUCT.size+anchor_len)
+
+    def __len__(self):
+        return self.num_of_keys
+
+    def __getitem__(self,i):
+        offset=self.slots[i]
+        suffix_len,=SUFFIX_LEN_STRUCT.unpack_from(self.node_block,offset)
+        return self.node_block[offset+SUFFIX_LEN_STRUCT.size:offset+SUFFIX_LEN_STRUCT.size+suffix_len]
+
+    # the whole entry i, (key,ptr values...), the ptr is unpacked by ptr_struct
+    def entry(self,i,ptr_struct):
+        offset=self.slots[i]
+        suffix_len,=SUFFIX_LEN_STRUCT.unpack_from(self.node_block,offset)
+        offset+=SUFFIX_LEN_STRUCT.size
+        return (self.anchor+bytes(self.node_block[offset:offset+suffix_len]),)+ptr_struct.unpack_from(self.node_block,offset+suffix_len)
+
+
+#------------------------------------
+# the common prefix of two keys
+#-----------------------------------------
+def common_prefix(key_1,key_2):
+    i=0
+    n=min(len(key_1),len(key_2))
+    while i<n and key_1[i]==key_2[i]:
+        i+=1
+    return key_1[:i]
+
+
+#------------------------------------
+# the key fields of an index
+# input
+#       index_field: a field name, the field names joined by FIELD_LIST_SEPARATOR, a list of field names, or None
+# output
+#       list of field names (bytes), which is empty for None
+#-----------------------------------------
+def index_field_names(index_field):
+    if not index_field:
+        return []
+    if not isinstance(index_field,(list,tuple)):
+        index_field=tool.tryToBytes(index_field).split(FIELD_LIST_SEPARATOR)
+    return [tool.tryToBytes(name).strip() for name in index_field if tool.tryToBytes(name).strip()]
+
+
+#------------------------------------
+# the name of the index file on a field of a table
+# input
+#       tablename
+#       index_field: the field name, or None for the index file of the table, see index_field_names()
+#                    the key fields of a composite index are joined by '+' in the file name
+#       kind: INDEX_KIND_BTREE (.ind) or INDEX_KIND_HASH (.hsh)
+#-----------------------------------------
+def index_file_name(tablename,index_field=None,kind=INDEX_KIND_BTREE):
+    tablename=tool.tryToBytes(tablename).strip()
+    suffix='.hsh'.encode('utf-8') if kind==INDEX_KIND_HASH else '.ind'.encode('utf-8')
+    if not index_field:
+        return tablename+suffix
+    return tablename+'_'.encode('utf-8')+'+'.encode('utf-8').join(index_field_names(index_field))+suffix
+
+
+#------------------------------------
+# the kind of the index on a field, found by its file
+# output
+#       INDEX_KIND_HASH, INDEX_KIND_BTREE, or None if the field has no index file
+#-----------------------------------------
+def index_kind(tablename,index_field):
+    for kind in (INDEX_KIND_HASH,INDEX_KIND_BTREE):
+        if os.path.exists(index_file_name(tablename,index_field,kind)):
+            return kind
+    return None
+
+
+#------------------------------------
+# to open the index on a field
+# input
+#       kind: INDEX_KIND_BTREE or INDEX_KIND_HASH, None to find it by the index file
+#       include_fields, compressed: see Index, a hash index has no included fields and is not compressed
+# output
+#       the Index or HashIndex object
+#-----------------------------------------
+def open_index(tablename,index_field,kind=None,include_fields=None,compressed=None):
+    if kind is None:
+        kind=index_kind(tablename,index_field)
+    if kind==INDEX_KIND_HASH:
+        if len(index_field_names(index_field))!=1 or include_fields or compressed:
+            raise ValueError('a hash index has one key field, no included fields and no compressed nodes')
+        return HashIndex(tablename,index_field)
+    return Index(tablename,index_field,include_fields,compressed)
+
+
+#------------------------------------
+# to turn a field value into a key of the index, padded with zeros to LEN_OF_KEY bytes
+# input
+#       field_value: bytes, str, int or bool
+#       key_type: the type of the field, or KEY_TYPE_LEGACY
+#       variable: whether the key is for a prefix-compressed index, then it is not padded:
+#                 an int takes 8 bytes, a bool one byte, and a str value at most MAX_LEN_OF_VAR_KEY bytes
+#                 followed by a zero byte, so that a shorter str comes before the longer ones beginning with it
+#-----------------------------------------
+def make_key(field_value,key_type=KEY_TYPE_LEGACY,variable=False):
+    if key_type==2: # an int out of 8 bytes takes the smallest or greatest key
+        field_value=INT_KEY_STRUCT.pack(min(max(int(field_value),-INT_KEY_BIAS),INT_KEY_BIAS-1)+INT_KEY_BIAS)
+    elif key_type==3:
+        field_value=b'\x01' if field_value else b'\x00'
+    else:
+        if isinstance(field_value,(bool,int)):
+            field_value=str(field_value)
+        if variable:
+            return tool.tryToBytes(field_value).rstrip(b'\x00')[:MAX_LEN_OF_VAR_KEY]+b'\x00'
+        field_value=tool.tryToBytes(field_value)[:LEN_OF_KEY]
+    if variable:
+        return field_value
+    return field_value.ljust(LEN_OF_KEY,b'\x00')
+
 
-def test():
-    my_dict={}
-    my_dict.setdefault('one',80)
-    my_dict.setdefault('two',90)
-    my_dict.setdefault('aaa',90)
-    print (my_dict.keys())
-    print (my_dict.items())
-    for my_each_key in sorted(my_dict):
-        print ("the value of key ",my_each_key," is ",my_dict[my_each_key])
+#------------------------------------
+# whether make_key() loses a part of a field value, so that other values have the same key
+#-----------------------------------------
+def is_key_cut(field_value,key_type=KEY_TYPE_LEGACY,variable=False):
+    if key_type==2:
+        return not -INT_KEY_BIAS<=int(field_value)<INT_KEY_BIAS
+    if key_type==3:
+        return False
+    if isinstance(field_value,(bool,int)):
+        field_value=str(field_value)
+    if variable:
+        return len(tool.tryToBytes(field_value).rstrip(b'\x00'))>MAX_LEN_OF_VAR_KEY
+    return len(tool.tryToBytes(field_value))>LEN_OF_KEY
 
-    my_list=[]
-    my_tuple=(1,2)
-    my_list.append(my_tuple)
-    (a,b)=my_list[0]
 
-    print (a,b)
-    
+#------------------------------------
+# the most bytes a key field takes in a variable-length key, see make_key()
+# input
+#       field: (field name,field type,field length)
+#-----------------------------------------
+def variable_key_len(field):
+    if field[1]==2:
+        return INT_KEY_STRUCT.size
+    if field[1]==3:
+        return 1
+    if field[1] in (0,1) and field[2]>0:
+        return min(field[2],MAX_LEN_OF_VAR_KEY)+1
+    return MAX_LEN_OF_VAR_KEY+1
+
+
+#------------------------------------
+# the type of a field of a table, which is the key type of the index on the field
+# output
+#       the field type, or KEY_TYPE_LEGACY if the table or the field does not exist
+#-----------------------------------------
+def field_key_type(tablename,index_field):
+    return table_fields(tablename,[index_field])[0][1]
+
+
+#------------------------------------
+# the fields of a table by their names
+# input
+#       tablename
+#       field_names: list of field names
+# output
+#       list of (field name,field type,field length), a field which does not exist is (field name,KEY_TYPE_LEGACY,0)
+#-----------------------------------------
+def table_fields(tablename,field_names):
+    field_names=[tool.tryToBytes(name).strip() for name in field_names]
+    fields={}
+    if os.path.exists(tool.tryToBytes(tablename).strip()+'.dat'.encode('utf-8')): # Storage would ask for the fields of a new table
+        registry=catalog_db.get_table_registry()
+        storage=registry.acquire(tablename)
+        try:
+            if storage.open:
+                for field in storage.getFieldList():
+                    fields[tool.tryToBytes(field[0]).strip()]=(field[1],field[2])
+        finally:
+            registry.release(tablename)
+    return [(name,)+fields.get(name,(KEY_TYPE_LEGACY,0)) for name in field_names]
+
 
 
 class Index(object):
@@ -63,40 +410,222 @@ class Index(object):
     # constructor of the class
     # input
     #       tablename : the table to be indexed
+    #       index_field : the field to be indexed, or the key fields of a composite index, see index_field_names()
+    #       include_fields : the fields whose values are kept in the leaf entries, see index_field_names(),
+    #                        None for those of the index file. if they are not those of the index file,
+    #                        the index is taken as empty until it is made again by create_index()
+    #       compressed : whether the nodes are prefix-compressed with variable-length keys, None for that of
+    #                    the index file, or False for a new one. it is taken like include_fields if it changes
     #-----------------------------------------
-    def __init__(self,tablename):
+    def __init__(self,tablename,index_field=None,include_fields=None,compressed=None):
 
         print ("__init__ of ",Index.__name__)
-        tablename.strip()
-        if  not os.path.exists(tablename+'.ind'): # in this case, the index file does not exist
-            
-            print ('index file '+tablename+'.ind does not exist')
-            self.f_handle=open(tablename+'.ind','wb+')
-            print (tablename+'.ind has been created')
-            
-        else: # the index file exists and we read its first block
-            
-            self.f_handle=open(tablename+'.ind','rb+')
-            print ('index file '+tablename+'.ind has been opened')
-            self.open=True
+        self.table_name=tool.tryToBytes(tablename).strip()
+        key_field_names=index_field_names(index_field)
+        self.index_field=FIELD_LIST_SEPARATOR.join(key_field_names) if key_field_names else None
+        self.file_name=index_file_name(self.table_name,self.index_field)
+        if  not os.path.exists(self.file_name): # in this case, the index file does not exist
+
+            print ('index file '+self.file_name.decode('utf-8')+' does not exist')
+            self.f_handle=open(self.file_name,'wb+')
+            self.f_handle.close()
+            print (self.file_name.decode('utf-8')+' has been created')
 
-            self.first_block_buf=ctypes.create_string_buffer(common_db.BLOCK_SIZE)
-            self.f_handle.seek(0)
-            self.first_block_buf=self.f_handle.read(common_db.BLOCK_SIZE)
+        # the nodes are read and written through the shared buffer pool
+        self.pool=buffer_db.get_buffer_pool()
+        self.f_handle=self.pool.open_file(self.file_name)
+        print ('index file '+self.file_name.decode('utf-8')+' has been opened')
+        self.open=True
+        self.pinned_nodes={} # block_id -> frame of the pinned internal nodes, see fetch_node()
+        self.pin_lock=threading.Lock() # for pinned_nodes
+        self.meta_latch=NodeLatch() # for has_root,num_of_levels and root_node_ptr
+        self.node_latches={} # block_id -> NodeLatch, see node_latch()
+        self.latch_table_lock=threading.Lock()
+        self.allocate_lock=threading.Lock()
+        self.next_new_block=0 # the blocks before it have been given out by allocate_block()
 
-            
+        # the meta information in block 0
+        if self.pool.block_count(self.file_name)==0: # there is no data in the index file
+            self.has_root=False
+            self.num_of_levels=0
+            self.root_node_ptr=SPECIAL_INDEX_BLOCK_PTR
+            # the keys of a new index are made by the types of the fields
+            self.set_fields(table_fields(self.table_name,key_field_names),
+                            table_fields(self.table_name,index_field_names(include_fields)),bool(compressed))
+        else:
+            meta_index_block=self.pool.fetch_page(self.file_name,0)
+            temp_block_id,self.has_root,self.num_of_levels,self.root_node_ptr,key_type,key_len=META_STRUCT.unpack_from(meta_index_block,0)
+            num_of_key_fields,num_of_include_fields=META_FIELDS_STRUCT.unpack_from(meta_index_block,META_STRUCT.size)
+            fields=[META_FIELD_STRUCT.unpack_from(meta_index_block,META_STRUCT.size+META_FIELDS_STRUCT.size+i*META_FIELD_STRUCT.size)
+                    for i in range(num_of_key_fields+num_of_include_fields)]
+            self.pool.unpin_page(self.file_name,0)
+            fields=[(name.rstrip(b'\x00').strip(),field_type,field_length) for name,field_type,field_length in fields]
+            if num_of_key_fields==0: # an index file made before the composite indexes, on one field
+                fields=[(self.index_field or b'',key_type,0)]
+                num_of_key_fields=1
+            if key_len==0:
+                fields[0]=(fields[0][0],KEY_TYPE_LEGACY,fields[0][2])
+            self.set_fields(fields[:num_of_key_fields],fields[num_of_key_fields:],key_len==VARIABLE_KEY_LEN)
 
+            if (include_fields is not None and index_field_names(include_fields)!=self.include_field_names()) or \
+               (compressed is not None and bool(compressed)!=self.compressed):
+                if include_fields is not None:
+                    self.include_fields=table_fields(self.table_name,index_field_names(include_fields))
+                self.set_fields(self.key_fields,self.include_fields,self.compressed if compressed is None else bool(compressed))
+                self.has_root=False
+                self.num_of_levels=0
+                self.root_node_ptr=SPECIAL_INDEX_BLOCK_PTR
 
-            # to view all the index entries
-            # to be inserted here
-            
+    #---------------------------------
+    # to set the key fields and the included fields, which make the layout of the entries
+    # input
+    #       key_fields: list of (field name,field type,field length), the type is KEY_TYPE_LEGACY for the keys
+    #                   of an old index, see make_key()
+    #       include_fields: the same as key_fields
+    #       compressed: whether the nodes are prefix-compressed, see the structure of their nodes
+    #---------------------------------
+    def set_fields(self,key_fields,include_fields,compressed=False):
+        if not key_fields:
+            key_fields=[(b'',KEY_TYPE_LEGACY,0)]
+        for field in include_fields:
+            if field[1] not in (0,1,2,3):
+                raise ValueError('the included field '+tool.tryToStr(field[0])+' does not exist')
+        self.key_fields=list(key_fields)
+        self.include_fields=list(include_fields)
+        self.key_types=[field[1] for field in self.key_fields]
+        self.key_type=self.key_types[0]
+        self.compressed=compressed
 
+        # the values of the included fields follow the ptr of a leaf entry
+        self.include_codec=None
+        leaf_ptr_format='ii'
+        if self.include_fields:
+            self.include_codec=storage_db.RecordCodec(self.include_fields,storage_db.RECORD_FORMAT_BINARY)
+            leaf_ptr_format+=str(self.include_codec.content_struct.size)+'s'
+        self.leaf_ptr_struct=struct.Struct('!'+leaf_ptr_format)
+        self.values_per_leaf_entry=3 if self.include_codec is None else 4
 
-  
-            
-            
+        if self.compressed:
+            # the keys have no fixed length, and a node takes as many entries as its block holds
+            self.key_len=VARIABLE_KEY_LEN
+            self.max_key_len=sum([variable_key_len(field) for field in self.key_fields])
+            self.key_struct=self.leaf_entry_struct=self.internal_entry_struct=None
+            max_entry_size=SLOT_STRUCT.size+SUFFIX_LEN_STRUCT.size+self.max_key_len+self.leaf_ptr_struct.size
+            if max_entry_size>(common_db.BLOCK_SIZE-COMPRESSED_HEAD_STRUCT.size-LAST_PTR_STRUCT.size)//4:
+                raise ValueError('the keys are too long for a prefix-compressed index')
+            return
 
-           
+        self.key_len=LEN_OF_KEY*len(self.key_fields)
+        self.max_key_len=self.key_len
+        self.key_struct=struct.Struct('!'+str(self.key_len)+'s')
+        self.leaf_entry_struct=struct.Struct('!'+str(self.key_len)+'s'+leaf_ptr_format)
+        self.internal_entry_struct=struct.Struct('!'+str(self.key_len)+'si')
+
+        # a node takes at most MAX_NUM_OF_KEYS entries, fewer if they are too long for a block
+        room=common_db.BLOCK_SIZE-NODE_HEAD_STRUCT.size-LAST_PTR_STRUCT.size
+        self.max_leaf_keys=min(MAX_NUM_OF_KEYS,room//self.leaf_entry_struct.size)
+        self.max_internal_keys=min(MAX_NUM_OF_KEYS,room//self.internal_entry_struct.size)
+
+    #---------------------------------
+    # the names of the key fields and the included fields
+    #---------------------------------
+    def key_field_names(self):
+        return [field[0] for field in self.key_fields]
+
+    def include_field_names(self):
+        return [field[0] for field in self.include_fields]
+
+    #---------------------------------
+    # to make the key and the included values of an entry
+    # input
+    #       values: the values of the key fields, followed by the values of the included fields
+    # output
+    #       (key,payload), payload is None if the index has no included fields
+    #---------------------------------
+    def make_entry(self,values):
+        key=self.entry_key(values)
+        if self.include_codec is None:
+            return key,None
+        return key,self.include_codec.encode_values(values[len(self.key_types):])
+
+    # the key of an entry, from the values of the key fields
+    def entry_key(self,values):
+        return b''.join([make_key(value,key_type,self.compressed) for value,key_type in zip(values,self.key_types)])
+
+    #---------------------------------
+    # to split a key into the keys of the key fields, see make_key()
+    #---------------------------------
+    def key_parts(self,key):
+        if not self.compressed:
+            return [key[i*LEN_OF_KEY:(i+1)*LEN_OF_KEY] for i in range(len(self.key_types))]
+        parts=[]
+        begin=0
+        for key_type in self.key_types:
+            if key_type==2:
+                end=begin+INT_KEY_STRUCT.size
+            elif key_type==3:
+                end=begin+1
+            else: # a str key ends with a zero byte
+                end=key.index(b'\x00',begin)+1
+            parts.append(key[begin:end])
+            begin=end
+        return parts
+
+    #---------------------------------
+    # to make the key of a bound of a range, see range_scan()
+    # input
+    #       value: a value of the first key field, or a tuple of the values of the first key fields
+    # output
+    #       (key,is_cut), the key is shorter than key_len if only the first key fields have values.
+    #       is_cut is True if a value is cut by make_key(), and then the values after it are not used
+    #---------------------------------
+    def bound_key(self,value):
+        values=value if isinstance(value,(tuple,list)) else (value,)
+        key=b''
+        for value,key_type in zip(values,self.key_types):
+            key+=make_key(value,key_type,self.compressed)
+            if is_key_cut(value,key_type,self.compressed):
+                return key,True
+        return key,False
+
+    #---------------------------------
+    # to pad the key of a bound, so that it goes before or after all the keys beginning with it
+    #---------------------------------
+    def pad_bound_key(self,key,after_keys):
+        if self.compressed: # a key without padding goes before the longer keys beginning with it
+            return key+b'\xff'*(self.max_key_len+1) if after_keys else key
+        return key.ljust(self.key_len,b'\xff' if after_keys else b'\x00')
+
+    #---------------------------------
+    # the fields whose values are found in the leaf entries, so that a query reading only them
+    # does not read the data blocks. they are the included fields, and the key fields whose values
+    # are made back from their keys exactly: an int or bool field, or a str field not longer than LEN_OF_KEY,
+    # or than MAX_LEN_OF_VAR_KEY in a prefix-compressed index
+    # output
+    #       list of field names (bytes), in the order of the values given by covered_scan()
+    #---------------------------------
+    def covered_fields(self):
+        return [field[0] for field,decode in zip(self.key_fields,self.key_decoders()) if decode is not None]+\
+               self.include_field_names()
+
+    #---------------------------------
+    # the function making the value of each key field back from its key, None if it cannot be done
+    # or the field is included, see covered_fields()
+    #---------------------------------
+    def key_decoders(self):
+        decoders=[]
+        for name,field_type,field_length in self.key_fields:
+            if name in self.include_field_names():
+                decoders.append(None)
+            elif field_type==2 and 0<field_length<19: # at most 18 digits, which is not cut by make_key()
+                decoders.append(lambda key:INT_KEY_STRUCT.unpack_from(key,0)[0]-INT_KEY_BIAS)
+            elif field_type==3:
+                decoders.append(lambda key:key[0]==1)
+            elif field_type in (0,1) and 0<field_length<=(MAX_LEN_OF_VAR_KEY if self.compressed else LEN_OF_KEY):
+                decoders.append(lambda key:key.rstrip(b'\x00'))
+            else:
+                decoders.append(None)
+        return decoders
 
 
 
@@ -105,219 +634,1591 @@ class Index(object):
     #-----------------------------------
     def __del__(self):
         print ("__del__ of ",Index.__name__)
-        self.f_handle.close()
-        self.open=False
+        self.close()
+
+    #---------------------------------
+    # to close the index file, the dirty nodes are written back when the file is closed
+    #-----------------------------------
+    def close(self):
+        if self.open:
+            self.unpin_nodes()
+            self.pool.close_file(self.file_name)
+            self.open=False
+
 
 
-    
     #-----------------------------
     # create index for all indexed items in one run
+    # the entries (key,block_id,offset) of the table are sorted, in runs of SORT_RUN_SIZE entries
+    # written to temporary files if the table is large, then the leaf nodes are packed in key order
+    # and the internal levels are built bottom-up, each node is written once in one sequential pass.
+    # the old content of the index file is replaced
+    # input
+    #       index_field: the field name, or the key fields of a composite index, see index_field_names()
+    #       fill_factor: how full the nodes are made, between 0 and 1
+    #       run_size: how many entries are sorted in main memory at a time
+    # output
+    #       the number of index entries
     #-----------------------------------
-    def create_index(self,index_field):
+    def create_index(self,index_field,fill_factor=DEFAULT_FILL_FACTOR,run_size=SORT_RUN_SIZE):
         print ('create_index begins to execute')
-        #field_value_address=[] # its element is a tuple (field_value,address)
-        # to be inserted here
+        registry=catalog_db.get_table_registry()
+        storage=registry.acquire(self.table_name)
+        try:
+            field_list=storage.getFieldList()
+            field_names=[tool.tryToBytes(field[0]).strip() for field in field_list]
+            field_idxs=[field_names.index(name) for name in index_field_names(index_field)+self.include_field_names()]
+            # the index is made again, with the keys of the field types
+            fields=[(field_names[i],field_list[i][1],field_list[i][2]) for i in field_idxs]
+            self.set_fields(fields[:len(fields)-len(self.include_fields)],fields[len(fields)-len(self.include_fields):],self.compressed)
+
+            # step 1: sort the entries of the table in runs
+            runs=[] # the temporary files of the sorted runs
+            entries=[]
+            for (block_id,slot_id),record in storage.scan():
+                key,payload=self.make_entry([record[i] for i in field_idxs])
+                entries.append((key,block_id,slot_id) if payload is None else (key,block_id,slot_id,payload))
+                if len(entries)>=run_size:
+                    entries.sort()
+                    runs.append(self._write_run(entries))
+                    entries=[]
+                    if len(runs)>=MERGE_FAN_IN:
+                        runs=[self._merge_runs(runs)]
+            entries.sort()
+
+            # step 2: merge the runs and build the tree
+            if runs:
+                if entries:
+                    runs.append(self._write_run(entries))
+                sorted_entries=heapq.merge(*[self._read_run(run) for run in runs])
+            else:
+                sorted_entries=iter(entries)
+            try:
+                return self._build_tree(sorted_entries,fill_factor)
+            finally:
+                for run in runs:
+                    run.close()
+        finally:
+            registry.release(self.table_name)
+
+    #-----------------------------
+    # to write a sorted run of index entries into a temporary file
+    # output
+    #       the temporary file, which is removed when it is closed
+    #-----------------------------------
+    def _write_run(self,entries):
+        run=tempfile.TemporaryFile()
+        run.write(b''.join(self._pack_run_entry(entry) for entry in entries))
+        run.seek(0)
+        return run
+
+    # an entry in a sorted run, the key of a prefix-compressed index is written after its length
+    def _pack_run_entry(self,entry):
+        if self.compressed:
+            return SUFFIX_LEN_STRUCT.pack(len(entry[0]))+entry[0]+self.leaf_ptr_struct.pack(*entry[1:])
+        return self.leaf_entry_struct.pack(*entry)
+
+    #-----------------------------
+    # to merge sorted runs into one run, the old runs are closed
+    #-----------------------------------
+    def _merge_runs(self,runs):
+        merged=tempfile.TemporaryFile()
+        buf=[]
+        for entry in heapq.merge(*[self._read_run(run) for run in runs]):
+            buf.append(self._pack_run_entry(entry))
+            if len(buf)>=4096:
+                merged.write(b''.join(buf))
+                buf=[]
+        merged.write(b''.join(buf))
+        merged.seek(0)
+        for run in runs:
+            run.close()
+        return merged
+
+    #-----------------------------
+    # to read the index entries of a sorted run back, one chunk at a time
+    #-----------------------------------
+    def _read_run(self,run):
+        if self.compressed:
+            for entry in self._read_compressed_run(run):
+                yield entry
+            return
+        while True:
+            chunk=run.read(self.leaf_entry_struct.size*4096)
+            if not chunk:
+                return
+            for entry in self.leaf_entry_struct.iter_unpack(chunk):
+                yield entry
+
+    # the entries have variable lengths, an entry cut at the end of a chunk is finished with the next chunk
+    def _read_compressed_run(self,run):
+        ptr_size=self.leaf_ptr_struct.size
+        buf=b''
+        while True:
+            chunk=run.read(common_db.BLOCK_SIZE*64)
+            if not chunk:
+                return
+            buf+=chunk
+            pos=0
+            while pos+SUFFIX_LEN_STRUCT.size<=len(buf):
+                key_len,=SUFFIX_LEN_STRUCT.unpack_from(buf,pos)
+                key_end=pos+SUFFIX_LEN_STRUCT.size+key_len
+                if key_end+ptr_size>len(buf):
+                    break
+                yield (buf[pos+SUFFIX_LEN_STRUCT.size:key_end],)+self.leaf_ptr_struct.unpack_from(buf,key_end)
+                pos=key_end+ptr_size
+            buf=buf[pos:]
+
+    #-----------------------------
+    # to build the tree bottom-up from index entries in key order
+    # the leaf nodes take blocks 1,2,... in key order, then each internal level follows the level below it
+    # input
+    #       sorted_entries: iterator of (key,block_id,offset) in key order, followed by the included values if any
+    #       fill_factor
+    # output
+    #       the number of index entries
+    #-----------------------------------
+    def _build_tree(self,sorted_entries,fill_factor):
+        self.unpin_nodes()
+        self.pool.truncate_file(self.file_name,0)
+        self.next_new_block=0
+
+        # step 1: the leaf nodes, the first key and block id of each node is kept for the level above it.
+        # a node is written when the next one begins, then its last_ptr is known
+        children=[] # (first key,block_id) of the nodes of the level
+        num_of_entries=0
+        node_entries=None
+        for next_entries in self._leaf_node_entries(sorted_entries,fill_factor):
+            if node_entries is not None:
+                self._write_built_leaf(len(children),node_entries,len(children)+1)
+            children.append((next_entries[0][0],len(children)+1))
+            num_of_entries+=len(next_entries)
+            node_entries=next_entries
+
+        if num_of_entries==0:
+            self.has_root=False
+            self.num_of_levels=0
+            self.root_node_ptr=SPECIAL_INDEX_BLOCK_PTR
+            self.write_meta()
+            self.pool.flush_file(self.file_name)
+            return 0
+        self._write_built_leaf(len(children),node_entries,SPECIAL_INDEX_BLOCK_PTR)
+        next_block_id=len(children)+1
+        num_of_levels=1
+
+        # step 2: the internal levels, each node takes a share of the nodes of the level below it
+        while len(children)>1:
+            upper_children=[]
+            for node_children in self._internal_node_children(children,fill_factor):
+                upper_children.append((node_children[0][0],next_block_id))
+                self.pool.write_page(self.file_name,next_block_id,
+                                     self.pack_node(next_block_id,INTERNAL_NODE_TYPE,
+                                                    [child[0] for child in node_children[1:]],
+                                                    [child[1] for child in node_children[:-1]],
+                                                    node_children[-1][1]))
+                next_block_id+=1
+            children=upper_children
+            num_of_levels+=1
+
+        # step 3: the meta information
+        self.has_root=True
+        self.num_of_levels=num_of_levels
+        self.root_node_ptr=children[0][1]
+        self.write_meta()
+        self.pool.flush_file(self.file_name)
+        print ('create_index:',num_of_entries,'entries in',next_block_id-1,'nodes and',num_of_levels,'levels')
+        return num_of_entries
+
+    def _write_built_leaf(self,block_id,node_entries,last_ptr):
+        self.pool.write_page(self.file_name,block_id,
+                             self.pack_node(block_id,LEAF_NODE_TYPE,[entry[0] for entry in node_entries],
+                                            [entry[1:] for entry in node_entries],last_ptr))
+
+    #-----------------------------
+    # to cut the sorted entries into the entries of the leaf nodes, see _build_tree()
+    # output
+    #       a generator of lists of entries, one list for each leaf node
+    #-----------------------------------
+    def _leaf_node_entries(self,sorted_entries,fill_factor):
+        if self.compressed:
+            for node_entries in self._fill_compressed_nodes(sorted_entries,self.leaf_ptr_struct.size,fill_factor,1):
+                yield node_entries
+            return
+        keys_per_node=min(self.max_leaf_keys,max(1,int(self.max_leaf_keys*fill_factor)))
+        node_entries=[]
+        for entry in sorted_entries:
+            if len(node_entries)==keys_per_node:
+                yield node_entries
+                node_entries=[]
+            node_entries.append(entry)
+        if node_entries:
+            yield node_entries
+
+    #-----------------------------
+    # to share the nodes of a level among the nodes of the level above it, see _build_tree()
+    # input
+    #       children: list of (first key,block_id) of the nodes of the level
+    # output
+    #       list of lists of children, one list for each internal node, every one has at least two children
+    #-----------------------------------
+    def _internal_node_children(self,children,fill_factor):
+        if self.compressed:
+            groups=list(self._fill_compressed_nodes(children,CHILD_PTR_STRUCT.size,fill_factor,3))
+            if len(groups)>1 and len(groups[-1])<2:
+                groups[-1].insert(0,groups[-2].pop())
+            return groups
+        keys_per_internal_node=min(self.max_internal_keys,max(1,int(self.max_internal_keys*fill_factor)))
+        num_of_nodes=(len(children)+keys_per_internal_node)//(keys_per_internal_node+1)
+        groups=[]
+        begin=0
+        for i in range(num_of_nodes):
+            end=begin+(len(children)-begin)//(num_of_nodes-i)
+            groups.append(children[begin:end])
+            begin=end
+        return groups
+
+    #-----------------------------
+    # to cut the entries in key order into the entries of prefix-compressed nodes, each node is filled
+    # up to fill_factor of its block. the size of a node is kept as the entries come, the anchor only gets shorter
+    # input
+    #       entries: iterator of (key,...) in key order
+    #       ptr_size: the size of the ptr of an entry
+    #       fill_factor
+    #       min_entries: the least number of entries of a node
+    # output
+    #       a generator of lists of entries
+    #-----------------------------------
+    def _fill_compressed_nodes(self,entries,ptr_size,fill_factor,min_entries):
+        max_node_size=int(common_db.BLOCK_SIZE*min(fill_factor,1.0))
+        entry_size=SLOT_STRUCT.size+SUFFIX_LEN_STRUCT.size+ptr_size
+        node_entries=[]
+        anchor=b''
+        key_bytes=0 # the total length of the keys of the node
+        for entry in entries:
+            key=entry[0]
+            if node_entries:
+                new_anchor=anchor if key.startswith(anchor) else common_prefix(anchor,key)
+                num_of_entries=len(node_entries)+1
+                node_size=COMPRESSED_HEAD_STRUCT.size+LAST_PTR_STRUCT.size+len(new_anchor)+key_bytes+len(key)+\
+                          num_of_entries*(entry_size-len(new_anchor))
+                if node_size>max_node_size and len(node_entries)>=min_entries:
+                    yield node_entries
+                    node_entries=[]
+                    key_bytes=0
+                else:
+                    anchor=new_anchor
+            if not node_entries:
+                anchor=key
+            node_entries.append(entry)
+            key_bytes+=len(key)
+        if node_entries:
+            yield node_entries
 
     #-----------------------------
     # get the internal node to follow
     # input
-    #       current_value:
-    #       index_key_list:
-    #       index_ptr_list:
+    #       current_value:  the key to search
+    #       index_key_list: the keys of the internal node
+    #       index_ptr_list: the ptrs of the internal node, with last_ptr at the end
     #output
-    #       the block_id to follow
+    #       the block_id to follow, namely the first node which may have the key
     #--------------------------------
     def get_next_block_ptr(self,current_value,index_key_list,index_ptr_list):
-        ret_value=-1
-        return ret_value
+        if len(index_ptr_list)!=len(index_key_list)+1:
+            return SPECIAL_INDEX_BLOCK_PTR
+        return index_ptr_list[bisect.bisect_left(index_key_list,current_value)]
+
 
-    
     #---------------------------------
     # insert the index entry into main memory list, which needs to determine the poistion
+    # an entry is put after the entries of the same key
     # input
     #       inert_key
-    #       insert_block_id
-    #       insert_oofset
-    # output 
+    #       ptr_tuple       : (block_id,offset_id)
     #       key_list
     #       ptr_list    : of which each element is a tuple (block_id,offset_id)
     def insert_key_value_into_leaf_list(self,insert_key,ptr_tuple,key_list,ptr_list):
-       
-        if len(key_list)>0:
-            pos=-1
-            for i in range(len(key_list)):
-                current_key=key_list[i]
-                if current_key==insert_key:
-                    pos=i
-                    break
-                elif current_key>insert_key:
-                    pos=i
+        pos=bisect.bisect_right(key_list,insert_key)
+        key_list.insert(pos,insert_key)
+        ptr_list.insert(pos,ptr_tuple)
+
+
+    #---------------------------------
+    # to read a node of the tree
+    # input
+    #       block_id
+    # output
+    #       (node_type,key_list,ptr_list,last_ptr)
+    #       for leaf node, each element of ptr_list is a tuple (block_id,offset_id),
+    #       or (block_id,offset_id,included values) if the index has included fields
+    #---------------------------------
+    def read_node(self,block_id):
+        current_index_block=self.pool.fetch_page(self.file_name,block_id)
+        try:
+            return self.unpack_node(current_index_block)
+        finally:
+            self.pool.unpin_page(self.file_name,block_id)
+
+    # to unpack a node from its block, see read_node()
+    def unpack_node(self,current_index_block):
+        temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+        last_ptr,=LAST_PTR_STRUCT.unpack_from(current_index_block,LAST_PTR_OFFSET)
+        if self.compressed:
+            entries=self.node_entries(self.node_keys(current_index_block,node_type,num_of_keys),node_type,0,num_of_keys)
+            if node_type==LEAF_NODE_TYPE:
+                return node_type,[entry[0] for entry in entries],[entry[1:] for entry in entries],last_ptr
+            return node_type,[entry[0] for entry in entries],[entry[1] for entry in entries],last_ptr
+
+        values=self.node_entries_struct(node_type,num_of_keys).unpack_from(current_index_block,NODE_HEAD_STRUCT.size)
+        if node_type==LEAF_NODE_TYPE:
+            step=self.values_per_leaf_entry
+            key_list=list(values[0::step])
+            ptr_list=list(zip(*[values[i::step] for i in range(1,step)]))
+        else:
+            key_list=list(values[0::2])
+            ptr_list=list(values[1::2])
+        return node_type,key_list,ptr_list,last_ptr
+
+    #---------------------------------
+    # the struct of the entries of a node of the index, see entries_struct()
+    #---------------------------------
+    def node_entries_struct(self,node_type,num_of_entries):
+        return entries_struct(self.leaf_entry_struct if node_type==LEAF_NODE_TYPE else self.internal_entry_struct,num_of_entries)
+
+    #---------------------------------
+    # the keys of a node for bisect, see NodeKeys and CompressedNodeKeys
+    #---------------------------------
+    def node_keys(self,node_block,node_type,num_of_keys):
+        if self.compressed:
+            return CompressedNodeKeys(node_block,num_of_keys)
+        entry_size=self.leaf_entry_struct.size if node_type==LEAF_NODE_TYPE else self.internal_entry_struct.size
+        return NodeKeys(node_block,num_of_keys,entry_size,self.key_struct)
+
+    #---------------------------------
+    # the position of a key in a node by binary search, only the keys compared are decoded
+    # input
+    #       keys: the keys of the node, see node_keys()
+    #       key
+    #       after_equal_keys: False for the position before the equal keys (bisect_left), True for the one after them
+    #       begin: the keys before it are not searched
+    #---------------------------------
+    def key_position(self,keys,key,after_equal_keys=False,begin=0):
+        if self.compressed:
+            # a key not beginning with the anchor goes before or after all the keys of the node,
+            # otherwise only the suffixes are compared
+            if not key.startswith(keys.anchor):
+                return begin if key<keys.anchor else keys.num_of_keys
+            key=key[len(keys.anchor):]
+        if after_equal_keys:
+            return bisect.bisect_right(keys,key,begin)
+        return bisect.bisect_left(keys,key,begin)
+
+    #---------------------------------
+    # to get the entries of a node from begin to end
+    # input
+    #       keys: the keys of the node, see node_keys()
+    #       node_type,begin,end
+    #       full_entries: see leaf_range()
+    # output
+    #       list of (key,block_id,offset_id,...) for a leaf node and of (key,ptr) for an internal node,
+    #       or of (block_id,offset_id) if full_entries is False
+    #---------------------------------
+    def node_entries(self,keys,node_type,begin,end,full_entries=True):
+        if end<=begin:
+            return []
+        if self.compressed:
+            ptr_struct=self.leaf_ptr_struct if node_type==LEAF_NODE_TYPE else CHILD_PTR_STRUCT
+            entries=[keys.entry(i,ptr_struct) for i in range(begin,end)]
+            return entries if full_entries else [entry[1:3] for entry in entries]
+        entry_struct=self.leaf_entry_struct if node_type==LEAF_NODE_TYPE else self.internal_entry_struct
+        step=self.values_per_leaf_entry if node_type==LEAF_NODE_TYPE else 2
+        values=entries_struct(entry_struct,end-begin).unpack_from(keys.node_block,NODE_HEAD_STRUCT.size+begin*entry_struct.size)
+        if full_entries:
+            return list(zip(*[values[i::step] for i in range(step)]))
+        return list(zip(values[1::step],values[2::step]))
+
+    #---------------------------------
+    # to get the frame of an internal node, which is given back with release_node()
+    # a node of the upper levels stays pinned after it is read the first time, until unpin_nodes().
+    # the pinned frame is the cached block of the node, so write_node() changes it too
+    # input
+    #       block_id
+    #       level: the level of the node, the root is level 0
+    #---------------------------------
+    def fetch_node(self,block_id,level):
+        with self.pin_lock: # two threads do not pin the same node
+            frame=self.pinned_nodes.get(block_id)
+            if frame is not None:
+                if self.pool.holds_page(self.file_name,block_id,frame):
+                    return frame
+                del self.pinned_nodes[block_id] # the pages of the file have been dropped, e.g. by another Index object
+            frame=self.pool.fetch_page(self.file_name,block_id)
+            if level<PINNED_LEVELS and len(self.pinned_nodes)<MAX_PINNED_NODES:
+                self.pinned_nodes[block_id]=frame
+            return frame
+
+    def release_node(self,block_id):
+        if block_id not in self.pinned_nodes:
+            self.pool.unpin_page(self.file_name,block_id)
+
+    #---------------------------------
+    # to unpin the nodes pinned by fetch_node(), when the index file is made again or closed
+    #---------------------------------
+    def unpin_nodes(self):
+        with self.pin_lock:
+            for block_id,frame in self.pinned_nodes.items():
+                if self.pool.holds_page(self.file_name,block_id,frame):
+                    self.pool.unpin_page(self.file_name,block_id)
+            self.pinned_nodes={}
+
+    #---------------------------------
+    # the latch of a node, made when it is first asked for
+    #---------------------------------
+    def node_latch(self,block_id):
+        latch=self.node_latches.get(block_id)
+        if latch is None:
+            with self.latch_table_lock:
+                latch=self.node_latches.setdefault(block_id,NodeLatch())
+        return latch
+
+    def latch_node(self,block_id,write=False):
+        if write:
+            self.node_latch(block_id).acquire_write()
+        else:
+            self.node_latch(block_id).acquire_read()
+
+    def unlatch_node(self,block_id,write=False):
+        if write:
+            self.node_latch(block_id).release_write()
+        else:
+            self.node_latch(block_id).release_read()
+
+    #---------------------------------
+    # to go down to a leaf node by latch crabbing, the internal nodes are latched for read
+    # input
+    #       key: None for the leftmost leaf node
+    #       after_equal_keys: see child_node_ptr()
+    #       write: whether the leaf node is latched for write
+    # output
+    #       the block_id of the leaf node, whose latch is held by the caller,
+    #       or SPECIAL_INDEX_BLOCK_PTR if the tree is empty
+    #---------------------------------
+    def latch_leaf(self,key,after_equal_keys=False,write=False):
+        self.meta_latch.acquire_read()
+        if not self.has_root:
+            self.meta_latch.release_read()
+            return SPECIAL_INDEX_BLOCK_PTR
+        # a split of the root while this thread is below it adds a level above, the levels below stay
+        next_node_ptr=self.root_node_ptr
+        num_of_levels=self.num_of_levels
+        self.latch_node(next_node_ptr,write and num_of_levels==1)
+        self.meta_latch.release_read()
+        for temp_count in range(num_of_levels-1):
+            current_node_type,child_ptr=self.child_node_ptr(next_node_ptr,key,after_equal_keys,temp_count)
+            self.latch_node(child_ptr,write and temp_count==num_of_levels-2)
+            self.unlatch_node(next_node_ptr)
+            next_node_ptr=child_ptr
+        return next_node_ptr
+
+    #---------------------------------
+    # whether a node has room for one more entry, so that an insert below it does not split it
+    # a prefix-compressed node is taken as packed again without its anchor and with the longest entry
+    #---------------------------------
+    def is_safe_node(self,block_id):
+        current_index_block=self.pool.fetch_page(self.file_name,block_id)
+        try:
+            temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+            if not self.compressed:
+                return num_of_keys<(self.max_leaf_keys if node_type==LEAF_NODE_TYPE else self.max_internal_keys)
+            anchor_len,entries_begin=COMPRESSED_HEAD_STRUCT.unpack_from(current_index_block,0)[3:]
+            ptr_size=self.leaf_ptr_struct.size if node_type==LEAF_NODE_TYPE else CHILD_PTR_STRUCT.size
+            node_size=COMPRESSED_HEAD_STRUCT.size+(LAST_PTR_OFFSET-entries_begin)+num_of_keys*anchor_len+\
+                      (num_of_keys+1)*SLOT_STRUCT.size+SUFFIX_LEN_STRUCT.size+self.max_key_len+ptr_size+LAST_PTR_STRUCT.size
+            return node_size<=common_db.BLOCK_SIZE
+        finally:
+            self.pool.unpin_page(self.file_name,block_id)
+
+    #---------------------------------
+    # to find the child of an internal node to follow, only the keys compared by bisect are decoded
+    # input
+    #       block_id
+    #       key: None for the first child
+    #       after_equal_keys: False for the first child which may have the key,
+    #                         True for the last one, where an entry of the key is put
+    #       level: the level of the node, see fetch_node()
+    # output
+    #       (node_type,block_id of the child)
+    #---------------------------------
+    def child_node_ptr(self,block_id,key,after_equal_keys=False,level=PINNED_LEVELS):
+        current_index_block=self.fetch_node(block_id,level)
+        try:
+            temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+            keys=self.node_keys(current_index_block,node_type,num_of_keys)
+            if key is None:
+                pos=0
+            else:
+                pos=self.key_position(keys,key,after_equal_keys)
+            return node_type,self.child_ptr_at(current_index_block,keys,pos)
+        finally:
+            self.release_node(block_id)
+
+    #---------------------------------
+    # the child ptr of an internal node at a position found by key_position(), the last ptr after the keys
+    #---------------------------------
+    def child_ptr_at(self,node_block,keys,pos):
+        if pos==keys.num_of_keys:
+            return LAST_PTR_STRUCT.unpack_from(node_block,LAST_PTR_OFFSET)[0]
+        if self.compressed:
+            return keys.entry(pos,CHILD_PTR_STRUCT)[1]
+        return CHILD_PTR_STRUCT.unpack_from(node_block,NODE_HEAD_STRUCT.size+pos*self.internal_entry_struct.size+self.key_len)[0]
+
+    #---------------------------------
+    # the positions on the path from the root down to the leaf node of a key, see estimate_range()
+    # input
+    #       key: None for the first or the last position
+    #       after_equal_keys: see key_position()
+    # output
+    #       list of (position,number of children) of the internal nodes, then (position,number of keys) of the leaf node
+    #---------------------------------
+    def key_path(self,key,after_equal_keys):
+        self.meta_latch.acquire_read()
+        node_ptr=self.root_node_ptr
+        num_of_levels=self.num_of_levels
+        self.latch_node(node_ptr)
+        self.meta_latch.release_read()
+        path=[]
+        for level in range(num_of_levels):
+            node_block=self.fetch_node(node_ptr,level)
+            try:
+                temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(node_block,0)
+                keys=self.node_keys(node_block,node_type,num_of_keys)
+                if key is None:
+                    pos=num_of_keys if after_equal_keys else 0
+                else:
+                    pos=self.key_position(keys,key,after_equal_keys)
+                if node_type==LEAF_NODE_TYPE:
+                    path.append((pos,num_of_keys))
                     break
+                path.append((pos,num_of_keys+1))
+                child_ptr=self.child_ptr_at(node_block,keys,pos)
+            finally:
+                self.release_node(node_ptr)
+            self.latch_node(child_ptr)
+            self.unlatch_node(node_ptr)
+            node_ptr=child_ptr
+        self.unlatch_node(node_ptr)
+        return path
 
-            if pos==-1:
-                pos=len(key_list)-1
+    #---------------------------------
+    # to get the entries of a leaf node in a range of keys
+    # input
+    #       block_id
+    #       low_key, high_key: the bounds, None means there is no bound
+    #       low_inclusive, high_inclusive
+    #       full_entries: whether to get the whole entries (key,block_id,offset_id,...) instead of the ptrs
+    # output
+    #       (ptr_list,last_ptr,beyond), beyond is True if the node has a key greater than the range
+    #---------------------------------
+    def leaf_range(self,block_id,low_key,high_key,low_inclusive=True,high_inclusive=True,full_entries=False):
+        current_index_block=self.pool.fetch_page(self.file_name,block_id)
+        try:
+            temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+            keys=self.node_keys(current_index_block,node_type,num_of_keys)
+            if low_key is None:
+                begin=0
+            else:
+                begin=self.key_position(keys,low_key,not low_inclusive)
+            if high_key is None:
+                end=num_of_keys
+            else:
+                end=self.key_position(keys,high_key,high_inclusive,begin)
+            ptr_list=self.node_entries(keys,node_type,begin,end,full_entries)
+            last_ptr,=LAST_PTR_STRUCT.unpack_from(current_index_block,LAST_PTR_OFFSET)
+            return ptr_list,last_ptr,end<num_of_keys
+        finally:
+            self.pool.unpin_page(self.file_name,block_id)
 
-            key_list.insert(pos,insert_key)           
-            ptr_list.insert(pos,ptr_tuple)                 
-                           
-        
-        elif len(key_list)==0:
-            key_list.append(insert_key)
-            ptr_list.append(ptr_tuple)
-            
-         
-        
+    #---------------------------------
+    # to put an entry into a leaf node which is not full, in place in its cached block
+    # the entries after it are moved by one entry and the count is changed, the others stay as they are
+    # input
+    #       block_id
+    #       insert_key
+    #       ptr_tuple: (block_id,offset_id), see read_node()
+    # output
+    #       (node_type,True) if the entry is put, (node_type,False) if the node is full or not a leaf
+    #---------------------------------
+    def insert_into_leaf(self,block_id,insert_key,ptr_tuple):
+        current_index_block=self.pool.fetch_page(self.file_name,block_id)
+        is_dirty=False
+        try:
+            temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+            if node_type!=LEAF_NODE_TYPE:
+                return node_type,False
+            if self.compressed:
+                is_dirty=self.insert_into_compressed_leaf(current_index_block,insert_key,ptr_tuple)
+                return node_type,is_dirty
+            if num_of_keys>=self.max_leaf_keys:
+                return node_type,False
+            entry_size=self.leaf_entry_struct.size
+            pos=self.key_position(self.node_keys(current_index_block,node_type,num_of_keys),insert_key,True)
+            begin=NODE_HEAD_STRUCT.size+pos*entry_size
+            end=NODE_HEAD_STRUCT.size+num_of_keys*entry_size
+            current_index_block[begin+entry_size:end+entry_size]=current_index_block[begin:end]
+            self.leaf_entry_struct.pack_into(current_index_block,begin,insert_key,*ptr_tuple)
+            NODE_HEAD_STRUCT.pack_into(current_index_block,0,block_id,node_type,num_of_keys+1)
+            is_dirty=True
+            return node_type,True
+        finally:
+            self.pool.unpin_page(self.file_name,block_id,is_dirty)
+
+    #---------------------------------
+    # to put an entry into a prefix-compressed leaf node, see insert_into_leaf()
+    # the entry goes below the others and its slot is put among the slots, if the key begins with
+    # the anchor and the free space holds it. otherwise the node is packed again with the entry,
+    # which gives back the holes of the deleted entries and finds the anchor again
+    # output
+    #       True if the entry is put, False if the node is full
+    #---------------------------------
+    def insert_into_compressed_leaf(self,current_index_block,insert_key,ptr_tuple):
+        block_id,node_type,num_of_keys,anchor_len,entries_begin=COMPRESSED_HEAD_STRUCT.unpack_from(current_index_block,0)
+        slots_begin=COMPRESSED_HEAD_STRUCT.size+anchor_len
+        slots_end=slots_begin+num_of_keys*SLOT_STRUCT.size
+        if current_index_block[COMPRESSED_HEAD_STRUCT.size:slots_begin]==insert_key[:anchor_len]:
+            suffix=insert_key[anchor_len:]
+            entry=SUFFIX_LEN_STRUCT.pack(len(suffix))+suffix+self.leaf_ptr_struct.pack(*ptr_tuple)
+            if entries_begin-len(entry)>=slots_end+SLOT_STRUCT.size:
+                pos=self.key_position(CompressedNodeKeys(current_index_block,num_of_keys),insert_key,True)
+                entries_begin-=len(entry)
+                current_index_block[entries_begin:entries_begin+len(entry)]=entry
+                slot=slots_begin+pos*SLOT_STRUCT.size
+                current_index_block[slot+SLOT_STRUCT.size:slots_end+SLOT_STRUCT.size]=current_index_block[slot:slots_end]
+                SLOT_STRUCT.pack_into(current_index_block,slot,entries_begin)
+                COMPRESSED_HEAD_STRUCT.pack_into(current_index_block,0,block_id,node_type,num_of_keys+1,anchor_len,entries_begin)
+                return True
+
+        node_type,key_list,ptr_list,last_ptr=self.unpack_node(current_index_block)
+        self.insert_key_value_into_leaf_list(insert_key,ptr_tuple,key_list,ptr_list)
+        if not self.node_fits(LEAF_NODE_TYPE,key_list):
+            return False
+        current_index_block[:]=self.pack_node(block_id,LEAF_NODE_TYPE,key_list,ptr_list,last_ptr)
+        return True
+
+    #---------------------------------
+    # whether the entries of the keys fit in one node
+    #---------------------------------
+    def node_fits(self,node_type,key_list):
+        if self.compressed:
+            return self.compressed_node_size(node_type,key_list)<=common_db.BLOCK_SIZE
+        return len(key_list)<=(self.max_leaf_keys if node_type==LEAF_NODE_TYPE else self.max_internal_keys)
+
+    #---------------------------------
+    # the size of a prefix-compressed node with the keys, see pack_node()
+    # input
+    #       node_type
+    #       key_list: the keys in order
+    #---------------------------------
+    def compressed_node_size(self,node_type,key_list):
+        anchor_len=len(common_prefix(key_list[0],key_list[-1])) if key_list else 0
+        ptr_size=self.leaf_ptr_struct.size if node_type==LEAF_NODE_TYPE else CHILD_PTR_STRUCT.size
+        return COMPRESSED_HEAD_STRUCT.size+anchor_len+LAST_PTR_STRUCT.size+sum([len(key) for key in key_list])+\
+               len(key_list)*(SLOT_STRUCT.size+SUFFIX_LEN_STRUCT.size+ptr_size-anchor_len)
+
+    #---------------------------------
+    # where to split a node which is too full, the entries before it go to the left node
+    # the entries of a prefix-compressed node are shared by their sizes, the others by their number
+    #---------------------------------
+    def split_position(self,node_type,key_list):
+        if not self.compressed:
+            return len(key_list)//2
+        anchor_len=len(common_prefix(key_list[0],key_list[-1]))
+        ptr_size=self.leaf_ptr_struct.size if node_type==LEAF_NODE_TYPE else CHILD_PTR_STRUCT.size
+        entry_sizes=[SLOT_STRUCT.size+SUFFIX_LEN_STRUCT.size+ptr_size+len(key)-anchor_len for key in key_list]
+        half=sum(entry_sizes)//2
+        size=0
+        for pos,entry_size in enumerate(entry_sizes):
+            size+=entry_size
+            if size>half:
+                return min(max(pos,1),len(key_list)-1)
+        return len(key_list)//2
+
+    #---------------------------------
+    # to write a node of the tree into its cached block
+    # input
+    #       block_id
+    #       node_type
+    #       key_list
+    #       ptr_list: as returned by read_node()
+    #       last_ptr
+    #---------------------------------
+    def write_node(self,block_id,node_type,key_list,ptr_list,last_ptr):
+        current_index_block=self.pool.fetch_page(self.file_name,block_id)
+        current_index_block[:]=self.pack_node(block_id,node_type,key_list,ptr_list,last_ptr)
+        self.pool.unpin_page(self.file_name,block_id,True)
+
+    #---------------------------------
+    # to pack a node of the tree into a block in main memory
+    # input
+    #       the same as write_node()
+    # output
+    #       the block (bytearray)
+    #---------------------------------
+    def pack_node(self,block_id,node_type,key_list,ptr_list,last_ptr):
+        if self.compressed:
+            return self.pack_compressed_node(block_id,node_type,key_list,ptr_list,last_ptr)
+        current_index_block=bytearray(common_db.BLOCK_SIZE)
+        NODE_HEAD_STRUCT.pack_into(current_index_block,0,block_id,node_type,len(key_list))
+        if node_type==LEAF_NODE_TYPE:
+            values=[value for key,ptr in zip(key_list,ptr_list) for value in (key,)+tuple(ptr)]
+        else:
+            values=[value for key_and_ptr in zip(key_list,ptr_list) for value in key_and_ptr]
+        self.node_entries_struct(node_type,len(key_list)).pack_into(current_index_block,NODE_HEAD_STRUCT.size,*values)
+        LAST_PTR_STRUCT.pack_into(current_index_block,LAST_PTR_OFFSET,last_ptr)
+        return current_index_block
+
+    #---------------------------------
+    # to pack a prefix-compressed node, the entries are put from the end of the block in key order
+    #---------------------------------
+    def pack_compressed_node(self,block_id,node_type,key_list,ptr_list,last_ptr):
+        if self.compressed_node_size(node_type,key_list)>common_db.BLOCK_SIZE:
+            raise ValueError('the entries are too many for a node')
+        current_index_block=bytearray(common_db.BLOCK_SIZE)
+        anchor=common_prefix(key_list[0],key_list[-1]) if key_list else b''
+        if node_type==LEAF_NODE_TYPE:
+            ptr_struct=self.leaf_ptr_struct
+        else:
+            ptr_struct=CHILD_PTR_STRUCT
+            ptr_list=[(ptr,) for ptr in ptr_list]
+        slots_begin=COMPRESSED_HEAD_STRUCT.size+len(anchor)
+        current_index_block[COMPRESSED_HEAD_STRUCT.size:slots_begin]=anchor
+        entries_begin=LAST_PTR_OFFSET
+        for i,(key,ptr) in enumerate(zip(key_list,ptr_list)):
+            suffix=key[len(anchor):]
+            entry=SUFFIX_LEN_STRUCT.pack(len(suffix))+suffix+ptr_struct.pack(*ptr)
+            entries_begin-=len(entry)
+            current_index_block[entries_begin:entries_begin+len(entry)]=entry
+            SLOT_STRUCT.pack_into(current_index_block,slots_begin+i*SLOT_STRUCT.size,entries_begin)
+        COMPRESSED_HEAD_STRUCT.pack_into(current_index_block,0,block_id,node_type,len(key_list),len(anchor),entries_begin)
+        LAST_PTR_STRUCT.pack_into(current_index_block,LAST_PTR_OFFSET,last_ptr)
+        return current_index_block
+
+    #---------------------------------
+    # to write the meta information into block 0
+    #---------------------------------
+    def write_meta(self):
+        meta_index_block=self.pool.fetch_page(self.file_name,0)
+        key_len=0 if self.key_type==KEY_TYPE_LEGACY and not self.compressed else self.key_len
+        META_STRUCT.pack_into(meta_index_block,0,0,self.has_root,self.num_of_levels,self.root_node_ptr,self.key_type,key_len)
+        META_FIELDS_STRUCT.pack_into(meta_index_block,META_STRUCT.size,len(self.key_fields),len(self.include_fields))
+        for i,field in enumerate(self.key_fields+self.include_fields):
+            META_FIELD_STRUCT.pack_into(meta_index_block,META_STRUCT.size+META_FIELDS_STRUCT.size+i*META_FIELD_STRUCT.size,*field)
+        self.pool.unpin_page(self.file_name,0,True)
+
+    #---------------------------------
+    # a new block at the end of the index file
+    #---------------------------------
+    def allocate_block(self):
+        # two threads splitting nodes at the same time get different blocks
+        with self.allocate_lock:
+            block_id=max(self.pool.block_count(self.file_name),1,self.next_new_block)
+            self.next_new_block=block_id+1
+            return block_id
 
     #-------------------------------
     # to insert a index entry into the index file
     # input
-    #       field_value     # field value
+    #       field_value     # field value, or the tuple of the values of the key fields and the included fields
     #       block_id        # block id
     #       offset          # offset in offset table, it is an integer
+    #       flush           # whether the changed nodes are written back at once
+    # output
+    #       True or False
     #--------------------------------------
 
-    def insert_index_entry(self,field_value,block_id,offset):
+    def insert_index_entry(self,field_value,block_id,offset,flush=True):
         print ('insert_index_entry begins to execute')
-        if len(field_value.strip())>0 and block_id>0 and offset>0:# the following is to insert an index entry into the index file
-            if len(self.first_block_buf.strip())==0:# there is no data in the index file
-                # to prepare the data in the index node, which is stored in block 1 
-                first_index_block=ctypes.create_string_buffer(common_db.BLOCK_SIZE)
+        if field_value is None:
+            return False
+        insert_key,payload=self.make_entry(field_value if isinstance(field_value,(tuple,list)) else (field_value,))
+        return self.insert_key_entry(insert_key,block_id,offset,flush,payload)
 
-                #block_id|node_type|number_of_keys|key_0|ptr_0
-                struct.pack_into('!iii10sii',first_index_block,0,1,LEAF_NODE_TYPE,1,field_value,block_id,offset)
-                struct.pack_into('!i',first_index_block,common_db.BLOCK_SIZE-struct.calcsize('!i'),SPECIAL_INDEX_BLOCK_PTR)
+    #-------------------------------
+    # to insert an entry of a key made by make_entry(), e.g. a key in the log
+    # a full node is split into two, and the key between them goes up to the parent node.
+    # when the root is split, a new root is made and the tree grows by one level
+    # input
+    #       payload: the included values made by make_entry(), None if the index has no included fields
+    #--------------------------------------
+    def insert_key_entry(self,insert_key,block_id,offset,flush=True,payload=None):
+        if block_id<=0 or offset<0:
+            return False
+        if (payload is None)!=(self.include_codec is None):
+            raise ValueError('the included values do not match the index')
+        ptr_tuple=(block_id,offset) if payload is None else (block_id,offset,payload)
 
-                
+        # most inserts fit in their leaf node, so the internal nodes are latched for read at first.
+        # if the leaf node is full, the tree is searched again with write latches to split it
+        is_inserted=self.insert_into_latched_leaf(insert_key,ptr_tuple)
+        if is_inserted is None:
+            is_inserted=self.insert_with_splits(insert_key,ptr_tuple)
+        if is_inserted and flush:
+            self.pool.flush_file(self.file_name)
+        return is_inserted
 
-                # to prepare the meta block node, which is stored in block 0
-                self.meta_index_block=ctypes.create_string_buffer(common_db.BLOCK_SIZE)
-                struct.pack_into('!i?ii',self.meta_index_block,0,0,True,1,1) #block_id,has_root,number of levels,root_node_ptr(block_id)
+    #-------------------------------
+    # to put an entry into its leaf node without splits, see insert_key_entry()
+    # output
+    #       True, False if the tree is wrong, or None if the leaf node is full or there is no root
+    #--------------------------------------
+    def insert_into_latched_leaf(self,insert_key,ptr_tuple):
+        # an entry goes after the entries of the same key, so the last child which may have the key is followed
+        leaf_ptr=self.latch_leaf(insert_key,True,True)
+        if leaf_ptr==SPECIAL_INDEX_BLOCK_PTR:
+            return None
+        try:
+            current_node_type,is_inserted=self.insert_into_leaf(leaf_ptr,insert_key,ptr_tuple)
+        finally:
+            self.unlatch_node(leaf_ptr,True)
+        if current_node_type!=LEAF_NODE_TYPE:
+            print ('wrong, it is should be a leaf node')
+            return False
+        return True if is_inserted else None
 
-                # record the meta information in the main memory data structures
+    #-------------------------------
+    # to insert an entry with the splits of the full nodes, see insert_key_entry()
+    # the nodes are latched for write from the meta information down. the latches above a node
+    # which has room for one more entry are given back, since the split does not go up beyond it
+    #--------------------------------------
+    def insert_with_splits(self,insert_key,ptr_tuple):
+        self.meta_latch.acquire_write()
+        held_latches=[self.meta_latch] # the write latches held, from the top
+        try:
+            if not self.has_root: # there is no data in the index file, the root is a leaf in block 1
                 self.has_root=True
-                self.number_of_levels=1
+                self.num_of_levels=1
                 self.root_node_ptr=1
+                self.write_meta()
+                self.write_node(1,LEAF_NODE_TYPE,[insert_key],[ptr_tuple],SPECIAL_INDEX_BLOCK_PTR)
+                return True
 
+            if self.num_of_levels<=0 or self.root_node_ptr<=0:
+                print ('the information in the index file is wrong')
+                return False
 
-                # the following is to write data to index file
-                self.f_handle.seek(0)
-                self.f_handle.write(self.meta_index_block)
-                self.f_handle.write(first_index_block)
-                self.f_handle.flush()
-                
-                
-               
-            else:# there is data in the file
-                self.meta_index_block=ctypes.create_string_buffer(common_db.BLOCK_SIZE)
-                self.f_handle.seek(0)
-                self.meta_index_block=self.f_handle.read(common_db.BLOCK_SIZE)
-
-                temp_block_id,self.has_root,self.num_of_levels,self.root_node_ptr=struct.unpack_from('!i?ii',self.meta_index_block,0)
-                if self.has_root==True and self.num_of_levels>0 and self.root_node_ptr>0:
-                    
-                    temp_count=0
-                    next_node_ptr=self.root_node_ptr
-                    
-                    while(temp_count<self.num_of_levels-1):# to search through the internal nodes
-                        
-                        current_index_block=ctypes.create_string_buffer(common_db.BLOCK_SIZE)
-                        read_pos=next_node_ptr*common_db.BLOCK_SIZE # the begining of the target block
-                        
-                        self.f_handle.seek(read_pos)
-                        current_index_block=self.f_handle.read(common_db.BLOCK_SIZE)
-                        current_node_type,current_num_of_keys=struct.unpack_from('!ii',current_index_block,struct.calcsize('!i'))
-
-                        if current_node_type!=INTERNAL_NODE_TYPE:
-                            print ('the internal node type is wrong')
-                            return
-
-                        if current_num_of_keys <=0:
-                            print ('the current_num_of_keys is wrong in internal node')
-                            return
-
-                        internal_key_list=[]
-                        internal_ptr_list=[]
-                        key_list=[]
-                        ptr_list=[]
-                        for i in range(current_num_of_keys):
-                            current_key,current_ptr=struct.unpack_from('!10si',current_index_block,struct.calcsize('!iii')+i*(10+4))
-                            internal_key_list.append(current_key)
-                            internal_ptr_list.append(current_ptr)
-                            
-                        last_ptr,=struct.unpack_from('!i',current_index_block,common_db.BLOCK_SIZE-4)
-                        ptr_list.append(last_ptr)
-                        
-                        # now it is to determine which path we should follow
-                        next_node_ptr= self.get_next_block_ptr(field_value, key_list, ptr_list)
-                        temp_count+=1
-                        
-                    # now it is at the leaf node
-                    current_index_block=ctypes.create_string_buffer(common_db.BLOCK_SIZE)
-                    read_pos=next_node_ptr*common_db.BLOCK_SIZE    # where the leaf node lies
-                    self.f_handle.seek(read_pos)
-                    
-                    current_index_block=self.f_handle.read(common_db.BLOCK_SIZE)
-                    current_node_type,current_num_of_keys=struct.unpack_from('!ii',current_index_block,struct.calcsize('!i'))
-                    
-                    if current_node_type==LEAF_NODE_TYPE:# it is leaf node
-                        if current_num_of_keys<MAX_NUM_OF_KEYS:# insert the value into the leaf node
-
-                            # the following is to read index entry into main memory list
-                            key_list=[]
-                            ptr_list=[]
-                            for i in range(current_num_of_keys):
-                                current_key,block_ptr,current_offset=struct.unpack_from('!10sii',current_index_block,struct.calcsize('!iii')+i*LEN_OF_LEAF_NODE)
-                                key_list.append(current_key)
-                                my_tuple=(block_ptr,current_offset)
-                                ptr_list.append(my_tuple)
-                            self.insert_key_value_into_leaf_list(field_value, my_tuple, key_list, ptr_list)
-
-                            # the following is to write the new index entry list to buffer
-                            for i in range(len(key_list)):
-                                curent_key=key_list[i]
-                                (current_id,current_offset)=ptr_list[i]
-                                struct.pack_into('!10sii',current_index_block,struct.calcsize('!iii')+i*LEN_OF_LEAF_NODE,current_key,current_id,current_offset)
-                                
-                            # change the nmber_of_keys
-                            current_num_of_keys+=1
-                            struct.pack_into('!i',current_index_block,8,current_num_of_keys)
-                            
-
-                            self.f_handle.seek(read_pos)
-                            self.f_handle.write(current_index_block)
-                            self.f_handle.flush()                       
-
-                            
-                            
-                            
-                            
-                            
-                        else:
-                            print ("the leaf node is full, we should split")
-                            
-                        
-                        
-                    else:
-                        print ('wrong, it is should be a leaf node')
-                    
-                    
-                else:
-                    print ('the information in the index file is wrong')
-                
-                
-            
-            
-            
-        
-        
+            # step 1: to search through the internal nodes, the path is kept for the splits
+            path=[] # the block ids of the internal nodes from the root
+            next_node_ptr=self.root_node_ptr
+            num_of_levels=self.num_of_levels
+            for temp_count in range(num_of_levels):
+                latch=self.node_latch(next_node_ptr)
+                latch.acquire_write()
+                if self.is_safe_node(next_node_ptr):
+                    for held_latch in held_latches:
+                        held_latch.release_write()
+                    held_latches=[]
+                held_latches.append(latch)
+                if temp_count==num_of_levels-1:
+                    break
+                current_node_type,child_ptr=self.child_node_ptr(next_node_ptr,insert_key,True,temp_count)
+                if current_node_type!=INTERNAL_NODE_TYPE:
+                    print ('the internal node type is wrong')
+                    return False
+                path.append(next_node_ptr)
+                next_node_ptr=child_ptr
 
+            # step 2: now it is at the leaf node, the entry is put in place if the node is not full,
+            # e.g. another thread has split it since the first try
+            current_node_type,is_inserted=self.insert_into_leaf(next_node_ptr,insert_key,ptr_tuple)
+            if current_node_type!=LEAF_NODE_TYPE:
+                print ('wrong, it is should be a leaf node')
+                return False
+            if is_inserted:
+                return True
 
+            # step 3: the leaf node is full, we split it, the new leaf follows it in the chain
+            current_node_type,key_list,ptr_list,last_ptr=self.read_node(next_node_ptr)
+            self.insert_key_value_into_leaf_list(insert_key,ptr_tuple,key_list,ptr_list)
+            mid=self.split_position(LEAF_NODE_TYPE,key_list)
+            new_node_ptr=self.allocate_block()
+            self.write_node(new_node_ptr,LEAF_NODE_TYPE,key_list[mid:],ptr_list[mid:],last_ptr)
+            self.write_node(next_node_ptr,LEAF_NODE_TYPE,key_list[:mid],ptr_list[:mid],new_node_ptr)
+            split_key=key_list[mid]
 
+            # step 4: insert the key and the new node into the parent nodes, which may be split in turn
+            # the parent nodes reached here are still latched, the others have room for the key
+            while path:
+                parent_ptr=path.pop()
+                current_node_type,internal_key_list,internal_ptr_list,last_ptr=self.read_node(parent_ptr)
+                internal_ptr_list.append(last_ptr)
+                pos=internal_ptr_list.index(next_node_ptr)
+                internal_key_list.insert(pos,split_key)
+                internal_ptr_list.insert(pos+1,new_node_ptr)
+                if self.node_fits(INTERNAL_NODE_TYPE,internal_key_list):
+                    self.write_node(parent_ptr,INTERNAL_NODE_TYPE,internal_key_list,internal_ptr_list[:-1],internal_ptr_list[-1])
+                    break
 
+                # the middle key goes up, it is kept in neither of the two nodes
+                mid=self.split_position(INTERNAL_NODE_TYPE,internal_key_list)
+                split_key=internal_key_list[mid]
+                next_node_ptr,new_node_ptr=parent_ptr,self.allocate_block()
+                self.write_node(new_node_ptr,INTERNAL_NODE_TYPE,internal_key_list[mid+1:],internal_ptr_list[mid+1:-1],internal_ptr_list[-1])
+                self.write_node(parent_ptr,INTERNAL_NODE_TYPE,internal_key_list[:mid],internal_ptr_list[:mid],internal_ptr_list[mid])
+            else:
+                # step 5: the root has been split, a new root is made above the two nodes, the meta latch is held.
+                # the pinned nodes stay pinned though they are one level lower now, the other threads
+                # may be reading them
+                new_root_ptr=self.allocate_block()
+                self.write_node(new_root_ptr,INTERNAL_NODE_TYPE,[split_key],[next_node_ptr],new_node_ptr)
+                self.root_node_ptr=new_root_ptr
+                self.num_of_levels+=1
+                self.write_meta()
+            return True
+        finally:
+            for held_latch in held_latches:
+                held_latch.release_write()
 
-# the following is to test
-index_obj=Index('all');
-index_obj.insert_index_entry('a',4,1)
-#test()
+    #-------------------------------
+    # to delete an index entry, e.g. when its record is deleted
+    # the entry is taken out of its leaf node in place, the nodes are not merged when they get
+    # small, and an empty leaf node stays in the chain until the index is made again
+    # input
+    #       field_value, block_id, offset: the same as insert_index_entry()
+    #       flush: whether the changed node is written back at once
+    # output
+    #       True, or False if there is no such entry
+    #--------------------------------------
+    def delete_index_entry(self,field_value,block_id,offset,flush=True):
+        if field_value is None:
+            return False
+        delete_key=self.entry_key(field_value if isinstance(field_value,(tuple,list)) else (field_value,))
+        return self.delete_key_entry(delete_key,block_id,offset,flush)
+
+    #-------------------------------
+    # to delete an entry of a key made by make_entry(), e.g. to undo a logged insert
+    #--------------------------------------
+    def delete_key_entry(self,delete_key,block_id,offset,flush=True):
+        found=self.latch_key_entry(delete_key,block_id,offset,True)
+        if found is None:
+            return False
+        leaf_ptr,pos=found
+        try:
+            current_index_block=self.pool.fetch_page(self.file_name,leaf_ptr)
+            if self.compressed: # only the slot is taken out, the entry is left as a hole
+                temp_block_id,node_type,num_of_keys,anchor_len,entries_begin=COMPRESSED_HEAD_STRUCT.unpack_from(current_index_block,0)
+                begin=COMPRESSED_HEAD_STRUCT.size+anchor_len+pos*SLOT_STRUCT.size
+                end=COMPRESSED_HEAD_STRUCT.size+anchor_len+num_of_keys*SLOT_STRUCT.size
+                entry_size=SLOT_STRUCT.size
+            else:
+                temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+                entry_size=self.leaf_entry_struct.size
+                begin=NODE_HEAD_STRUCT.size+pos*entry_size
+                end=NODE_HEAD_STRUCT.size+num_of_keys*entry_size
+            current_index_block[begin:end-entry_size]=current_index_block[begin+entry_size:end]
+            current_index_block[end-entry_size:end]=bytes(entry_size)
+            NODE_HEAD_STRUCT.pack_into(current_index_block,0,leaf_ptr,node_type,num_of_keys-1)
+            self.pool.unpin_page(self.file_name,leaf_ptr,True)
+        finally:
+            self.unlatch_node(leaf_ptr,True)
+        if flush:
+            self.pool.flush_file(self.file_name)
+        return True
+
+    #-------------------------------
+    # to find an entry of a key made by make_entry(), e.g. to redo a logged change only once
+    # output
+    #       (block_id of the leaf node,position in the node), or None if there is no such entry
+    #--------------------------------------
+    def find_key_entry(self,key,block_id,offset):
+        found=self.latch_key_entry(key,block_id,offset,False)
+        if found is not None:
+            self.unlatch_node(found[0])
+        return found
+
+    #-------------------------------
+    # to find an entry and keep its leaf node latched, so that the position stays right
+    # the entries of the key may go on in the next leaf nodes, the latch of the next leaf node
+    # is taken before that of the current one is given back
+    # input
+    #       key,block_id,offset: the same as find_key_entry()
+    #       write: whether the leaf nodes are latched for write
+    # output
+    #       the same as find_key_entry(), the caller gives back the latch of the leaf node found
+    #--------------------------------------
+    def latch_key_entry(self,key,block_id,offset,write):
+        next_node_ptr=self.latch_leaf(key,False,write)
+        while next_node_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+            current_index_block=self.pool.fetch_page(self.file_name,next_node_ptr)
+            try:
+                temp_block_id,node_type,num_of_keys=NODE_HEAD_STRUCT.unpack_from(current_index_block,0)
+                keys=self.node_keys(current_index_block,node_type,num_of_keys)
+                begin=self.key_position(keys,key,False)
+                end=self.key_position(keys,key,True,begin)
+                for pos,ptr in enumerate(self.node_entries(keys,node_type,begin,end,False),begin):
+                    if ptr==(block_id,offset):
+                        return next_node_ptr,pos
+                last_ptr,=LAST_PTR_STRUCT.unpack_from(current_index_block,LAST_PTR_OFFSET)
+                if end<num_of_keys: # a greater key is found
+                    last_ptr=SPECIAL_INDEX_BLOCK_PTR
+            finally:
+                self.pool.unpin_page(self.file_name,next_node_ptr)
+            if last_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+                self.latch_node(last_ptr,write)
+            self.unlatch_node(next_node_ptr,write)
+            next_node_ptr=last_ptr
+        return None
+
+    #-------------------------------
+    # to find the records of a field value, it reads one node per level and the leaf nodes with the key
+    # the keys are cut to LEN_OF_KEY bytes, so the caller should check the field value of the records
+    # input
+    #       field_value: the value of the first key field, or a tuple of the values of the first key fields
+    # output
+    #       list of (block_id,offset) of the records
+    #--------------------------------------
+    def search(self,field_value):
+        return list(self.range_scan(field_value,field_value))
+
+
+    #---------------------------------
+    # to scan the index entries whose keys are in a range, in key order
+    # the tree is descended once to the first leaf node of the range, then the leaf nodes
+    # are followed through last_ptr until a key beyond the range is found
+    # a bound which is cut like the keys, see is_key_cut(), is taken as inclusive and
+    # the caller checks the records against the original bound
+    # a bound of a composite index may have the values of the first key fields only, e.g. (a,) is
+    # the bound of the keys (a,x) for every x, so low=high=(a,) finds the entries whose first field is a
+    # input
+    #       low, high: the bounds of the range, None means there is no bound, see bound_key()
+    #       low_inclusive, high_inclusive: whether the bound itself is in the range
+    # output
+    #       a generator of (block_id,offset_id)
+    #---------------------------------
+    def range_scan(self,low=None,high=None,low_inclusive=True,high_inclusive=True):
+        for ptr in self._scan_entries(low,high,low_inclusive,high_inclusive,False):
+            yield ptr
+
+    #---------------------------------
+    # to scan the values of the covered fields in a range of keys, from the leaf nodes only,
+    # so that the data blocks are not read at all, see covered_fields()
+    # input
+    #       the same as range_scan()
+    # output
+    #       a generator of ((block_id,offset_id),values), values is the tuple of the values of covered_fields()
+    #---------------------------------
+    def covered_scan(self,low=None,high=None,low_inclusive=True,high_inclusive=True):
+        key_decoders=[(i,decode) for i,decode in enumerate(self.key_decoders()) if decode is not None]
+        include_codec=self.include_codec
+        for entry in self._scan_entries(low,high,low_inclusive,high_inclusive,True):
+            key_parts=self.key_parts(entry[0])
+            values=[decode(key_parts[i]) for i,decode in key_decoders]
+            if include_codec is not None:
+                values.extend(include_codec.decode_values(include_codec.content_struct.unpack(entry[3])))
+            yield (entry[1],entry[2]),tuple(values)
+
+    #---------------------------------
+    # to estimate how many index entries are in a range, without walking through its leaf nodes.
+    # the tree is descended to the leaf node of each bound, see key_path(), and the positions
+    # on the two paths are told apart level by level. it is exact when the range is in one leaf node
+    # input
+    #       the same as range_scan()
+    # output
+    #       the estimated number of entries
+    #---------------------------------
+    def estimate_range(self,low=None,high=None,low_inclusive=True,high_inclusive=True):
+        if not self.has_root:
+            return 0
+        low_key,high_key,low_inclusive,high_inclusive=self.range_keys(low,high,low_inclusive,high_inclusive)
+        while True:
+            low_path=self.key_path(low_key,not low_inclusive)
+            high_path=self.key_path(high_key,high_inclusive)
+            if len(low_path)==len(high_path): # otherwise the root has been split between the two paths
+                break
+
+        # a node of a level is taken as holding as many entries as the fuller node of the two paths,
+        # so that the two ends are counted alike, e.g. the last leaf node is often not full
+        num_of_entries=0
+        subtree_entries=1
+        for (low_pos,low_num),(high_pos,high_num) in reversed(list(zip(low_path,high_path))):
+            num_of_entries+=(high_pos-low_pos)*subtree_entries
+            subtree_entries*=max(low_num,high_num,1)
+        return max(num_of_entries,0)
+
+    #---------------------------------
+    # the keys of the bounds of a range, see range_scan()
+    # a bound with the first key fields only goes before or after all the keys beginning with it
+    # output
+    #       (low_key,high_key,low_inclusive,high_inclusive), a key is None if there is no bound
+    #---------------------------------
+    def range_keys(self,low,high,low_inclusive,high_inclusive):
+        low_key=high_key=None
+        if low is not None:
+            low_key,is_cut=self.bound_key(low)
+            low_inclusive=low_inclusive or is_cut
+            low_key=self.pad_bound_key(low_key,not low_inclusive)
+        if high is not None:
+            high_key,is_cut=self.bound_key(high)
+            high_inclusive=high_inclusive or is_cut
+            high_key=self.pad_bound_key(high_key,high_inclusive)
+        return low_key,high_key,low_inclusive,high_inclusive
+
+    def _scan_entries(self,low,high,low_inclusive,high_inclusive,full_entries):
+        if not self.has_root:
+            return
+        low_key,high_key,low_inclusive,high_inclusive=self.range_keys(low,high,low_inclusive,high_inclusive)
+
+        # to search through the internal nodes, the leftmost leaf node is used if there is no low bound
+        next_node_ptr=self.latch_leaf(low_key)
+
+        # to walk through the leaf nodes, the entries of a node are got before they are given out,
+        # so that no block stays pinned and no latch is held between two entries. an entry moves only
+        # to a new node on the right when a node is split, so the next leaf node still has the entries after them
+        while next_node_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+            try:
+                ptr_list,last_ptr,beyond=self.leaf_range(next_node_ptr,low_key,high_key,low_inclusive,high_inclusive,full_entries)
+            finally:
+                self.unlatch_node(next_node_ptr)
+            for ptr in ptr_list:
+                yield ptr
+            if beyond: # a key beyond the range is found
+                return
+            next_node_ptr=last_ptr
+            if next_node_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+                self.latch_node(next_node_ptr)
+
+
+
+
+#------------------------------------
+# the hash index on a field (extendible hashing), which finds the entries of a key with
+# one bucket read, since the directory is kept in main memory. it has no order, so only
+# the entries equal to a value are found
+#-----------------------------------------
+class HashIndex(object):
+    #------------------------------------
+    # constructor of the class
+    # input
+    #       tablename : the table to be indexed
+    #       index_field : the field to be indexed, or the list of the one key field, see index_field_names()
+    #-----------------------------------------
+    def __init__(self,tablename,index_field):
 
-        
+        print ("__init__ of ",HashIndex.__name__)
+        self.open=False # __del__ closes nothing if the file is not opened yet
+        self.table_name=tool.tryToBytes(tablename).strip()
+        self.index_field=FIELD_LIST_SEPARATOR.join(index_field_names(index_field))
+        self.file_name=index_file_name(self.table_name,self.index_field,INDEX_KIND_HASH)
+        if  not os.path.exists(self.file_name): # in this case, the index file does not exist
+
+            print ('index file '+self.file_name.decode('utf-8')+' does not exist')
+            self.f_handle=open(self.file_name,'wb+')
+            self.f_handle.close()
+            print (self.file_name.decode('utf-8')+' has been created')
+
+        self.pool=buffer_db.get_buffer_pool()
+        self.f_handle=self.pool.open_file(self.file_name)
+        print ('index file '+self.file_name.decode('utf-8')+' has been opened')
+        self.open=True
+        self.key_len=LEN_OF_KEY # a hash index has one key field and no included fields, see Index.set_fields()
+        self.include_codec=None
+
+        if self.pool.block_count(self.file_name)==0: # a new index has one empty bucket
+            self.key_type=field_key_type(self.table_name,self.index_field)
+            self.init_buckets(0)
+        else:
+            meta_index_block=self.pool.fetch_page(self.file_name,0)
+            temp_block_id,self.global_depth,self.num_of_blocks,self.free_block_ptr,self.key_type,key_len,num_of_dir_blocks=\
+                HASH_META_STRUCT.unpack_from(meta_index_block,0)
+            self.dir_block_ptrs=list(struct.unpack_from('!'+str(num_of_dir_blocks)+'i',meta_index_block,HASH_META_STRUCT.size))
+            self.pool.unpin_page(self.file_name,0)
+
+            # the directory is read into main memory
+            self.directory=[]
+            for dir_block_ptr in self.dir_block_ptrs:
+                num_of_ptrs=min(DIR_PTRS_PER_BLOCK,(1<<self.global_depth)-len(self.directory))
+                dir_block=self.pool.fetch_page(self.file_name,dir_block_ptr)
+                self.directory.extend(struct.unpack_from('!'+str(num_of_ptrs)+'i',dir_block,0))
+                self.pool.unpin_page(self.file_name,dir_block_ptr)
+
+    def __del__(self):
+        print ("__del__ of ",HashIndex.__name__)
+        self.close()
+
+    #---------------------------------
+    # to close the index file, the dirty buckets are written back when the file is closed
+    #-----------------------------------
+    def close(self):
+        if self.open:
+            self.pool.close_file(self.file_name)
+            self.open=False
+
+    #---------------------------------
+    # to make the index file empty, with 2**global_depth empty buckets
+    #---------------------------------
+    def init_buckets(self,global_depth):
+        self.pool.truncate_file(self.file_name,0)
+        self.global_depth=global_depth
+        num_of_dir_blocks=((1<<global_depth)+DIR_PTRS_PER_BLOCK-1)//DIR_PTRS_PER_BLOCK
+        self.dir_block_ptrs=list(range(1,1+num_of_dir_blocks))
+        self.directory=list(range(1+num_of_dir_blocks,1+num_of_dir_blocks+(1<<global_depth)))
+        self.num_of_blocks=1+num_of_dir_blocks+len(self.directory)
+        self.free_block_ptr=SPECIAL_INDEX_BLOCK_PTR
+        for bucket_ptr in self.directory:
+            self.write_bucket(bucket_ptr,global_depth,[],SPECIAL_INDEX_BLOCK_PTR)
+        self.write_directory(range(num_of_dir_blocks))
+        self.write_meta()
+
+    #---------------------------------
+    # to write the meta information and the list of directory blocks into block 0
+    #---------------------------------
+    def write_meta(self):
+        meta_index_block=self.pool.fetch_page(self.file_name,0)
+        key_len=0 if self.key_type==KEY_TYPE_LEGACY else LEN_OF_KEY
+        HASH_META_STRUCT.pack_into(meta_index_block,0,0,self.global_depth,self.num_of_blocks,self.free_block_ptr,
+                                   self.key_type,key_len,len(self.dir_block_ptrs))
+        struct.pack_into('!'+str(len(self.dir_block_ptrs))+'i',meta_index_block,HASH_META_STRUCT.size,*self.dir_block_ptrs)
+        self.pool.unpin_page(self.file_name,0,True)
+
+    #---------------------------------
+    # the same as those of Index, for one key field without included fields
+    #---------------------------------
+    def key_field_names(self):
+        return [self.index_field]
+
+    def include_field_names(self):
+        return []
+
+    def covered_fields(self):
+        return [] # the entries are not read without the data blocks
+
+    def make_entry(self,values):
+        return make_key(values[0],self.key_type),None
+
+    #---------------------------------
+    # to write the bucket ptrs of the directory into some directory blocks
+    # input
+    #       dir_block_numbers: the numbers (0,1,...) of the directory blocks to write
+    #---------------------------------
+    def write_directory(self,dir_block_numbers):
+        for i in dir_block_numbers:
+            ptrs=self.directory[i*DIR_PTRS_PER_BLOCK:(i+1)*DIR_PTRS_PER_BLOCK]
+            dir_block=self.pool.fetch_page(self.file_name,self.dir_block_ptrs[i])
+            struct.pack_into('!'+str(len(ptrs))+'i',dir_block,0,*ptrs)
+            self.pool.unpin_page(self.file_name,self.dir_block_ptrs[i],True)
+
+    #---------------------------------
+    # to write a bucket
+    # input
+    #       entries: list of (key,block_id,offset), at most BUCKET_CAPACITY of them
+    #---------------------------------
+    def write_bucket(self,bucket_ptr,local_depth,entries,overflow_ptr):
+        bucket_block=self.pool.fetch_page(self.file_name,bucket_ptr)
+        bucket_block[:]=bytes(common_db.BLOCK_SIZE)
+        NODE_HEAD_STRUCT.pack_into(bucket_block,0,bucket_ptr,local_depth,len(entries))
+        entries_struct(LEAF_ENTRY_STRUCT,len(entries)).pack_into(bucket_block,NODE_HEAD_STRUCT.size,
+                                                              *[value for entry in entries for value in entry])
+        LAST_PTR_STRUCT.pack_into(bucket_block,LAST_PTR_OFFSET,overflow_ptr)
+        self.pool.unpin_page(self.file_name,bucket_ptr,True)
+
+    #---------------------------------
+    # to read all the entries of a bucket and its overflow buckets
+    # output
+    #       (list of the block ids of the chain,list of (key,block_id,offset))
+    #---------------------------------
+    def read_chain(self,bucket_ptr):
+        chain=[]
+        entries=[]
+        while bucket_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+            bucket_block=self.pool.fetch_page(self.file_name,bucket_ptr)
+            try:
+                temp_block_id,local_depth,num_of_entries=NODE_HEAD_STRUCT.unpack_from(bucket_block,0)
+                values=entries_struct(LEAF_ENTRY_STRUCT,num_of_entries).unpack_from(bucket_block,NODE_HEAD_STRUCT.size)
+                overflow_ptr,=LAST_PTR_STRUCT.unpack_from(bucket_block,LAST_PTR_OFFSET)
+            finally:
+                self.pool.unpin_page(self.file_name,bucket_ptr)
+            chain.append(bucket_ptr)
+            entries.extend(zip(values[0::3],values[1::3],values[2::3]))
+            bucket_ptr=overflow_ptr
+        return chain,entries
+
+    #---------------------------------
+    # the positions in a bucket of the entries with a key, the keys are found with bytes.find()
+    # instead of decoding all the entries
+    #---------------------------------
+    def key_positions(self,bucket_block,key,num_of_entries):
+        begin=NODE_HEAD_STRUCT.size
+        end=begin+num_of_entries*LEN_OF_LEAF_NODE
+        positions=[]
+        pos=bucket_block.find(key,begin,end)
+        while pos>=0:
+            if (pos-begin)%LEN_OF_LEAF_NODE==0: # a key, not a part of the entry
+                positions.append((pos-begin)//LEN_OF_LEAF_NODE)
+            pos=bucket_block.find(key,pos+1,end)
+        return positions
+
+    #---------------------------------
+    # a free block, from the chain of the freed blocks or at the end of the index file
+    #---------------------------------
+    def allocate_block(self):
+        if self.free_block_ptr==SPECIAL_INDEX_BLOCK_PTR:
+            self.num_of_blocks+=1
+            return self.num_of_blocks-1
+        block_id=self.free_block_ptr
+        free_block=self.pool.fetch_page(self.file_name,block_id)
+        self.free_block_ptr,=LAST_PTR_STRUCT.unpack_from(free_block,LAST_PTR_OFFSET)
+        self.pool.unpin_page(self.file_name,block_id)
+        return block_id
+
+    def free_block(self,block_id):
+        self.write_bucket(block_id,0,[],self.free_block_ptr)
+        self.free_block_ptr=block_id
+
+    #---------------------------------
+    # to write entries into a chain of buckets, the blocks of the chain are used first,
+    # more blocks are allocated if they are not enough and the blocks left over are freed
+    # input
+    #       chain: list of block ids, the first one is the bucket in the directory
+    #---------------------------------
+    def write_chain(self,chain,local_depth,entries):
+        num_of_buckets=max(1,(len(entries)+BUCKET_CAPACITY-1)//BUCKET_CAPACITY)
+        ptrs=chain[:num_of_buckets]
+        while len(ptrs)<num_of_buckets:
+            ptrs.append(self.allocate_block())
+        for i,bucket_ptr in enumerate(ptrs):
+            overflow_ptr=ptrs[i+1] if i+1<len(ptrs) else SPECIAL_INDEX_BLOCK_PTR
+            self.write_bucket(bucket_ptr,local_depth,entries[i*BUCKET_CAPACITY:(i+1)*BUCKET_CAPACITY],overflow_ptr)
+        for bucket_ptr in chain[num_of_buckets:]:
+            self.free_block(bucket_ptr)
+
+    #---------------------------------
+    # to split a bucket into two by one more bit of the hash, the directory is doubled if
+    # the bucket is told apart by all its bits
+    # input
+    #       hash_value: the hash of a key in the bucket
+    #       chain,entries: the chain and the entries of the bucket, see read_chain()
+    #       local_depth: the local depth of the bucket
+    #---------------------------------
+    def split_bucket(self,hash_value,chain,entries,local_depth):
+        changed_dir_blocks=set()
+        if local_depth==self.global_depth:
+            self.directory=self.directory+self.directory
+            self.global_depth+=1
+            while len(self.dir_block_ptrs)*DIR_PTRS_PER_BLOCK<len(self.directory):
+                self.dir_block_ptrs.append(self.allocate_block())
+            changed_dir_blocks.update(range(len(self.dir_block_ptrs)))
+
+        bit=1<<local_depth
+        new_bucket_ptr=self.allocate_block()
+        self.write_chain(chain,local_depth+1,[entry for entry in entries if not zlib.crc32(entry[0])&bit])
+        self.write_chain([new_bucket_ptr],local_depth+1,[entry for entry in entries if zlib.crc32(entry[0])&bit])
+
+        # the ptrs of the bucket whose new bit is 1 go to the new bucket
+        for i in range((hash_value&(bit-1))|bit,len(self.directory),bit<<1):
+            self.directory[i]=new_bucket_ptr
+            changed_dir_blocks.add(i//DIR_PTRS_PER_BLOCK)
+        self.write_directory(sorted(changed_dir_blocks))
+        self.write_meta()
+
+    #-------------------------------
+    # to insert an index entry into the index file
+    # input
+    #       field_value,block_id,offset,flush: the same as Index.insert_index_entry()
+    # output
+    #       True or False
+    #--------------------------------------
+    def insert_index_entry(self,field_value,block_id,offset,flush=True):
+        if field_value is None:
+            return False
+        return self.insert_key_entry(make_key(field_value,self.key_type),block_id,offset,flush)
+
+    #-------------------------------
+    # to insert an entry of a key made by make_key()
+    # the entry goes to the first bucket of the chain with room. when the chain is full, the bucket
+    # is split if its keys have different hash values, otherwise an overflow bucket is added
+    # payload is always None, see Index.insert_key_entry()
+    #--------------------------------------
+    def insert_key_entry(self,insert_key,block_id,offset,flush=True,payload=None):
+        if block_id<=0 or offset<0:
+            return False
+        hash_value=zlib.crc32(insert_key)
+        while True:
+            bucket_ptr=self.directory[hash_value&((1<<self.global_depth)-1)]
+
+            # step 1: to find a bucket of the chain with room
+            next_bucket_ptr=bucket_ptr
+            while next_bucket_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+                bucket_block=self.pool.fetch_page(self.file_name,next_bucket_ptr)
+                temp_block_id,local_depth,num_of_entries=NODE_HEAD_STRUCT.unpack_from(bucket_block,0)
+                if num_of_entries<BUCKET_CAPACITY:
+                    LEAF_ENTRY_STRUCT.pack_into(bucket_block,NODE_HEAD_STRUCT.size+num_of_entries*LEN_OF_LEAF_NODE,
+                                                insert_key,block_id,offset)
+                    NODE_HEAD_STRUCT.pack_into(bucket_block,0,next_bucket_ptr,local_depth,num_of_entries+1)
+                    self.pool.unpin_page(self.file_name,next_bucket_ptr,True)
+                    if flush:
+                        self.pool.flush_file(self.file_name)
+                    return True
+                last_bucket_ptr=next_bucket_ptr
+                next_bucket_ptr,=LAST_PTR_STRUCT.unpack_from(bucket_block,LAST_PTR_OFFSET)
+                self.pool.unpin_page(self.file_name,last_bucket_ptr)
+
+            # step 2: the chain is full, the bucket is split and the entry is inserted again
+            chain,entries=self.read_chain(bucket_ptr)
+            if (local_depth<self.global_depth or self.global_depth<MAX_GLOBAL_DEPTH) and \
+                    any(zlib.crc32(entry[0])!=hash_value for entry in entries):
+                self.split_bucket(hash_value,chain,entries,local_depth)
+                continue
+
+            # step 3: the keys cannot be told apart, an overflow bucket is added to the chain
+            overflow_ptr=self.allocate_block()
+            self.write_bucket(overflow_ptr,local_depth,[(insert_key,block_id,offset)],SPECIAL_INDEX_BLOCK_PTR)
+            bucket_block=self.pool.fetch_page(self.file_name,chain[-1])
+            LAST_PTR_STRUCT.pack_into(bucket_block,LAST_PTR_OFFSET,overflow_ptr)
+            self.pool.unpin_page(self.file_name,chain[-1],True)
+            self.write_meta()
+            if flush:
+                self.pool.flush_file(self.file_name)
+            return True
+
+    #-------------------------------
+    # to delete an index entry, the last entry of its bucket takes its place.
+    # the buckets are not merged
+    # input
+    #       field_value,block_id,offset,flush: the same as Index.delete_index_entry()
+    # output
+    #       True, or False if there is no such entry
+    #--------------------------------------
+    def delete_index_entry(self,field_value,block_id,offset,flush=True):
+        if field_value is None:
+            return False
+        return self.delete_key_entry(make_key(field_value,self.key_type),block_id,offset,flush)
+
+    def delete_key_entry(self,delete_key,block_id,offset,flush=True):
+        found=self.find_key_entry(delete_key,block_id,offset)
+        if found is None:
+            return False
+        bucket_ptr,pos=found
+        bucket_block=self.pool.fetch_page(self.file_name,bucket_ptr)
+        temp_block_id,local_depth,num_of_entries=NODE_HEAD_STRUCT.unpack_from(bucket_block,0)
+        last=NODE_HEAD_STRUCT.size+(num_of_entries-1)*LEN_OF_LEAF_NODE
+        begin=NODE_HEAD_STRUCT.size+pos*LEN_OF_LEAF_NODE
+        bucket_block[begin:begin+LEN_OF_LEAF_NODE]=bucket_block[last:last+LEN_OF_LEAF_NODE]
+        bucket_block[last:last+LEN_OF_LEAF_NODE]=bytes(LEN_OF_LEAF_NODE)
+        NODE_HEAD_STRUCT.pack_into(bucket_block,0,bucket_ptr,local_depth,num_of_entries-1)
+        self.pool.unpin_page(self.file_name,bucket_ptr,True)
+        if flush:
+            self.pool.flush_file(self.file_name)
+        return True
+
+    #-------------------------------
+    # to find an entry of a key made by make_key()
+    # output
+    #       (block_id of the bucket,position in the bucket), or None if there is no such entry
+    #--------------------------------------
+    def find_key_entry(self,key,block_id,offset):
+        bucket_ptr=self.directory[zlib.crc32(key)&((1<<self.global_depth)-1)]
+        while bucket_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+            bucket_block=self.pool.fetch_page(self.file_name,bucket_ptr)
+            try:
+                temp_block_id,local_depth,num_of_entries=NODE_HEAD_STRUCT.unpack_from(bucket_block,0)
+                for pos in self.key_positions(bucket_block,key,num_of_entries):
+                    if LEAF_ENTRY_STRUCT.unpack_from(bucket_block,NODE_HEAD_STRUCT.size+pos*LEN_OF_LEAF_NODE)[1:]==(block_id,offset):
+                        return bucket_ptr,pos
+                overflow_ptr,=LAST_PTR_STRUCT.unpack_from(bucket_block,LAST_PTR_OFFSET)
+            finally:
+                self.pool.unpin_page(self.file_name,bucket_ptr)
+            bucket_ptr=overflow_ptr
+        return None
+
+    #-------------------------------
+    # to find the records of a field value, it reads the bucket of the key and its overflow buckets
+    # the keys are cut to LEN_OF_KEY bytes, so the caller should check the field value of the records
+    # output
+    #       list of (block_id,offset) of the records
+    #--------------------------------------
+    def search(self,field_value):
+        key=make_key(field_value,self.key_type)
+        result=[]
+        bucket_ptr=self.directory[zlib.crc32(key)&((1<<self.global_depth)-1)]
+        while bucket_ptr!=SPECIAL_INDEX_BLOCK_PTR:
+            bucket_block=self.pool.fetch_page(self.file_name,bucket_ptr)
+            num_of_entries=NODE_HEAD_STRUCT.unpack_from(bucket_block,0)[2]
+            for pos in self.key_positions(bucket_block,key,num_of_entries):
+                result.append(tuple(LEAF_ENTRY_STRUCT.unpack_from(bucket_block,NODE_HEAD_STRUCT.size+pos*LEN_OF_LEAF_NODE)[1:]))
+            overflow_ptr,=LAST_PTR_STRUCT.unpack_from(bucket_block,LAST_PTR_OFFSET)
+            self.pool.unpin_page(self.file_name,bucket_ptr)
+            bucket_ptr=overflow_ptr
+        return result
+
+    #---------------------------------
+    # the same as Index.range_scan(), but a hash index has no order, so the range has to be one value,
+    # e.g. low and high come from field=value. a range with two different values is empty
+    #---------------------------------
+    def range_scan(self,low=None,high=None,low_inclusive=True,high_inclusive=True):
+        if low is None or high is None:
+            raise ValueError('a hash index only finds the entries equal to a value')
+        if low==high and low_inclusive and high_inclusive:
+            for ptr in self.search(low):
+                yield ptr
+
+    #---------------------------------
+    # the same as Index.estimate_range(), the entries of the value are counted, from its bucket
+    # and the overflow buckets
+    #---------------------------------
+    def estimate_range(self,low=None,high=None,low_inclusive=True,high_inclusive=True):
+        return len(list(self.range_scan(low,high,low_inclusive,high_inclusive)))
+
+    #-----------------------------
+    # create index for all indexed items in one run
+    # the directory is made big enough at once for the records of the table, so that the buckets
+    # are seldom split, then the entries are put into the buckets in runs of run_size entries,
+    # in the order of the buckets. the old content of the index file is replaced
+    # input
+    #       index_field: the field name
+    #       fill_factor: how full the buckets are expected to be, between 0 and 1
+    #       run_size: how many entries are put in order in main memory at a time
+    # output
+    #       the number of index entries
+    #-----------------------------------
+    def create_index(self,index_field,fill_factor=DEFAULT_FILL_FACTOR,run_size=SORT_RUN_SIZE):
+        print ('create_index begins to execute')
+        registry=catalog_db.get_table_registry()
+        storage=registry.acquire(self.table_name)
+        try:
+            field_names=[tool.tryToBytes(field[0]).strip() for field in storage.getFieldList()]
+            field_idx=field_names.index(FIELD_LIST_SEPARATOR.join(index_field_names(index_field)))
+            self.key_type=storage.getFieldList()[field_idx][1]
+
+            # step 1: the number of records, including the deleted ones, is read from the data block heads
+            num_of_records=sum(storage._record_count(block_id) for block_id in range(1,storage.data_block_num+1))
+            global_depth=0
+            while global_depth<MAX_GLOBAL_DEPTH and (1<<global_depth)*BUCKET_CAPACITY*fill_factor<num_of_records:
+                global_depth+=1
+            self.init_buckets(global_depth)
+
+            # step 2: put the entries into the buckets
+            num_of_entries=0
+            entries=[]
+            for (block_id,slot_id),record in storage.scan():
+                entries.append((make_key(record[field_idx],self.key_type),block_id,slot_id))
+                if len(entries)>=run_size:
+                    num_of_entries+=self.put_entries(entries)
+                    entries=[]
+            num_of_entries+=self.put_entries(entries)
+            self.pool.flush_file(self.file_name)
+            return num_of_entries
+        finally:
+            registry.release(self.table_name)
+
+    def put_entries(self,entries):
+        mask=(1<<self.global_depth)-1
+        entries.sort(key=lambda entry:zlib.crc32(entry[0])&mask) # the entries of a bucket come together
+        for key,block_id,offset in entries:
+            self.insert_key_entry(key,block_id,offset,False)
+        return len(entries)
+
+
+
+# the following is to test
+if __name__=='__main__':
+    index_obj=Index('all')
+    index_obj.insert_index_entry('a',4,1)
+    print (index_obj.search('a'))
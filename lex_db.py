@@ -53,7 +53,9 @@ def t_COMMA(t):
 
 
 def t_EQX(t):
-    r'[=]'
+    r'(<=|>=|!=|<>|=|<|>)'  # 比较运算符，两个字符的要放在前面
+    if t.value == '<>':
+        t.value = '!='
     return t
 
 
@@ -103,20 +105,38 @@ def t_error(t):
 
 # ------------------------------------------
 # to set the global_lexer in common_db.py
+# the lexer is made once in the program, before another query it is only reset,
+# so that the rules are not collected and their regular expressions not compiled again
 # -------------------------------------------
 def set_lex_handle():
-    common_db.global_lexer = lex.lex()
     if common_db.global_lexer is None:
-        print('wrong when the global_lex is created')
+        common_db.global_lexer = lex.lex()
+        if common_db.global_lexer is None:
+            print('wrong when the global_lex is created')
+    else:
+        reset_lex_handle()
+
+
+# ------------------------------------------
+# to make the global lexer ready for another query, e.g. after a query ended with an error
+# -------------------------------------------
+def reset_lex_handle():
+    common_db.global_lexer.input('')
+    common_db.global_lexer.lineno = 1
 
 
 t_ignore = ' \t\n'  # 直接忽略空白符
 
 
+# ------------------------------------------
+# to print the tokens of a query with the global lexer, which is reset afterwards for the parser
+# -------------------------------------------
 def tokenize_sql(sql):
-    lexer = lex.lex()
+    if common_db.global_lexer is None:
+        set_lex_handle()
+    lexer = common_db.global_lexer
     lexer.input(sql)
     print(f"\nTokenizing: '{sql}'")
     for tok in lexer:
         print(f"Type: {tok.type:<10} Value: {tok.value}")
-    lexer.input(sql)  # 重置供后续使用
\ No newline at end of file
+    reset_lex_handle()  # 重置供后续使用
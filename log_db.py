@@ -14,7 +14,7 @@
 import os
 import struct
 from common_db import BLOCK_SIZE 
-import storage_db 
+import catalog_db
 
 # --- 日志记录类型常量 ---
 RECORD_TYPE_BEGIN = 0
@@ -22,6 +22,12 @@ RECORD_TYPE_COMMIT = 1
 RECORD_TYPE_ABORT = 2
 RECORD_TYPE_INSERT = 3
 RECORD_TYPE_DELETE = 4 
+RECORD_TYPE_INSERT_BATCH = 5  # 一个数据块中连续槽位上的多条插入记录
+RECORD_TYPE_REORG = 6  # 表文件被重组 (例如格式转换)，此前该表日志中的位置全部失效
+RECORD_TYPE_PAGE_IMAGE = 7  # 一个块的完整映像 (例如压缩表时)，不属于任何事务，恢复时总是重做
+RECORD_TYPE_INDEX_INSERT = 8  # 索引中加入一个条目，和它的记录属于同一个事务
+RECORD_TYPE_INDEX_DELETE = 9  # 索引中去掉一个条目
+RECORD_TYPE_REORG_DONE = 10  # 表重组之后它的索引已经重建，恢复不需要再重建
 
 # --- 日志记录头部格式 ---
 # <Record_Length (I)> <Transaction_ID (Q)> <Record_Type (B)>
@@ -31,6 +37,33 @@ RECORD_TYPE_DELETE = 4
 LOG_HEADER_FORMAT = '!IQB'
 LOG_HEADER_SIZE = struct.calcsize(LOG_HEADER_FORMAT)
 
+# -----------------------
+# 构造只包含表名的 payload，用于 REORG 日志
+# 格式: <table_name_len> <table_name>
+# -----------------------
+def pack_table_payload(table_name_bytes):
+    return struct.pack(f'!I{len(table_name_bytes)}s', len(table_name_bytes), table_name_bytes)
+
+
+# -----------------------
+# 构造块映像的 payload，用于 PAGE_IMAGE 日志
+# 格式: <table_name_len> <table_name> <block_id> <block_data>
+# -----------------------
+def pack_page_image_payload(table_name_bytes, block_id, data):
+    return pack_table_payload(table_name_bytes) + struct.pack('!I', block_id) + bytes(data)
+
+
+# -----------------------
+# 构造索引条目的 payload，用于 INDEX_INSERT 和 INDEX_DELETE 日志
+# 格式: <table_name_len> <table_name> <field_name_len> <field_name> <block_id> <slot_id> <key>
+# key 是 Index.make_entry() 得到的键，索引包含其他字段时后面跟着这些字段的值
+# 前缀压缩索引的键长度不固定，包含字段的值长度固定，所以从末尾切分
+# -----------------------
+def pack_index_payload(table_name_bytes, field_name_bytes, block_id, slot_id, key):
+    return (pack_table_payload(table_name_bytes) + pack_table_payload(field_name_bytes) +
+            struct.pack('!II', block_id, slot_id) + key)
+
+
 # -----------------------
 #   管理事务日志的读写和恢复
 # -----------------------
@@ -43,6 +76,9 @@ class LogManager:
         self.log_file_name = log_file_name
         # 以二进制追加读写模式打开文件
         self.log_file = open(self.log_file_name, 'ab+')
+        self._recovery_tables = set()  # 恢复过程中从表注册表取得的表
+        self._transaction_records = {}  # 活动事务ID -> 它写下的日志记录在日志文件中的位置，用于中止时撤销
+        self._last_reorg_pos = {}  # 表名 -> 本次运行中该表最后一条 REORG 日志的位置
         print(f"LogManager initialized. Log file: '{self.log_file_name}'")
 
     # -----------------------
@@ -51,21 +87,55 @@ class LogManager:
     #    :param transaction_id: 当前事务的ID
     #    :param record_type: 日志记录的类型 (e.g., RECORD_TYPE_BEGIN)
     #    :param payload: 日志的具体内容 (二进制数据)
+    #    :param force: 是否立即刷盘；批量写日志时可以为False，最后调用一次 force()
     # -----------------------
-    def log(self, transaction_id, record_type, payload=b''):
+    def log(self, transaction_id, record_type, payload=b'', force=True):
         # 1. 构造日志记录
         record_length = LOG_HEADER_SIZE + len(payload)
         header = struct.pack(LOG_HEADER_FORMAT, record_length, transaction_id, record_type)
         log_record = header + payload
 
-        # 2. 写入日志文件
+        # 2. 写入日志文件，记下事务的修改记录的位置，事务结束时丢掉
+        self.log_file.seek(0, os.SEEK_END)
+        pos = self.log_file.tell()
         self.log_file.write(log_record)
+        if record_type in [RECORD_TYPE_COMMIT, RECORD_TYPE_ABORT]:
+            self._transaction_records.pop(transaction_id, None)
+        elif record_type == RECORD_TYPE_REORG:
+            self._last_reorg_pos[self._payload_table_name(payload)] = pos
+        elif record_type in [RECORD_TYPE_INSERT, RECORD_TYPE_DELETE, RECORD_TYPE_INSERT_BATCH,
+                             RECORD_TYPE_INDEX_INSERT, RECORD_TYPE_INDEX_DELETE]:
+            self._transaction_records.setdefault(transaction_id, []).append(pos)
 
         # 3. 强制刷盘 (关键步骤)
-        # 确保日志从操作系统缓存写入物理磁盘，实现持久性
+        if force:
+            self.force()
+
+    # -----------------------
+    # 强制刷盘，确保日志从操作系统缓存写入物理磁盘，实现持久性
+    # 修改数据块之前必须调用
+    # -----------------------
+    def force(self):
         self.log_file.flush()
         os.fsync(self.log_file.fileno())
 
+    # -----------------------
+    # 中止一个事务时撤销它的所有修改 (数据和索引)，从后往前，和恢复的撤销阶段一样
+    # 在 ABORT 日志之前调用，这样中途崩溃时恢复会把这些修改撤销完
+    # :param transaction_id: 要撤销的事务ID
+    # -----------------------
+    def rollback(self, transaction_id):
+        self.log_file.flush()
+        for pos in reversed(self._transaction_records.get(transaction_id, [])):
+            self.log_file.seek(pos)
+            record_length, tx_id, record_type = struct.unpack(LOG_HEADER_FORMAT, self.log_file.read(LOG_HEADER_SIZE))
+            payload = self.log_file.read(record_length - LOG_HEADER_SIZE)
+            if self._is_stale(record_type, payload, pos, self._last_reorg_pos):
+                continue  # 表已经被重组，记录不在原来的位置了
+            print(f"  Undoing operation from log for aborted transaction {tx_id}...")
+            self._undo_op(record_type, payload)
+        self._release_tables()
+
     # -----------------------
     # 执行恢复算法，在系统启动时调用
     # 分为三个阶段：Analysis, Redo, Undo
@@ -79,12 +149,25 @@ class LogManager:
         print("[Recovery] Phase 1: Analysis...")
         committed_transactions = set()
         active_transactions = set()
+        last_reorg_pos = {}  # 表名 -> 该表最后一条 REORG 日志的位置
+        last_change_pos = {}  # 表名 -> 该表最后一条修改记录或索引的日志的位置
+        unfinished_reorgs = set()  # 重组之后索引还没有重建的表
         pos = 0
         while pos < len(log_data):
             # 解析头部
             record_length, tx_id, record_type = struct.unpack_from(LOG_HEADER_FORMAT, log_data, pos)
             
-            if record_type == RECORD_TYPE_BEGIN:
+            if record_type == RECORD_TYPE_REORG:
+                table_name = self._payload_table_name(log_data[pos + LOG_HEADER_SIZE : pos + record_length])
+                last_reorg_pos[table_name] = pos
+                unfinished_reorgs.add(table_name)
+            elif record_type == RECORD_TYPE_REORG_DONE:
+                unfinished_reorgs.discard(self._payload_table_name(log_data[pos + LOG_HEADER_SIZE : pos + record_length]))
+            elif record_type in [RECORD_TYPE_INSERT, RECORD_TYPE_DELETE, RECORD_TYPE_INSERT_BATCH,
+                                 RECORD_TYPE_INDEX_INSERT, RECORD_TYPE_INDEX_DELETE]:
+                table_name = self._payload_table_name(log_data[pos + LOG_HEADER_SIZE : pos + record_length])
+                last_change_pos[table_name] = pos
+            elif record_type == RECORD_TYPE_BEGIN:
                 active_transactions.add(tx_id)
             elif record_type == RECORD_TYPE_COMMIT:
                 active_transactions.remove(tx_id)
@@ -100,15 +183,23 @@ class LogManager:
 
         # --- 2. 重做阶段 (Redo) ---
         print("\n[Recovery] Phase 2: Redo...")
+        redone_images = set()  # 重做了块映像的表
         pos = 0
         while pos < len(log_data):
             record_length, tx_id, record_type = struct.unpack_from(LOG_HEADER_FORMAT, log_data, pos)
             payload_pos = pos + LOG_HEADER_SIZE
             payload = log_data[payload_pos : pos + record_length]
 
-            if tx_id in committed_transactions:
+            if record_type == RECORD_TYPE_PAGE_IMAGE:
+                # 块映像之后该表还有修改，说明映像已经写入并同步到磁盘，重做它会覆盖之后的修改
+                if not self._is_stale(record_type, payload, pos, last_reorg_pos) and \
+                        pos > last_change_pos.get(self._payload_table_name(payload), -1):
+                    self._redo_op(record_type, payload)
+                    redone_images.add(self._payload_table_name(payload))
+            elif tx_id in committed_transactions and not self._is_stale(record_type, payload, pos, last_reorg_pos):
                 # 只对已提交事务的修改操作进行重做
-                if record_type in [RECORD_TYPE_INSERT, RECORD_TYPE_DELETE]:
+                if record_type in [RECORD_TYPE_INSERT, RECORD_TYPE_DELETE, RECORD_TYPE_INSERT_BATCH,
+                                   RECORD_TYPE_INDEX_INSERT, RECORD_TYPE_INDEX_DELETE]:
                     print(f"  Redoing operation from log for committed transaction {tx_id}...")
                     self._redo_op(record_type, payload)
 
@@ -121,7 +212,8 @@ class LogManager:
         pos = 0
         while pos < len(log_data):
              record_length, tx_id, record_type = struct.unpack_from(LOG_HEADER_FORMAT, log_data, pos)
-             if tx_id in active_transactions:
+             payload = log_data[pos + LOG_HEADER_SIZE : pos + record_length]
+             if tx_id in active_transactions and not self._is_stale(record_type, payload, pos, last_reorg_pos):
                  undo_records.append((record_length, tx_id, record_type, pos))
              pos += record_length
 
@@ -139,8 +231,53 @@ class LogManager:
             self.log(tx_id, RECORD_TYPE_ABORT)
 
         print("[Undo] Phase completed.")
+
+        # 重做了块映像的表，以及重组之后索引重建之前系统就崩溃了的表，它们的索引日志已经失效，
+        # 重新建立这些表的索引。早已完成的重组不再重建
+        for table_name in sorted(redone_images | unfinished_reorgs):
+            if os.path.exists(table_name.encode('utf-8') + b'.dat'):
+                self._open_table(table_name)._rebuild_indexes()
+                self.log(0, RECORD_TYPE_REORG_DONE, pack_table_payload(table_name.encode('utf-8')))
+
+        self._release_tables()
         print("--- Recovery Process Finished ---")
 
+    # -----------------------
+    # 恢复或撤销中用到的表保持打开，归还给表注册表
+    # -----------------------
+    def _release_tables(self):
+        for table_name in self._recovery_tables:
+            catalog_db.get_table_registry().release(table_name.encode('utf-8'))
+        self._recovery_tables = set()
+
+    # -----------------------
+    # 从payload中解析出表名，所有修改表的日志的payload都以表名开头
+    # -----------------------
+    def _payload_table_name(self, payload):
+        table_name_len, = struct.unpack_from('!I', payload, 0)
+        table_name_bytes, = struct.unpack_from(f'!{table_name_len}s', payload, 4)
+        return table_name_bytes.decode('utf-8')
+
+    # -----------------------
+    # 判断一条修改表的日志是否已经失效：它写在该表最后一次 REORG 之前，其中的位置已经不存在
+    # -----------------------
+    def _is_stale(self, record_type, payload, pos, last_reorg_pos):
+        if record_type not in [RECORD_TYPE_INSERT, RECORD_TYPE_DELETE, RECORD_TYPE_INSERT_BATCH,
+                               RECORD_TYPE_PAGE_IMAGE, RECORD_TYPE_INDEX_INSERT, RECORD_TYPE_INDEX_DELETE]:
+            return False
+        return pos < last_reorg_pos.get(self._payload_table_name(payload), -1)
+
+    # -----------------------
+    # 从表注册表取得表的 Storage 对象，每张表在一次恢复或撤销中只取一次，结束时归还
+    # -----------------------
+    def _open_table(self, table_name):
+        storage = catalog_db.get_table_registry().acquire(table_name.encode('utf-8'))
+        if storage.open and table_name not in self._recovery_tables:
+            self._recovery_tables.add(table_name)
+        else:
+            catalog_db.get_table_registry().release(table_name.encode('utf-8'))
+        return storage
+
     # -----------------------
     # 一个辅助函数，用于从payload中解析出通用信息
     # -----------------------
@@ -162,16 +299,99 @@ class LogManager:
             print(f"  [Error] Failed to parse payload: {e}")
             return None, None, None, None
 
+    # -----------------------
+    # 解析 INSERT_BATCH 的 payload
+    # 格式: <table_name_len> <table_name> <block_id> <first_slot_id> <number_of_records> <record_content_len> <record_contents>
+    # record_content_len 为 0 表示记录是变长的，每条记录内容前有它的长度 <I>
+    # 返回: table_name, block_id, first_slot_id, 记录内容的列表
+    # -----------------------
+    def _parse_batch_payload(self, payload):
+        try:
+            table_name_len, = struct.unpack_from('!I', payload, 0)
+            table_name_bytes, = struct.unpack_from(f'!{table_name_len}s', payload, 4)
+            table_name = table_name_bytes.decode('utf-8')
+            offset = 4 + table_name_len
+
+            block_id, first_slot_id, num_of_records, record_data_len = struct.unpack_from('!IIII', payload, offset)
+            offset += 16
+            if record_data_len > 0:
+                records = [payload[offset + i * record_data_len: offset + (i + 1) * record_data_len]
+                           for i in range(num_of_records)]
+            else:  # 变长记录，每条记录内容前有它的长度
+                records = []
+                for i in range(num_of_records):
+                    record_data_len, = struct.unpack_from('!I', payload, offset)
+                    records.append(payload[offset + 4: offset + 4 + record_data_len])
+                    offset += 4 + record_data_len
+
+            return table_name, block_id, first_slot_id, records
+        except struct.error as e:
+            print(f"  [Error] Failed to parse payload: {e}")
+            return None, None, None, None
+
+
+    # -----------------------
+    # 解析 INDEX_INSERT 和 INDEX_DELETE 的 payload，见 pack_index_payload()
+    # 返回: table_name, field_name (bytes), block_id, slot_id, key
+    # -----------------------
+    def _parse_index_payload(self, payload):
+        try:
+            table_name_len, = struct.unpack_from('!I', payload, 0)
+            table_name = payload[4: 4 + table_name_len].decode('utf-8')
+            offset = 4 + table_name_len
+            field_name_len, = struct.unpack_from('!I', payload, offset)
+            field_name = payload[offset + 4: offset + 4 + field_name_len]
+            offset += 4 + field_name_len
+            block_id, slot_id = struct.unpack_from('!II', payload, offset)
+            return table_name, field_name, block_id, slot_id, payload[offset + 8:]
+        except struct.error as e:
+            print(f"  [Error] Failed to parse payload: {e}")
+            return None, None, None, None, None
+
+    # -----------------------
+    # 重做或撤销一个索引条目的改变
+    # present 为 True 表示条目应该存在 (REDO INDEX_INSERT, UNDO INDEX_DELETE)
+    # -----------------------
+    def _force_index_op(self, payload, present):
+        table_name, field_name, block_id, slot_id, key = self._parse_index_payload(payload)
+        if table_name is None:
+            return
+        storage = self._open_table(table_name)
+        print(f"  {'ADD' if present else 'REMOVE'} INDEX ENTRY on '{table_name}.{field_name.decode('utf-8')}' "
+              f"for Block {block_id}, Slot {slot_id}")
+        storage._force_index_entry(field_name, key, block_id, slot_id, present)
 
     # -----------------------
     # 重做（Redo）：将日志中的操作重新执行一遍，确保数据写入文件。
     # -----------------------
     def _redo_op(self, record_type, payload):
+        if record_type in [RECORD_TYPE_INDEX_INSERT, RECORD_TYPE_INDEX_DELETE]:
+            self._force_index_op(payload, record_type == RECORD_TYPE_INDEX_INSERT)
+            return
+
+        if record_type == RECORD_TYPE_PAGE_IMAGE:
+            table_name = self._payload_table_name(payload)
+            offset = 4 + len(table_name.encode('utf-8'))
+            block_id, = struct.unpack_from('!I', payload, offset)
+            storage = self._open_table(table_name)
+            print(f"  REDO PAGE_IMAGE on table '{table_name}' at Block {block_id}")
+            storage._force_write_page(block_id, payload[offset + 4: offset + 4 + BLOCK_SIZE])
+            return
+
+        if record_type == RECORD_TYPE_INSERT_BATCH:
+            table_name, block_id, first_slot_id, records = self._parse_batch_payload(payload)
+            if table_name is None:
+                return
+            storage = self._open_table(table_name)
+            print(f"  REDO INSERT_BATCH on table '{table_name}' at Block {block_id}, {len(records)} records")
+            storage._force_insert_records_at(block_id, first_slot_id, records)
+            return
+
         table_name, block_id, slot_id, record_data_bytes = self._parse_payload(payload)
         if table_name is None:
             return
 
-        storage = storage_db.Storage(table_name.encode('utf-8'))
+        storage = self._open_table(table_name)
 
         if record_type == RECORD_TYPE_INSERT:
             # Redo一个INSERT操作：强制在指定位置插入记录
@@ -188,11 +408,26 @@ class LogManager:
     # 撤销（Undo）：执行与日志记录相反的操作，回滚未提交的修改。
     # -----------------------
     def _undo_op(self, record_type, payload):
+        if record_type in [RECORD_TYPE_INDEX_INSERT, RECORD_TYPE_INDEX_DELETE]:
+            self._force_index_op(payload, record_type == RECORD_TYPE_INDEX_DELETE)
+            return
+
+        if record_type == RECORD_TYPE_INSERT_BATCH:
+            # Undo一批INSERT操作：逐条删除
+            table_name, block_id, first_slot_id, records = self._parse_batch_payload(payload)
+            if table_name is None:
+                return
+            storage = self._open_table(table_name)
+            print(f"  UNDO INSERT_BATCH on table '{table_name}' at Block {block_id}, {len(records)} records")
+            for slot_id in range(first_slot_id + len(records) - 1, first_slot_id - 1, -1):
+                storage._force_delete_at(block_id, slot_id)
+            return
+
         table_name, block_id, slot_id, record_data_bytes = self._parse_payload(payload)
         if table_name is None:
             return
 
-        storage = storage_db.Storage(table_name.encode('utf-8'))
+        storage = self._open_table(table_name)
 
         if record_type == RECORD_TYPE_INSERT:
             # Undo一个INSERT操作：删除它
@@ -203,15 +438,7 @@ class LogManager:
             # --- 关键修改 ---
             # Undo一个DELETE操作：调用新的 undelete 方法，恢复删除标记位
             print(f"  UNDO DELETE on table '{table_name}' by restoring flag at Block {block_id}, Slot {slot_id}")
-            
-            # 将 record_data_bytes 解码回元组，以便更新 storage 对象的内存列表
-            try:
-                record_str = record_data_bytes.decode('utf-8')
-                original_tuple = tuple(record_str.split(','))
-            except:
-                original_tuple = None # 如果解析失败，传入None
-
-            storage._force_undelete_at(block_id, slot_id, original_tuple)
+            storage._force_undelete_at(block_id, slot_id)
 
 
     # -----------------------
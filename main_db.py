@@ -13,9 +13,11 @@ import os
 
 import head_db  # the main memory structure of table schema
 import schema_db  # the module to process table schema
-import storage_db  # the module to process the storage of instance
 import log_db  # the module to process the transaction log, which is stored in binary format
+import storage_db  # the module to process the storage of instance
 import transaction_db  # the module to process the transaction
+import catalog_db  # the tables open in the program
+import index_db  # the B+ tree indexes on the fields of the tables
 
 import query_plan_db  # for SQL clause of which data is stored in binary format
 import lex_db  # for lex, where data is stored in binary format
@@ -25,7 +27,8 @@ import query_plan_db  # construct the query plan and execute it
 
 PROMPT_STR = '\nInput your choice  \n1:add a new table structure and data \n2:delete a table structure and data\
 \n3:view a table structure and data \n4:delete all tables and data \n5:select from where clause\
-\n6:delete a row according to field keyword \n7:update a row according to field keyword \n. to quit):\n'
+\n6:delete a row according to field keyword \n7:update a row according to field keyword \
+\n8:compact the data of a table \n9:create an index on fields of a table \n10:convert a table into the latest record format \n. to quit):\n'
 
 
 # --------------------------
@@ -49,6 +52,7 @@ def main():
     # The instance data of table is stored in binary format, which corresponds to chapter 2-8 of textbook
 
     schemaObj = schema_db.Schema()  # to create a schema object, which contains the schema of all tables
+    registry = catalog_db.get_table_registry()  # each table is opened once and shared by all the choices
     dataObj = None
     choice = input(PROMPT_STR)
 
@@ -66,14 +70,27 @@ def main():
                 
                 # 创建 Storage 实例时传入 log_manager
                 # 模式修改本身也应该是事务性的，但为简化，此处只将数据插入设为事务性
-                dataObj = storage_db.Storage(tableName, log_manager)
+                dataObj = registry.acquire(tableName, log_manager)
 
                 #  tableName not in all.sch
                 insertFieldList = []
                 if tableName.strip() not in schemaObj.get_table_name_list():
 
                     insertFieldList = dataObj.getFieldList()
-                    schemaObj.appendTable(tableName, insertFieldList)  # add the table structure
+                    # the values of the key fields are unique, an insert with a value already there is rejected
+                    # the key fields are asked again until each of them is a field of the table
+                    while True:
+                        primaryKey = input(f'\033[34mplease input the primary key field (empty for none):\033[0m').strip()
+                        uniqueFields = [name.strip() for name in
+                                        input(f'\033[34mplease input the other unique fields, separated by "," (empty for none):\033[0m').split(',')
+                                        if name.strip()]
+                        if schemaObj.validKeys(insertFieldList, primaryKey or None, uniqueFields):
+                            break
+                        print(f'\033[31mThe key fields are invalid, please input them again.\033[0m')
+                    if not schemaObj.appendTable(tableName, insertFieldList, primaryKey or None, uniqueFields):  # add the table structure
+                        registry.drop(tableName)  # the data file is not left without its schema
+                        raise Exception("The table schema is not created!")
+                    dataObj.create_key_indexes()  # the key fields are checked with these indexes
                     print(f'\033[32mTable schema created.\033[0m')
                 else:
                     # to the students: The following needs to be further implemented (many lines can be added)
@@ -101,7 +118,8 @@ def main():
                     print(f'\033[31mTransaction {tx_id} aborted and rolled back.\033[0m')
             finally:
                 if dataObj:
-                    del dataObj
+                    registry.release(tableName)
+                    dataObj = None
                 choice = input(PROMPT_STR)
 
 
@@ -118,9 +136,7 @@ def main():
 
                     # 假设 delete_table_schema 方法和 delete_table_data 方法都支持事务
                     if schemaObj.delete_table_schema(table_name):  # delete the schema from the schema file
-                        dataObj = storage_db.Storage(table_name, log_manager)  # create an object for the data of table
-                        dataObj.delete_table_data(table_name.strip())  # delete table content from the table file
-                        del dataObj
+                        registry.drop(table_name)  # close the table and delete its table file
 
                         transaction_manager.commit(tx_id)
                         print(f'\033[32mTable {table_name.decode()} and its data deleted. Transaction {tx_id} committed.\033[0m')
@@ -151,9 +167,10 @@ def main():
                     if schemaObj.find_table(table_name.strip()):
                         schemaObj.viewTableStructure(table_name)  # to be implemented
 
-                        dataObj = storage_db.Storage(table_name)  # create an object for the data of table
-                        dataObj.show_table_data()  # view all the data of the table
-                        del dataObj
+                        dataObj = registry.acquire(table_name)  # the object for the data of table
+                        dataObj.show_table_data(use_mmap=True)  # view all the data of the table
+                        registry.release(table_name)
+                        dataObj = None
                     else:
                         print(f'\033[31mtable name is None\033[0m')
             else:
@@ -170,9 +187,7 @@ def main():
                 for table_name in table_name_list:
                     table_name = table_name.strip()
                     if table_name:
-                        stObj = storage_db.Storage(table_name, log_manager)
-                        stObj.delete_table_data(table_name)
-                        del stObj
+                        registry.drop(table_name)
                 schemaObj.deleteAll() # 模式修改
                 transaction_manager.commit(tx_id)
                 print(f'\033[32mAll tables deleted. Transaction {tx_id} committed.\033[0m')
@@ -189,7 +204,7 @@ def main():
             print('#        Your Query is to SQL QUERY                  #')
             sql_str = input(f'\033[34mplease enter the select from where clause:\033[0m')
 
-            lex_db.set_lex_handle()
+            lex_db.set_lex_handle()  # the lexer and the parser are made at the first query, then the lexer is only reset
             parser_db.set_handle()
             common_db.global_syn_tree = None
             common_db.global_logical_tree = None
@@ -197,20 +212,23 @@ def main():
 
             try:
                 print("stripped_str:"+sql_str.strip())
-                lex_db.tokenize_sql(sql_str.strip())  # 先打印token流
+                # 与之前的查询形状相同 (只有常量不同) 时使用缓存的查询计划，不再解析和构建
+                if not query_plan_db.use_cached_plan(sql_str.strip()):
+                    lex_db.tokenize_sql(sql_str.strip())  # 先打印token流
 
-                # 解析SQL构建语法树
-                common_db.global_syn_tree = common_db.global_parser.parse(
-                    sql_str.strip(), lexer=common_db.global_lexer
-                )
+                    # 解析SQL构建语法树
+                    common_db.global_syn_tree = common_db.global_parser.parse(
+                        sql_str.strip(), lexer=common_db.global_lexer
+                    )
 
-                # 打印语法树
-                print("\nSyntax Tree:")
-                common_db.show(common_db.global_syn_tree)
+                    # 打印语法树
+                    print("\nSyntax Tree:")
+                    common_db.show(common_db.global_syn_tree)
 
-                # 构建查询计划
-                print("\nBuilding Query Plan...")
-                query_plan_db.construct_logical_tree()
+                    # 构建查询计划
+                    print("\nBuilding Query Plan...")
+                    query_plan_db.construct_logical_tree()
+                    query_plan_db.cache_plan(sql_str.strip())
 
                 # 执行查询计划
                 print("\nExecuting Query...")
@@ -232,7 +250,7 @@ def main():
                     table_name=table_name.encode('utf-8')
                 
                 if table_name.strip() and schemaObj.find_table(table_name.strip()):
-                    dataObj = storage_db.Storage(table_name, log_manager)
+                    dataObj = registry.acquire(table_name, log_manager)
                     dataObj.show_table_data()
 
                     field_keyword = input(f'\033[34mplease input the field name and the corresponding keyword (\033[33mfieldname:keyword\033[34m):\033[0m')
@@ -244,7 +262,6 @@ def main():
                         dataObj.show_table_data()
                     else:
                         raise Exception("Record not found or delete failed.")
-                    del dataObj
                 else:
                     print(f'\033[33mTable name is None or does not exist\033[0m')
             except Exception as e:
@@ -253,6 +270,9 @@ def main():
                     transaction_manager.abort(tx_id)
                     print(f'\033[31mTransaction {tx_id} aborted.\033[0m')
             finally:
+                if dataObj:
+                    registry.release(table_name)
+                    dataObj = None
                 choice = input(PROMPT_STR)
 
 
@@ -265,7 +285,7 @@ def main():
                     table_name = table_name.encode('utf-8').strip()
 
                 if table_name and schemaObj.find_table(table_name):
-                    dataObj = storage_db.Storage(table_name, log_manager)
+                    dataObj = registry.acquire(table_name, log_manager)
                     dataObj.show_table_data()
                     field_keyword = input(f'\033[34mplease input the field name and the corresponding keyword (\033[33mfieldname:keyword\033[34m):\033[0m')
                     
@@ -290,7 +310,6 @@ def main():
                     transaction_manager.commit(tx_id)
                     print(f'\033[32mUpdate success! Transaction {tx_id} committed.\033[0m')
                     dataObj.show_table_data()
-                    del dataObj
                 else:
                     print(f'\033[33mTable name is None or does not exist\033[0m')
             except Exception as e:
@@ -298,12 +317,115 @@ def main():
                 if tx_id:
                     transaction_manager.abort(tx_id)
                     print(f'\033[31mTransaction {tx_id} aborted.\033[0m')
+            finally:
+                if dataObj:
+                    registry.release(table_name)
+                    dataObj = None
+                choice = input(PROMPT_STR)
+
+
+        elif choice == '8':  # compact the data blocks of a table, the deleted records are dropped
+            try:
+                schemaObj.viewTableNames()
+                table_name = input(f'\033[34mplease input the name of the table to be compacted:\033[0m')
+                if isinstance(table_name, str):
+                    table_name = table_name.encode('utf-8').strip()
+
+                if table_name and schemaObj.find_table(table_name):
+                    dataObj = registry.acquire(table_name, log_manager)
+                    block_range = input(f'\033[34mplease input the range of blocks (\033[33mfirst:last\033[34m), '
+                                        f'or nothing for all the blocks:\033[0m').strip()
+                    if block_range:
+                        first_block, last_block = block_range.split(':', 1)
+                        block_range = (int(first_block), int(last_block))
+                    result = dataObj.vacuum(block_range or None, transaction_manager.active_transactions)
+                    if result is not None:
+                        print(f'\033[32mCompact success! {result[0]} bytes and {result[1]} blocks reclaimed.\033[0m')
+                else:
+                    print(f'\033[33mTable name is None or does not exist\033[0m')
+            except Exception as e:
+                print(f'\033[31mError: {e}\033[0m')
+            finally:
+                if dataObj:
+                    registry.release(table_name)
+                    dataObj = None
+                choice = input(PROMPT_STR)
+
+
+        elif choice == '9':  # create an index on fields, which is kept up to date by the storage from now on
+            try:
+                schemaObj.viewTableNames()
+                table_name = input(f'\033[34mplease input the name of the table to be indexed:\033[0m')
+                if isinstance(table_name, str):
+                    table_name = table_name.encode('utf-8').strip()
+
+                if table_name and schemaObj.find_table(table_name):
+                    # several key fields make a composite index, e.g. dept,name
+                    field_name = input(f'\033[34mplease input the name of the field to be indexed '
+                                       f'(fields separated by commas):\033[0m')
+                    field_names = index_db.index_field_names(field_name.encode('utf-8'))
+                    dataObj = registry.acquire(table_name)
+                    table_field_names = [field[0].strip() for field in dataObj.getFieldList()]
+                    missing = [name for name in field_names if name not in table_field_names]
+                    if field_names and not missing:
+                        kind = input(f'\033[34mplease input the kind of the index (0-> B+ tree; 1-> hash, '
+                                     f'for = only):\033[0m').strip()
+                        kind = index_db.INDEX_KIND_HASH if kind == '1' and len(field_names) == 1 else index_db.INDEX_KIND_BTREE
+                        include_fields = []
+                        compressed = False
+                        if kind == index_db.INDEX_KIND_BTREE:
+                            # the included fields are kept in the leaf entries, so that the queries reading
+                            # only the fields of the index do not read the data blocks
+                            include_fields = index_db.index_field_names(input(
+                                f'\033[34mplease input the fields included in the index, separated by commas '
+                                f'(empty for none):\033[0m').encode('utf-8'))
+                            missing = [name for name in include_fields if name not in table_field_names]
+                            # the nodes with variable-length keys keep long str values whole, so a long str key
+                            # is told apart beyond its first 10 bytes. for int, bool and short str keys, whose
+                            # fixed keys are partly padding, they also hold more entries
+                            compressed = input(f'\033[34mplease input whether the nodes are prefix-compressed '
+                                               f'(y/n, for long str keys, or more entries per node):\033[0m').strip().lower() == 'y'
+                        if not missing:
+                            index = index_db.open_index(table_name, field_names, kind, include_fields, compressed)
+                            num_of_entries = index.create_index(field_names)
+                            index.close()
+                            catalog_db.get_index_catalog().add_index(table_name, field_names, kind)
+                            print(f'\033[32mIndex created with {num_of_entries} entries.\033[0m')
+                    if missing or not field_names:
+                        print(f'\033[33mField {b",".join(missing).decode()} does not exist\033[0m')
+                else:
+                    print(f'\033[33mTable name is None or does not exist\033[0m')
+            except Exception as e:
+                print(f'\033[31mError: {e}\033[0m')
+            finally:
+                if dataObj:
+                    registry.release(table_name)
+                    dataObj = None
+                choice = input(PROMPT_STR)
+
+
+        elif choice == '10':  # convert an old table, e.g. with text records, into the latest record format
+            try:
+                schemaObj.viewTableNames()
+                table_name = input(f'\033[34mplease input the name of the table to be converted:\033[0m')
+                if isinstance(table_name, str):
+                    table_name = table_name.encode('utf-8').strip()
+
+                if table_name and schemaObj.find_table(table_name):
+                    result = storage_db.convert_table_format(table_name, log_manager)
+                    if result is not None:
+                        print(f'\033[32mConvert success! {result[0]} data blocks before, {result[1]} after.\033[0m')
+                else:
+                    print(f'\033[33mTable name is None or does not exist\033[0m')
+            except Exception as e:
+                print(f'\033[31mError: {e}\033[0m')
             finally:
                 choice = input(PROMPT_STR)
 
 
         elif choice == '.':
             print('main loop finishies')
+            registry.close_all()
             del schemaObj
             break
 
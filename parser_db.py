@@ -6,6 +6,8 @@
 # the module is to construct a syntax tree for a "select from where" SQL clause
 # the output is a syntax tree
 # ----------------------------------------------------
+import os
+
 import common_db
 
 # the following two packages need to be installed by yourself
@@ -14,6 +16,8 @@ import ply.lex as lex
 
 from lex_db import tokens
 
+PARSE_TABLE_MODULE = 'parsetab'  # the module written by yacc with the parse tables, see set_handle()
+
 
 # ---------------------------------
 # Query  : SFW
@@ -24,6 +28,7 @@ from lex_db import tokens
 # FromList:TCNAME COMMA FromList
 # FromList:TCNAME
 # Condition: TCNAME EQX CONSTANT
+#   EQX  : = | != | < | <= | > | >=
 # ---------------------------------
 
 
@@ -197,9 +202,14 @@ def p_error(p):
 
 # ------------------------------------------
 # to set the global_parser handle in common_db.py
+# the parser is made once in the program and used for every query. its LALR tables are read
+# from parsetab.py next to the code, they are made and written only if the file is missing
+# or the grammar has changed, since PLY checks the signature of the grammar in the file
 # ---------------------------------------------
 def set_handle():
-    common_db.global_parser = yacc.yacc(write_tables=0)
+    if common_db.global_parser is None:
+        common_db.global_parser = yacc.yacc(debug=False, write_tables=True, tabmodule=PARSE_TABLE_MODULE,
+                                            outputdir=os.path.dirname(os.path.abspath(__file__)))
     if common_db.global_parser is None:
         print('wrong when yacc object is created')
 
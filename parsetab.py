@@ -0,0 +1,44 @@
+
+# parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'AND BOOL COMMA CONSTANT EQX FROM SELECT STRING TCNAME WHERE WILDCARDQuery : SFW\n             | SFSFW : SELECT SelList FROM FromList WHERE CondSF : SELECT SelList FROM FromListSelList : TCNAME COMMA SelListSelList : TCNAMESelList : WILDCARDFromList : TCNAME COMMA FromListFromList : TCNAMECond : Expression\n            | Expression AND ExpressionExpression : TCNAME EQX CONSTANT\n                  | TCNAME EQX STRING\n                  | TCNAME EQX BOOL\n                  '
+    
+_lr_action_items = {'SELECT':([0,],[4,]),'$end':([1,2,3,10,11,15,16,18,21,22,23,24,],[0,-1,-2,-4,-9,-3,-10,-8,-11,-12,-13,-14,]),'TCNAME':([4,8,9,13,14,19,],[6,11,6,17,11,17,]),'WILDCARD':([4,9,],[7,7,]),'FROM':([5,6,7,12,],[8,-6,-7,-5,]),'COMMA':([6,11,],[9,14,]),'WHERE':([10,11,18,],[13,-9,-8,]),'AND':([16,22,23,24,],[19,-12,-13,-14,]),'EQX':([17,],[20,]),'CONSTANT':([20,],[22,]),'STRING':([20,],[23,]),'BOOL':([20,],[24,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'Query':([0,],[1,]),'SFW':([0,],[2,]),'SF':([0,],[3,]),'SelList':([4,9,],[5,12,]),'FromList':([8,14,],[10,18,]),'Cond':([13,],[15,]),'Expression':([13,19,],[16,21,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> Query","S'",1,None,None,None),
+  ('Query -> SFW','Query',1,'p_expr_query','parser_db.py',57),
+  ('Query -> SF','Query',1,'p_expr_query','parser_db.py',58),
+  ('SFW -> SELECT SelList FROM FromList WHERE Cond','SFW',6,'p_expr_sfw','parser_db.py',76),
+  ('SF -> SELECT SelList FROM FromList','SF',4,'p_expr_sw','parser_db.py',87),
+  ('SelList -> TCNAME COMMA SelList','SelList',3,'p_expr_sellist_first','parser_db.py',104),
+  ('SelList -> TCNAME','SelList',1,'p_expr_sellist_second','parser_db.py',122),
+  ('SelList -> WILDCARD','SelList',1,'p_expr_sellist_third','parser_db.py',130),
+  ('FromList -> TCNAME COMMA FromList','FromList',3,'p_expr_fromlist_first','parser_db.py',145),
+  ('FromList -> TCNAME','FromList',1,'p_expr_fromlist_second','parser_db.py',161),
+  ('Cond -> Expression','Cond',1,'p_expr_condition','parser_db.py',175),
+  ('Cond -> Expression AND Expression','Cond',3,'p_expr_condition','parser_db.py',176),
+  ('Expression -> TCNAME EQX CONSTANT','Expression',3,'p_expr_expression','parser_db.py',218),
+  ('Expression -> TCNAME EQX STRING','Expression',3,'p_expr_expression','parser_db.py',219),
+  ('Expression -> TCNAME EQX BOOL','Expression',3,'p_expr_expression','parser_db.py',220),
+]
@@ -9,15 +9,31 @@
 # this module can turn a syntax tree into a query plan tree
 # ----------------------------------------------------------
 
+import collections
+import copy
 import common_db
-import storage_db
+import catalog_db
+import index_db
+import lex_db
+import tool
 import itertools
 
+import ply.lex as lex
+
 # --------------------------------
 # to import the syntax tree, which is defined in parser_db.py
 # -------------------------------------------
 from common_db import global_syn_tree as syn_tree
 
+# an index scan reads the data blocks of the records in the index range one by one, and a table
+# scan reads all the data blocks in order. the index scan is chosen only if it reads at most
+# this fraction of the data blocks
+INDEX_SCAN_MAX_BLOCK_FRACTION = 0.3
+
+# the plans of the latest queries are kept in the plan cache, see PlanCache
+PLAN_CACHE_SIZE = 64
+LITERAL_TOKENS = ('CONSTANT', 'STRING', 'BOOL')  # the tokens taken out of a query as its parameters
+
 
 class parseNode:
     def __init__(self):
@@ -185,6 +201,257 @@ def construct_select_node(wf_node, sel_list):
         return common_db.Node('Proj', [wf_node], sel_list)
 
 
+# ---------------------------
+# to list the comparisons [field, operator, value] joined by AND in a where condition
+# ---------------------------
+def condition_terms(condition):
+    if isinstance(condition, list) and len(condition) == 3 and not isinstance(condition[0], list):
+        return [condition]
+    if isinstance(condition, list) and len(condition) == 2:
+        return condition_terms(condition[0]) + condition_terms(condition[1])
+    return []
+
+
+# ---------------------------
+# to find the bounds of each field in the where condition
+# a field is used if the condition compares it with a value of its type,
+# and the bounds on the same field are combined
+# input:
+#       condition: the where condition, see condition_terms()
+#       field_types: field name (str) -> field type
+# output:
+#       field name -> [low, high, low_inclusive, high_inclusive], None means there is no bound
+# -----------------------------------
+def condition_bounds(condition, field_types):
+    ranges = {}  # field name -> [low, high, low_inclusive, high_inclusive]
+    for field_name, operator, value in condition_terms(condition):
+        if field_name not in field_types or operator not in ('=', '<', '<=', '>', '>='):
+            continue
+        field_type = field_types[field_name]
+        if field_type in (0, 1):
+            if not isinstance(value, str):
+                continue
+        elif field_type == 2:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                continue
+        elif field_type == 3:
+            if not isinstance(value, bool):
+                continue
+
+        bounds = ranges.setdefault(field_name, [None, None, True, True])
+        if operator in ('=', '>', '>='):  # a low bound
+            inclusive = operator != '>'
+            if bounds[0] is None or value > bounds[0] or (value == bounds[0] and not inclusive):
+                bounds[0], bounds[2] = value, inclusive
+        if operator in ('=', '<', '<='):  # a high bound
+            inclusive = operator != '<'
+            if bounds[1] is None or value < bounds[1] or (value == bounds[1] and not inclusive):
+                bounds[1], bounds[3] = value, inclusive
+    return ranges
+
+
+# ---------------------------
+# the indexes of a table, those in the index catalog and the index files on one field made before it
+# output:
+#       list of (index name (str), kind), the index name is the key fields joined by ',', e.g. 'dept,name'
+# -----------------------------------
+def table_indexes(table_name, field_types):
+    index_names = [tool.tryToStr(name) for name in catalog_db.get_index_catalog().indexed_fields(table_name)]
+    index_names += [field_name for field_name in field_types if field_name not in index_names]
+    result = []
+    for index_name in index_names:
+        if not all(tool.tryToStr(name) in field_types for name in index_db.index_field_names(index_name)):
+            continue
+        kind = index_db.index_kind(table_name, index_name)
+        if kind is not None:
+            result.append((index_name, kind))
+    return result
+
+
+# ---------------------------
+# to find the range of one index which has all the records satisfying the where condition
+# the first key fields compared with = make the first values of the bounds, and the bounds of
+# the next key field the last one, see index_db.Index.range_scan(). the keys of an old index
+# on an int or bool field are not ordered as the values, see index_db.KEY_TYPE_LEGACY, and a
+# hash index has no order at all, so only = is used for them
+# input:
+#       table_name
+#       index_name, kind: see table_indexes()
+#       ranges: see condition_bounds()
+#       field_types
+# output:
+#       (low, high, low_inclusive, high_inclusive, score), or None if the index cannot be used
+#       the bounds of a composite index are tuples. the score counts 2 for a key field compared
+#       with = and 1 for a bound of the next key field, the greater the narrower the range
+# -----------------------------------
+def index_range(table_name, index_name, kind, ranges, field_types):
+    key_fields = [tool.tryToStr(name) for name in index_db.index_field_names(index_name)]
+    equal_values = []  # the values of the first key fields compared with =
+    for field_name in key_fields:
+        bounds = ranges.get(field_name)
+        if bounds is None or bounds[0] is None or bounds[0] != bounds[1] or not bounds[2] or not bounds[3]:
+            break
+        equal_values.append(bounds[0])
+
+    low = high = None
+    low_inclusive = high_inclusive = True
+    if len(equal_values) < len(key_fields) and key_fields[len(equal_values)] in ranges:
+        low, high, low_inclusive, high_inclusive = ranges[key_fields[len(equal_values)]]
+    if kind == index_db.INDEX_KIND_HASH:
+        if not equal_values:
+            return None
+        low = high = None
+    if not equal_values and low is None and high is None:
+        return None
+    if not equal_values and field_types[key_fields[0]] in (2, 3):
+        index_obj = index_db.Index(table_name, index_name)
+        key_type = index_obj.key_type
+        index_obj.close()
+        if key_type == index_db.KEY_TYPE_LEGACY:
+            return None
+
+    score = 2 * len(equal_values) + (low is not None) + (high is not None)
+    if len(key_fields) == 1:
+        if equal_values:
+            return equal_values[0], equal_values[0], True, True, score
+        return low, high, low_inclusive, high_inclusive, score
+    low_bound = tuple(equal_values + [low]) if low is not None else (tuple(equal_values) or None)
+    high_bound = tuple(equal_values + [high]) if high is not None else (tuple(equal_values) or None)
+    return low_bound, high_bound, low_inclusive, high_inclusive, score
+
+
+# ---------------------------
+# to find the range of an index which has all the records satisfying the where condition
+# the index with the narrowest range is chosen, see index_range()
+# input:
+#       table_name
+#       condition: the where condition, see condition_terms()
+#       field_types: field name (str) -> field type
+#       with_score: whether the score of the range is given too, see index_range()
+# output:
+#       (index_name, low, high, low_inclusive, high_inclusive), or None if no index can be used
+# -----------------------------------
+def choose_index_range(table_name, condition, field_types, with_score=False):
+    ranges = condition_bounds(condition, field_types)
+    if not ranges:
+        return None
+    best = None
+    for index_name, kind in table_indexes(table_name, field_types):
+        found = index_range(table_name, index_name, kind, ranges, field_types)
+        if found is not None and (best is None or found[-1] > best[-1]):
+            best = (index_name,) + found
+    if best is None or with_score:
+        return best
+    return best[:-1]
+
+
+# ---------------------------
+# to find an index covering a query, namely the fields of the select list and of the where condition
+# are all found in its leaf entries, see index_db.Index.covered_fields(), so that the query is answered
+# without reading the data blocks. the index with the narrowest range is chosen, see index_range(),
+# and an index which has no range for the condition is read from its first leaf node to the last one
+# input:
+#       table_name
+#       condition: the where condition, None if there is no where clause
+#       sel_list: the selected fields, ['*'] for all the fields
+#       field_types: field name (str) -> field type
+#       with_score: whether the score of the range is given too, 0 if the whole index is read
+# output:
+#       (index_name, low, high, low_inclusive, high_inclusive), or None if no index covers the query
+# -----------------------------------
+def choose_covering_index(table_name, condition, sel_list, field_types, with_score=False):
+    if not sel_list or '*' in sel_list:
+        fields = set(field_types)
+    else:
+        fields = set(sel_list)
+    terms = condition_terms(condition)
+    if condition is not None and not terms:
+        return None  # the fields of the condition are not known
+    fields |= {term[0] for term in terms}
+    if not fields <= set(field_types):
+        return None
+
+    ranges = condition_bounds(condition, field_types)
+    best = None
+    for index_name, kind in table_indexes(table_name, field_types):
+        if kind != index_db.INDEX_KIND_BTREE:
+            continue
+        index_obj = index_db.Index(table_name, index_name)
+        covered_fields = {tool.tryToStr(name) for name in index_obj.covered_fields()}
+        index_obj.close()
+        if not fields <= covered_fields:
+            continue
+        found = index_range(table_name, index_name, kind, ranges, field_types) or (None, None, True, True, 0)
+        if best is None or found[-1] > best[-1]:
+            best = (index_name,) + found
+    if best is None or with_score:
+        return best
+    return best[:-1]
+
+
+# ---------------------------
+# to choose how the records of a table are read for a where condition
+# an IndexOnlyScan is chosen if an index covers the query, see choose_covering_index(), unless another
+# index has a narrower range for the condition. otherwise an IndexScan is chosen if an index can be used,
+# see choose_index_range(), and the records in its range lie in few data blocks, see INDEX_SCAN_MAX_BLOCK_FRACTION.
+# if they do not, the covering index is still read rather than the table. otherwise it is a TableScan
+# input:
+#       table_name
+#       condition: the where condition, None if there is no where clause
+#       sel_list: the selected fields, None if the fields of the query are not known
+# output:
+#       the IndexOnlyScan, IndexScan or TableScan node, whose child is the TableName node
+#       the var of the IndexOnlyScan and IndexScan node is [index_name, low, high, low_inclusive, high_inclusive]
+# -----------------------------------
+def choose_access_path(table_name, condition, sel_list=None):
+    table_node = common_db.Node('TableName', [], table_name)
+    if condition is None and sel_list is None:
+        return common_db.Node('TableScan', [table_node])
+
+    registry = catalog_db.get_table_registry()
+    storage = registry.acquire(table_name.encode('utf-8'))
+    try:
+        if not storage.open:
+            return common_db.Node('TableScan', [table_node])
+        field_types = {tool.tryToStr(field[0]): field[1] for field in storage.field_name_list}
+        covering_range = None
+        if sel_list is not None:
+            covering_range = choose_covering_index(table_name, condition, sel_list, field_types, True)
+        index_range = choose_index_range(table_name, condition, field_types, True) if condition is not None else None
+
+        # the covering index is read unless another index has a narrower range, e.g. the covering
+        # index has no range for the condition and is read from its first leaf node to the last one
+        if covering_range is not None and (index_range is None or covering_range[-1] >= index_range[-1]):
+            print(f"access path of {table_name}: IndexOnlyScan on {covering_range[0]}, no data block is read")
+            return common_db.Node('IndexOnlyScan', [table_node], list(covering_range[:-1]))
+        if index_range is None:
+            if condition is not None:
+                print(f"access path of {table_name}: TableScan, no index can be used")
+            return common_db.Node('TableScan', [table_node])
+        index_range = index_range[:-1]
+
+        # the entries in the index range are estimated from the tree instead of being read, so that
+        # the index is walked once, by execute_logical_tree(). each entry is in one data block at most
+        max_blocks = int(storage.data_block_num * INDEX_SCAN_MAX_BLOCK_FRACTION)
+        index_obj = index_db.open_index(table_name, index_range[0])
+        num_of_blocks = min(index_obj.estimate_range(*index_range[1:]), storage.data_block_num)
+        index_obj.close()
+        if num_of_blocks > max_blocks:
+            if covering_range is not None:
+                print(f"access path of {table_name}: IndexOnlyScan on {covering_range[0]}, "
+                      f"the index on {index_range[0]} is not selective enough")
+                return common_db.Node('IndexOnlyScan', [table_node], list(covering_range[:-1]))
+            print(f"access path of {table_name}: TableScan, the index on {index_range[0]} is not selective enough")
+            return common_db.Node('TableScan', [table_node])
+
+        print(f"access path of {table_name}: IndexScan on {index_range[0]}, about {num_of_blocks} of {storage.data_block_num} data blocks")
+        return common_db.Node('IndexScan', [table_node], list(index_range))
+    finally:
+        registry.release(table_name.encode('utf-8'))
+
+
 # ----------------------------------
 # Author: Shuting Guo shutingnjupt@gmail.com
 # to execute the query plan and return the result
@@ -202,9 +469,11 @@ def execute_logical_tree():
     projection_fields = []
     filter_conditions = []
     tables_to_scan = []
+    index_range = None  # the var of the IndexScan or IndexOnlyScan node
+    index_only = False  # whether the records are made from the index leaf nodes
 
     def extract_plan_info(node):
-        nonlocal projection_fields, filter_conditions, tables_to_scan
+        nonlocal projection_fields, filter_conditions, tables_to_scan, index_range, index_only
         if node.value == 'Project':
             # print("1")
             projection_fields = node.var if node.var else []
@@ -213,8 +482,11 @@ def execute_logical_tree():
             # print("2")
             filter_conditions = node.var
 
-        elif node.value == 'TableScan':
+        elif node.value in ('TableScan', 'IndexScan', 'IndexOnlyScan'):
             #　print("3")
+            if node.value in ('IndexScan', 'IndexOnlyScan'):
+                index_range = node.var
+                index_only = node.value == 'IndexOnlyScan'
             if node.children and node.children[0].value == 'TableName':
                 # 访问TableName节点存储的实际表名
                 tables_to_scan.append(node.children[0].var)
@@ -228,11 +500,12 @@ def execute_logical_tree():
     extract_plan_info(common_db.global_logical_tree)
 
     # 执行查询
+    storage = None
     try:
         import tool
-        # 加载表数据（单表查询）
+        # 取得表的 Storage 对象（单表查询），表只在第一次查询时打开，之后的查询直接使用
         table_name = tables_to_scan[0]
-        storage = storage_db.Storage(table_name.encode('utf-8'))
+        storage = catalog_db.get_table_registry().acquire(table_name.encode('utf-8'))
 
         # 获取字段列表
         all_fields = [tool.tryToStr(field[0]) for field in storage.field_name_list]
@@ -254,8 +527,35 @@ def execute_logical_tree():
                 if field not in all_fields:
                     raise Exception(f"Field '{field}' does not exist in table '{table_name}'")
 
-        # 加载所有记录
-        records = storage.record_list
+        # where 条件是 [字段, 运算符, 值]，或者 AND 连接的 [条件, 条件]
+        condition = filter_conditions[0] if filter_conditions else None
+
+        # IndexOnlyScan 从索引的叶子结点得到查询用到的字段值，不读数据块，其他字段为 None
+        # IndexScan 只读取索引范围内的记录，TableScan 逐块扫描记录
+        if index_only:
+            index_field, low, high, low_inclusive, high_inclusive = index_range
+            index_obj = index_db.Index(table_name, index_field)
+            field_positions = [all_fields.index(tool.tryToStr(name)) for name in index_obj.covered_fields()]
+            entries = list(index_obj.covered_scan(low, high, low_inclusive, high_inclusive))
+            index_obj.close()
+            print(f"index only scan on {table_name}.{index_field}: {len(entries)} index entries")
+
+            def index_records():
+                for position, values in entries:
+                    record = [None] * len(all_fields)
+                    for i, value in zip(field_positions, values):
+                        record[i] = value
+                    yield tuple(record)
+            records = index_records()
+        elif index_range is not None:
+            index_field, low, high, low_inclusive, high_inclusive = index_range
+            index_obj = index_db.open_index(table_name, index_field)
+            positions = list(index_obj.range_scan(low, high, low_inclusive, high_inclusive))
+            index_obj.close()
+            print(f"index range scan on {table_name}.{index_field}: {len(positions)} index entries")
+            records = (record for position, record in storage.fetch_records(positions))
+        else:
+            records = (record for position, record in storage.scan(use_mmap=True))
 
         # 应用过滤条件
         def evaluate_condition(record, condition):
@@ -315,21 +615,8 @@ def execute_logical_tree():
 
         # 过滤记录
         if filter_conditions:
-            print("records:")
-            for record in records:
-                print(record.__str__()+"|")
-
-            # print(type(filter_conditions))
-            # print(type(filter_conditions[0]))
-            # print(filter_conditions)
-            # for cond in filter_conditions[0]:
-            #    print(cond.__str__()+"|")
-            if isinstance(filter_conditions[0][0], list):  # 如果查询中有AND，那这东西就是list of list of lists，否则是list of list
-                filter_conditions = filter_conditions[0]  # 转化成list of list,len为1，0号内部多个元素
-            records = [record for record in records if evaluate_condition(record, filter_conditions[0])]
-            print("records under conditions")
-            for record in records:
-                print(record.__str__() + "|")
+            # 索引只用来缩小读取的范围，每条记录仍然按全部条件检查
+            records = (record for record in records if evaluate_condition(record, condition))
 
         # 应用投影
         result = []
@@ -365,6 +652,9 @@ def execute_logical_tree():
 
     except Exception as e:
         print(f"Error executing query: {str(e)}")
+    finally:
+        if storage is not None:
+            catalog_db.get_table_registry().release(table_name.encode('utf-8'))
 
 # --------------------------------
 # Author: Shuting Guo shutingnjupt@gmail.com
@@ -384,11 +674,11 @@ def construct_logical_tree():
             sel_list = [item for item in sel_list if item != ',']
             from_list = [item for item in from_list if item != ',']
 
-            # 构建FROM子树 - 使用TableScan代替X
+            # 构建FROM子树 - 使用TableScan代替X，单表查询的where条件可以用索引时使用IndexScan，
+            # 查询用到的字段都在一个索引的叶子结点中时使用IndexOnlyScan
             if from_list:
                 if len(from_list) == 1:
-                    table_node = common_db.Node('TableName', [], from_list[0])
-                    from_node = common_db.Node('TableScan', [table_node])
+                    from_node = choose_access_path(from_list[0], where_list[0] if where_list else None, sel_list)
                 else:
                     from_node = common_db.Node('Join', [])
                     for table in from_list:
@@ -423,6 +713,207 @@ def construct_logical_tree():
         common_db.global_logical_tree = None
 
 
+# --------------------------------
+# the plan cache keeps the logical trees made by construct_logical_tree(), so that a query of the same
+# shape as a former one is not parsed and planned again. the key of a query is its tokens with the
+# literals taken out, e.g. "select * from emp where age = 42" and "... age = 7" have the same key,
+# and the literals are the parameters which are put into a copy of the cached tree.
+# the access path is chosen once for all the parameters: an IndexScan or IndexOnlyScan gets
+# the range of its index for the new values, but a TableScan chosen because the index was not
+# selective enough stays a TableScan. the cache is emptied when the table schemas or the index
+# catalog change, see common_db.global_schema_version and catalog_db.IndexCatalog.version
+# --------------------------------
+class PlanCache(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       capacity: how many plans are kept, the least recently used one goes first
+    # -------------------------------------
+    def __init__(self, capacity=PLAN_CACHE_SIZE):
+        self.capacity = capacity
+        self.plans = collections.OrderedDict()  # key -> (logical tree, number of parameters, field types)
+        self.versions = None  # (schema version, index catalog version) when the plans were made
+        self.num_of_hits = 0
+        self.num_of_misses = 0
+
+    # ------------------------------
+    # to empty the cache if the plans were made with an older schema or index catalog
+    # -------------------------------------
+    def _check_versions(self):
+        versions = (common_db.global_schema_version, catalog_db.get_index_catalog().version)
+        if versions != self.versions:
+            self.plans.clear()
+            self.versions = versions
+
+    # ------------------------------
+    # to find the plan of a query
+    # input:
+    #       key, params: made by normalize_sql()
+    # output:
+    #       the logical tree with the parameters in it, or None if there is no plan of the query
+    # -------------------------------------
+    def lookup(self, key, params):
+        self._check_versions()
+        entry = self.plans.get(key)
+        if entry is None:
+            self.num_of_misses += 1
+            return None
+        self.plans.move_to_end(key)
+        self.num_of_hits += 1
+        return bind_plan(entry[0], params, entry[2])
+
+    # ------------------------------
+    # to keep the plan of a query
+    # input:
+    #       key, params: made by normalize_sql()
+    #       logical_tree: made by construct_logical_tree() for the query
+    #       field_types: field name (str) -> field type, of the table of a single table query
+    # -------------------------------------
+    def store(self, key, params, logical_tree, field_types):
+        self._check_versions()
+        self.plans[key] = (logical_tree, len(params), field_types)
+        self.plans.move_to_end(key)
+        while len(self.plans) > self.capacity:
+            self.plans.popitem(last=False)
+
+    def clear(self):
+        self.plans.clear()
+
+
+# ------------------------------------------
+# to get the plan cache shared by the whole program
+# the cache is created at the first call and stored in common_db.py
+# -------------------------------------------
+def get_plan_cache():
+    if common_db.global_plan_cache is None:
+        common_db.global_plan_cache = PlanCache()
+    return common_db.global_plan_cache
+
+
+# --------------------------------
+# to turn a query into the key of the plan cache and its parameters
+# input:
+#       sql: the query
+# output:
+#       (key, params), the key is the tuple of the tokens with a placeholder for each literal,
+#       params is the list of the literal values. the key is None if the query cannot be split into tokens
+# --------------------------------
+def normalize_sql(sql):
+    if common_db.global_lexer is None:
+        lex_db.set_lex_handle()
+    lexer = common_db.global_lexer
+    key = []
+    params = []
+    try:
+        lexer.input(sql)
+        for tok in lexer:
+            if tok.type in LITERAL_TOKENS:
+                key.append((tok.type,))
+                params.append(tok.value)
+            else:
+                key.append((tok.type, tok.value))
+    except lex.LexError:
+        return None, []
+    finally:
+        lex_db.reset_lex_handle()
+    return tuple(key), params
+
+
+# --------------------------------
+# to put the parameters into a copy of a cached logical tree
+# the literals of a query are in its where condition, in the order of condition_terms()
+# input:
+#       logical_tree: the cached tree
+#       params: the literal values of the query
+#       field_types: see PlanCache.store()
+# output:
+#       the new tree, the cached tree itself if there is no parameter
+# --------------------------------
+def bind_plan(logical_tree, params, field_types):
+    if not params:
+        return logical_tree
+    logical_tree = copy.deepcopy(logical_tree)
+    nodes = [logical_tree]
+    condition = None
+    while nodes:
+        node = nodes.pop()
+        if node.value == 'Filter':
+            condition = node.var[0]
+            for term, value in zip(condition_terms(condition), params):
+                term[2] = value
+        nodes.extend(child for child in node.children if isinstance(child, common_db.Node))
+
+    # the index range of the access path is found again for the new values
+    nodes = [logical_tree]
+    while nodes:
+        node = nodes.pop()
+        for i, child in enumerate(node.children):
+            if not isinstance(child, common_db.Node):
+                continue
+            if child.value in ('IndexScan', 'IndexOnlyScan') and condition is not None:
+                table_name = child.children[0].var
+                index_name = child.var[0]
+                found = index_range(table_name, index_name, index_db.index_kind(table_name, index_name),
+                                    condition_bounds(condition, field_types), field_types)
+                if found is not None:
+                    child.var = [index_name] + list(found[:-1])
+                elif child.value == 'IndexOnlyScan':  # the whole index is read
+                    child.var = [index_name, None, None, True, True]
+                else:  # e.g. a value of another type, which the index cannot find
+                    node.children[i] = common_db.Node('TableScan', child.children)
+            nodes.append(child)
+    return logical_tree
+
+
+# --------------------------------
+# to use the cached plan of a query, see PlanCache
+# input:
+#       sql: the query
+# output:
+#       True if the plan is found, then it is in global_logical_tree, otherwise False
+# --------------------------------
+def use_cached_plan(sql):
+    key, params = normalize_sql(sql)
+    if key is None:
+        return False
+    cache = get_plan_cache()
+    logical_tree = cache.lookup(key, params)
+    if logical_tree is None:
+        return False
+    common_db.global_logical_tree = logical_tree
+    print(f"plan cache hit ({cache.num_of_hits} hits, {cache.num_of_misses} misses)")
+    return True
+
+
+# --------------------------------
+# to keep the plan in global_logical_tree, which construct_logical_tree() has made for a query
+# input:
+#       sql: the query
+# --------------------------------
+def cache_plan(sql):
+    logical_tree = common_db.global_logical_tree
+    key, params = normalize_sql(sql)
+    if key is None or logical_tree is None:
+        return
+    field_types = {}
+    conditions = []
+    nodes = [logical_tree]
+    while nodes:
+        node = nodes.pop()
+        if node.value == 'Filter':
+            conditions.append(node.var[0])
+        if node.value in ('IndexScan', 'IndexOnlyScan'):
+            storage = catalog_db.get_table_registry().acquire(node.children[0].var.encode('utf-8'))
+            field_types = {tool.tryToStr(field[0]): field[1] for field in storage.field_name_list}
+            catalog_db.get_table_registry().release(node.children[0].var.encode('utf-8'))
+        nodes.extend(child for child in node.children if isinstance(child, common_db.Node))
+    # the literals should be the values of the where condition, in the same order
+    if len(conditions) > 1 or [term[2] for condition in conditions for term in condition_terms(condition)] != params:
+        return
+    get_plan_cache().store(key, params, logical_tree, field_types)
+
+
 # --------------------------------
 # 增强的解析辅助函数
 # --------------------------------
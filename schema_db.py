@@ -10,7 +10,9 @@
 
 
 import ctypes
+import os
 import struct
+import common_db
 import head_db # it is main memory structure for the table schema
 import tool 
 
@@ -56,6 +58,20 @@ MAX_FIELD_SECTION_SIZE=FIELD_ENTRY_SIZE_PER_TABLE*MAX_TABLE_NUM #the THIRD part
 BODY_BEGIN_INDEX=META_HEAD_SIZE+TABLE_NAME_HEAD_SIZE            # Intitially, where the field name, type and length are stored
 
 
+# the following is the key section after the body, which keeps the key fields of the tables
+# a table without key fields has no entry, the entries end with an empty table name
+"""
+tablename|primaryKey|uniqueMask|....|tablename|primaryKey|uniqueMask|
+10 bytes |4 bytes   |4 bytes
+primaryKey   # the number of the primary key field, -1 if there is no primary key
+uniqueMask   # bit i is set if the values of field i are unique, the primary key field is not included
+"""
+NO_PRIMARY_KEY=-1
+KEY_ENTRY_LEN=MAX_TABLE_NAME_LEN+4+4                        # the length of one key entry
+KEY_SECTION_BEGIN=BODY_BEGIN_INDEX+MAX_FIELD_SECTION_SIZE   # the FOURTH part in the schema file
+KEY_SECTION_SIZE=MAX_TABLE_NUM*KEY_ENTRY_LEN
+
+
 # -----------------------------
 # the table name is padded if its lenght is smaller than MAX_TABLE_NAME_WHEN
 # input:
@@ -67,6 +83,43 @@ def fillTableName(tableName): # it should be 10 bytes
         return tableName
 
 
+# -----------------------------
+# to read the key section of the schema file
+# input:
+#       buf: the content of the schema file
+#       offset: where the key section begins in buf
+# output:
+#       a dictionary, each element is (tablename, (primaryKey, list of the numbers of the unique fields))
+# -------------------------------
+def unpackKeys(buf,offset=KEY_SECTION_BEGIN):
+    tableKeys={}
+    if len(buf)<offset+KEY_ENTRY_LEN: # the schema file is written before the key section
+        return tableKeys
+    for i in range(min(MAX_TABLE_NUM,(len(buf)-offset)//KEY_ENTRY_LEN)):
+        tempName,primaryKey,uniqueMask=struct.unpack_from('!10sii',buf,offset+i*KEY_ENTRY_LEN)
+        if not tempName.strip(b' \x00'):
+            break
+        tableKeys[tempName.strip()]=(primaryKey,[j for j in range(MAX_NUM_OF_FIELD_PER_TABLE) if uniqueMask&(1<<j)])
+    return tableKeys
+
+
+# -----------------------------
+# the key fields of a table, read from the schema file without a Schema object, e.g. by storage_db.py
+# input:
+#       table_name
+# output:
+#       list of the numbers of the key fields, the primary key field comes first
+# -------------------------------
+def read_table_keys(table_name):
+    if not os.path.exists(Schema.fileName):
+        return []
+    with open(Schema.fileName,'rb') as fileObj:
+        fileObj.seek(KEY_SECTION_BEGIN)
+        buf=fileObj.read(KEY_SECTION_SIZE)
+    primaryKey,uniqueFields=unpackKeys(buf,0).get(tool.tryToBytes(table_name).strip(),(NO_PRIMARY_KEY,[]))
+    return ([primaryKey] if primaryKey!=NO_PRIMARY_KEY else [])+uniqueFields
+
+
 class Schema(object):
     '''
     Schema class
@@ -104,9 +157,10 @@ class Schema(object):
 
         # 字段类型映射
         type_map = {0: 'str', 1: 'varstr', 2: 'int', 3: 'bool'}
-        print(f"{'Field Name':<15}{'Type':<10}{'Length':<10}")
-        print('-' * 35)
-        for field in fields:
+        primaryKey, uniqueFields = self.headObj.tableKeys.get(table_name.strip(), (NO_PRIMARY_KEY, []))
+        print(f"{'Field Name':<15}{'Type':<10}{'Length':<10}{'Key':<10}")
+        print('-' * 45)
+        for i, field in enumerate(fields):
             # 处理字段名
             field_name = field[0].strip()
             if isinstance(field[0], bytes):
@@ -114,7 +168,8 @@ class Schema(object):
 
             field_type = type_map.get(field[1], str(field[1]))
             field_length = field[2]
-            print(f"{field_name:<15}{field_type:<10}{field_length:<10}")
+            key = 'primary' if i == primaryKey else ('unique' if i in uniqueFields else '')
+            print(f"{field_name:<15}{field_type:<10}{field_length:<10}{key:<10}")
 
     # ------------------------------------------------
     # constructor of the class
@@ -126,7 +181,7 @@ class Schema(object):
         self.fileObj = open(Schema.fileName, 'rb+')  # in binary format
 
         # read all data from schema file
-        bufLen = META_HEAD_SIZE + TABLE_NAME_HEAD_SIZE + MAX_FIELD_SECTION_SIZE  # the length of metahead, table name entries and feildName sections
+        bufLen = META_HEAD_SIZE + TABLE_NAME_HEAD_SIZE + MAX_FIELD_SECTION_SIZE + KEY_SECTION_SIZE  # the length of metahead, table name entries, feildName and key sections
         buf = ctypes.create_string_buffer(bufLen)
         buf = self.fileObj.read(bufLen)
 
@@ -216,7 +271,7 @@ class Schema(object):
 
                 # the main memory structure for schema is constructed
 
-                self.headObj = head_db.Header(nameList, fieldsList, True, tempTableNum, tempOffset)
+                self.headObj = head_db.Header(nameList, fieldsList, True, tempTableNum, tempOffset, unpackKeys(buf))
 
     # ----------------------------
     # destructor of the class
@@ -239,12 +294,14 @@ class Schema(object):
     def deleteAll(self):
         self.headObj.tableFields={}
         self.headObj.tableNames=[]
+        self.headObj.tableKeys={}
         self.fileObj.seek(0)
         self.fileObj.truncate(0)
         self.headObj.isStored = False
         self.headObj.lenOfTableNum = 0
         self.headObj.offsetOfBody = self.body_begin_index
         self.fileObj.flush()
+        common_db.global_schema_version += 1
         print ("all.sch file has been truncated")
 
     # -----------------------------
@@ -252,13 +309,21 @@ class Schema(object):
     # input:
     #       tablename: the table to be added
     #       fieldList: the field information list and each element is a tuple(fieldname,fieldtype,fieldlength)
+    #       primaryKey: the name of the primary key field, None if there is no primary key
+    #       uniqueFields: the names of the other fields whose values are unique
     # -------------------------------
-    def appendTable(self, tableName, fieldList):  # it modify the tableNameHead and body of all.sch
+    def appendTable(self, tableName, fieldList, primaryKey=None, uniqueFields=()):  # it modify the tableNameHead and body of all.sch
         print ("appendTable begins to execute")
         tableName.strip()
 
+        fieldNames = [tool.tryToBytes(field[0]).strip() for field in fieldList]
+        keyNames = [tool.tryToBytes(name).strip() for name in ([primaryKey] if primaryKey else []) + list(uniqueFields)]
         if len(tableName) == 0 or len(tableName) > 10 or len(fieldList)==0:
             print ('tablename is invalid or field list is invalid')
+            return False
+        elif not self.validKeys(fieldList, primaryKey, uniqueFields):
+            print ('the key fields are invalid')
+            return False
         else:
 
             fieldNum = len(fieldList)
@@ -307,6 +372,52 @@ class Schema(object):
             tableName = tool.tryToBytes(tableName)  # convert to bytes if it is string
             self.headObj.tableFields[tableName]=fieldList
 
+            # the primary key and the unique fields, the key section is written again
+            keyNumbers = [fieldNames.index(name) for name in keyNames]
+            if keyNumbers:
+                self.headObj.tableKeys[tableName.strip()] = (keyNumbers[0] if primaryKey else NO_PRIMARY_KEY,
+                                                             keyNumbers[1:] if primaryKey else keyNumbers)
+            self.writeKeys()
+            return True
+
+    # -----------------------------
+    # to check the key fields of a new table, each of them is a field of the table and none is repeated
+    # input:
+    #       fieldList: list of (field name, field type, field length)
+    #       primaryKey: the primary key field name or None
+    #       uniqueFields: the other unique field names
+    # output:
+    #       True or False
+    # -------------------------------
+    def validKeys(self, fieldList, primaryKey=None, uniqueFields=()):
+        fieldNames = [tool.tryToBytes(field[0]).strip() for field in fieldList]
+        keyNames = [tool.tryToBytes(name).strip() for name in ([primaryKey] if primaryKey else []) + list(uniqueFields)]
+        return all(name in fieldNames for name in keyNames) and len(set(keyNames)) == len(keyNames)
+
+    # -----------------------------
+    # to write the key section of the schema file from the main memory structure
+    # storage_db.py reads the keys with read_table_keys() when common_db.global_schema_version changes
+    # -------------------------------
+    def writeKeys(self):
+        keyBuf = ctypes.create_string_buffer(KEY_SECTION_SIZE)
+        for idx, (tableName, (primaryKey, uniqueFields)) in enumerate(self.headObj.tableKeys.items()):
+            uniqueMask = sum(1 << j for j in uniqueFields)
+            struct.pack_into('!10sii', keyBuf, idx * KEY_ENTRY_LEN, fillTableName(tableName) or tableName, primaryKey, uniqueMask)
+        self.fileObj.seek(KEY_SECTION_BEGIN)
+        self.fileObj.write(keyBuf)
+        self.fileObj.flush()
+        common_db.global_schema_version += 1
+
+    # -----------------------------
+    # the key fields of a table
+    # input
+    #       table_name
+    # output
+    #       (the number of the primary key field or NO_PRIMARY_KEY, list of the numbers of the unique fields)
+    # -------------------------------
+    def get_table_keys(self, table_name):
+        return self.headObj.tableKeys.get(tool.tryToBytes(table_name).strip(), (NO_PRIMARY_KEY, []))
+
     # -------------------------------
     # to determine whether the table named table_name exist, depending on the main memory structures
     # input
@@ -379,6 +490,8 @@ class Schema(object):
             
             del self.headObj.tableNames[tmpIndex]
             del self.headObj.tableFields[table_name.strip()]
+            self.headObj.tableKeys.pop(table_name.strip(), None)
+            self.writeKeys()
             #print self.headObj.tableFields
             self.headObj.lenOfTableNum-=1
 
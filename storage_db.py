@@ -19,7 +19,25 @@ from common_db import BLOCK_SIZE
 # block_id                                # 0
 # number_of_dat_blocks                    # at first it is 0 because there is no data in the table
 # number_of_fields or number_of_records   # the total number of fields for the table
+# field_0_name|field_0_type|field_0_length
+# ...
+# free space
+# ...
+# number_of_fsm_entries                   # the free space map, which lies at FSM_OFFSET
+# fsm_entry_0_block_id|fsm_entry_0_reusable_slots
+# ...
+# record_format                           # the last 4 bytes of the block, see RECORD_FORMAT_*
 # -----------------------------------------------------------------------------------------
+RECORD_FORMAT_TEXT = 0  # every field value is stored as text padded with spaces on the left
+RECORD_FORMAT_BINARY = 1  # int is stored as a 4 or 8 bytes big-endian integer, bool as one byte
+RECORD_FORMAT_VARIABLE = 2  # like RECORD_FORMAT_BINARY, but a varstr only takes the bytes of its value
+RECORD_FORMAT_OFFSET = BLOCK_SIZE - 4  # where record_format lies in block 0
+
+# the free space map keeps the data blocks which have deleted records, with the number
+# of their deleted slots. an insert reuses such a slot before it appends a record.
+# a block is not kept if the map is full, so the map may miss some deleted slots
+FSM_MAX_ENTRIES = 128
+FSM_OFFSET = RECORD_FORMAT_OFFSET - 4 - FSM_MAX_ENTRIES * 8  # where the free space map lies in block 0
 
 
 # the data type is as follows
@@ -56,13 +74,442 @@ from common_db import BLOCK_SIZE
 # ...
 # field_n_value
 # -------------------------
+# each field value takes a fixed width
+# in RECORD_FORMAT_TEXT, a field takes field length bytes
+# in RECORD_FORMAT_BINARY, str and varstr take field length bytes padded with zeros,
+# int takes 4 bytes if field length < 10 (8 bytes otherwise) and bool takes 1 byte
+#
+# in RECORD_FORMAT_VARIABLE, the record content is as follows
+# -----------------------------
+# the values of the fields other than varstr, in the order of the fields, as in RECORD_FORMAT_BINARY
+# varstr_0_end                # 2 bytes, the end of the value of the first varstr field in the varstr area
+# ...
+# varstr_m_end
+# varstr_0_value|...|varstr_m_value    # the varstr area, each value takes only its own bytes
+# -----------------------------
+# so the records of such a table have different lengths. a new record is put just below
+# the record in the previous slot, and a block is full when the free space between the
+# offsets and the records cannot hold the record and its offset
 
 
 import struct
 import os
-import ctypes
+import mmap
 import tool
 import log_db
+import buffer_db
+import common_db
+import catalog_db
+import index_db
+import schema_db
+
+
+# --------------------------------------------
+# the record format of a new table, or of a table after convert_table_format()
+# tables with varstr fields use RECORD_FORMAT_VARIABLE, the others RECORD_FORMAT_BINARY
+# --------------------------------------------
+def latest_record_format(field_name_list):
+    if any(field[1] == 1 for field in field_name_list):
+        return RECORD_FORMAT_VARIABLE
+    return RECORD_FORMAT_BINARY
+
+
+# --------------------------------------------
+# to make the slots deleted by a transaction reusable, when the transaction commits, or aborts
+# and its deletes have been undone. until then the recovery may undo the delete, which needs
+# the deleted record in its slot
+# input:
+#       transaction_id
+# --------------------------------------------
+def release_deleted_slots(transaction_id):
+    for slot, deleter in list(common_db.global_uncommitted_deletes.items()):
+        if deleter == transaction_id:
+            del common_db.global_uncommitted_deletes[slot]
+
+
+# --------------------------------------------
+# the class encodes and decodes the records of one table
+# it is built once from the field list of the table, so that the struct
+# formats are compiled once instead of once per record
+# --------------------------------------------
+class RecordCodec(object):
+
+    # ------------------------------
+    # constructor of the class
+    # input:
+    #       field_name_list: each element is (field name, field type, field length)
+    #       record_format: RECORD_FORMAT_TEXT, RECORD_FORMAT_BINARY or RECORD_FORMAT_VARIABLE
+    # -------------------------------------
+    def __init__(self, field_name_list, record_format=RECORD_FORMAT_TEXT):
+        self.field_name_list = field_name_list
+        self.record_format = record_format
+
+        self.block_head_struct = struct.Struct('!ii')  # block_id, number of records
+        self.head_struct = struct.Struct('!ii10si')  # pointer, length of record, time stamp, is_deleted
+        self.slot_struct = struct.Struct('!i')  # the offset of a record
+        # the varstr fields of RECORD_FORMAT_VARIABLE are kept out of content_struct, the others
+        # are stored one after another, each of which has a fixed width
+        self.var_fields = [i for i, field in enumerate(field_name_list)
+                           if record_format == RECORD_FORMAT_VARIABLE and field[1] == 1]
+        self.fixed_fields = [i for i in range(len(field_name_list)) if i not in self.var_fields]
+        # the function turning the stored value of each field into its value is None if nothing is to be done
+        content_format = ''
+        self.converters = []
+        for field in field_name_list:
+            if record_format in (RECORD_FORMAT_BINARY, RECORD_FORMAT_VARIABLE):
+                if field[1] == 2:  # int
+                    content_format += 'i' if field[2] < 10 else 'q'
+                    self.converters.append(None)
+                elif field[1] == 3:  # bool
+                    content_format += '?'
+                    self.converters.append(None)
+                elif field[1] == 1 and record_format == RECORD_FORMAT_VARIABLE:  # varstr
+                    self.converters.append(None)
+                else:  # str and varstr
+                    content_format += str(field[2]) + 's'
+                    self.converters.append(lambda t: t.rstrip(b'\x00'))
+            else:
+                content_format += str(field[2]) + 's'
+                if field[1] == 2:  # int
+                    self.converters.append(int)
+                elif field[1] == 3:  # bool
+                    self.converters.append(lambda t: tool.parseBool(t) is True)
+                else:  # str and varstr
+                    self.converters.append(bytes.strip)
+        self._identity = all(convert is None for convert in self.converters)
+
+        if self.var_fields:
+            # the fixed part is followed by the end of each varstr value
+            self.content_struct = struct.Struct('!' + content_format + 'H' * len(self.var_fields))
+            self.record_struct = None
+            self.record_len = None  # the records have different lengths
+            # the position of each field in (fixed values + varstr values)
+            self._field_order = [self.fixed_fields.index(i) if i in self.fixed_fields
+                                 else len(self.fixed_fields) + self.var_fields.index(i)
+                                 for i in range(len(field_name_list))]
+        else:
+            self.content_struct = struct.Struct('!' + content_format)
+            self.record_struct = struct.Struct('!ii10si' + content_format)  # record head and record content
+            self.record_len = self.record_struct.size
+
+        self._slot_structs = {}  # number of records -> struct of the offset table
+        self._packed_offsets = {}  # number of records -> offsets when the records are packed from the end
+
+    # ------------------------------
+    # to turn the stored field values of a record into a tuple of values
+    # -------------------------------------
+    def decode_values(self, stored_values):
+        if self._identity:
+            return tuple(stored_values)
+        return tuple([t if convert is None else convert(t) for convert, t in zip(self.converters, stored_values)])
+
+    # ------------------------------
+    # to decode the record content of RECORD_FORMAT_VARIABLE
+    # input:
+    #       data_block: the block buffer
+    #       content_offset: where the record content begins in the block
+    # output:
+    #       the tuple of the field values
+    # -------------------------------------
+    def _decode_variable(self, data_block, content_offset):
+        stored_values = self.content_struct.unpack_from(data_block, content_offset)
+        num_of_fixed = len(self.fixed_fields)
+        values = list(stored_values[:num_of_fixed])
+
+        var_begin = content_offset + self.content_struct.size
+        begin = 0
+        for end in stored_values[num_of_fixed:]:
+            values.append(bytes(data_block[var_begin + begin:var_begin + end]))
+            begin = end
+        return self.decode_values([values[i] for i in self._field_order])
+
+    # ------------------------------
+    # to turn field values into the record content
+    # input:
+    #       values: the value of each field, namely bytes, int or bool
+    # output:
+    #       the record content (bytes)
+    #       ValueError or struct.error is raised if a value does not fit its field
+    # -------------------------------------
+    def encode_values(self, values):
+        if self.record_format == RECORD_FORMAT_BINARY:
+            return self.content_struct.pack(*values)  # str is padded with zeros by struct
+
+        if self.record_format == RECORD_FORMAT_VARIABLE:
+            var_values = []
+            var_ends = []
+            end = 0
+            for i in self.var_fields:
+                value = tool.tryToBytes(values[i])
+                if len(value) > self.field_name_list[i][2]:
+                    raise ValueError('the value is too long for the field')
+                end += len(value)
+                var_values.append(value)
+                var_ends.append(end)
+            return self.content_struct.pack(*[values[i] for i in self.fixed_fields], *var_ends) + b''.join(var_values)
+
+        stored_values = []
+        for field, value in zip(self.field_name_list, values):
+            if isinstance(value, bool):
+                text = (b'True' if value else b'False') if field[2] >= 5 else (b'1' if value else b'0')
+            else:
+                text = tool.tryToBytes(str(value) if isinstance(value, int) else value)
+            if len(text) > field[2]:
+                raise ValueError('the value is too long for the field')
+            stored_values.append(text.rjust(field[2]))
+        return b''.join(stored_values)
+
+    # ------------------------------
+    # to check a record given as text and turn it into the record content
+    # input:
+    #       insert_record: list of str, e.g. ['xuyidan','23','True']
+    # output:
+    #       the record content (bytes), or None if the record is wrong
+    # -------------------------------------
+    def encode_record(self, insert_record):
+        if len(insert_record) != len(self.field_name_list):
+            return None
+        values = []
+        for field, value in zip(self.field_name_list, insert_record):
+            value = tool.tryToStr(value)
+            if field[1] == 2:  # int
+                try:
+                    value = int(value)
+                except ValueError:
+                    return None
+            elif field[1] == 3:  # bool
+                value = tool.parseBool(value)
+                if value is None:
+                    return None
+            else:  # str and varstr
+                value = value.encode('utf-8')
+                if len(value) > field[2]:
+                    return None
+            values.append(value)
+
+        try:
+            record_data_bytes = self.encode_values(values)
+        except (ValueError, struct.error):  # e.g. the int is too large
+            return None
+        if self.record_space(record_data_bytes) > BLOCK_SIZE - self.block_head_struct.size:
+            return None  # the record cannot be put into one data block
+        return record_data_bytes
+
+    # ------------------------------
+    # the space taken in a data block by a record and its offset
+    # input:
+    #       record_data_bytes: the record content
+    # -------------------------------------
+    def record_space(self, record_data_bytes):
+        return self.head_struct.size + len(record_data_bytes) + self.slot_struct.size
+
+    # ------------------------------
+    # where the free space of a data block ends, namely the offset of the record in the previous slot
+    # input:
+    #       data_block: the block buffer
+    #       slot_id: the slot of the next record
+    # -------------------------------------
+    def _free_space_end(self, data_block, slot_id):
+        if slot_id == 0:
+            return BLOCK_SIZE
+        return self.slot_struct.unpack_from(data_block,
+                                            self.block_head_struct.size + (slot_id - 1) * self.slot_struct.size)[0]
+
+    # ------------------------------
+    # the free space between the offsets and the records of a data block
+    # input:
+    #       data_block: the block buffer
+    # output:
+    #       (number of records, bytes of free space)
+    # -------------------------------------
+    def free_space(self, data_block):
+        Number_of_Records = self.block_head_struct.unpack_from(data_block, 0)[1]
+        free_space = self._free_space_end(data_block, Number_of_Records) - self.block_head_struct.size - \
+                     Number_of_Records * self.slot_struct.size
+        return Number_of_Records, free_space
+
+    # ------------------------------
+    # the deleted slots of a data block and the space of each, in which a new record can be put
+    # input:
+    #       data_block: the block buffer
+    # output:
+    #       a list of (slot_id, bytes of space for the record head and content)
+    # -------------------------------------
+    def deleted_slots(self, data_block):
+        Number_of_Records = self.block_head_struct.unpack_from(data_block, 0)[1]
+        result = []
+        for slot_id in range(Number_of_Records):
+            offset = self.slot_struct.unpack_from(data_block, self.block_head_struct.size + slot_id * self.slot_struct.size)[0]
+            if self.head_struct.unpack_from(data_block, offset)[3]:  # is_deleted
+                result.append((slot_id, self._free_space_end(data_block, slot_id) - offset))
+        return result
+
+    # ------------------------------
+    # the contents of all the records in a data block, including the deleted ones
+    # input:
+    #       data_block: the block buffer
+    # output:
+    #       a list of (is_deleted, record content) in the order of the slots
+    # -------------------------------------
+    def record_contents(self, data_block):
+        Number_of_Records = self.block_head_struct.unpack_from(data_block, 0)[1]
+        result = []
+        for slot_id in range(Number_of_Records):
+            offset = self.slot_struct.unpack_from(data_block, self.block_head_struct.size + slot_id * self.slot_struct.size)[0]
+            pointer, record_content_len, update_time, is_deleted = self.head_struct.unpack_from(data_block, offset)
+            content_offset = offset + self.head_struct.size
+            result.append((is_deleted, bytes(data_block[content_offset:content_offset + record_content_len])))
+        return result
+
+    # ------------------------------
+    # to split records into the data blocks they are put into, a block is filled until
+    # the next record and its offset do not fit its free space
+    # input:
+    #       contents: list of record contents
+    #       block_id, first_slot_id, free_space: the block the first record goes to, its next slot and free space
+    # output:
+    #       a list of (block_id, first_slot_id, records), the following blocks are new ones
+    # -------------------------------------
+    def split_into_blocks(self, contents, block_id, first_slot_id, free_space):
+        block_batches = []
+        records = []
+        for record_data_bytes in contents:
+            space = self.record_space(record_data_bytes)
+            if space > free_space:  # go on with a new block
+                if records:
+                    block_batches.append((block_id, first_slot_id, records))
+                block_id, first_slot_id, records = block_id + 1, 0, []
+                free_space = BLOCK_SIZE - self.block_head_struct.size
+            records.append(record_data_bytes)
+            free_space -= space
+        if records:
+            block_batches.append((block_id, first_slot_id, records))
+        return block_batches
+
+    # ------------------------------
+    # to write one record and its offset into a data block in main memory
+    # a new record is put below the record in the previous slot, a record written again
+    # into an existing slot (e.g. by the recovery) stays where it is.
+    # the number of records in the block head is not changed here
+    # input:
+    #       data_block: the block buffer
+    #       slot_id: the slot of the record in the block
+    #       record_data_bytes: the record content
+    #       update_time: the time stamp in the record head
+    # -------------------------------------
+    def pack_record(self, data_block, slot_id, record_data_bytes, update_time=b'2016-11-16'):
+        record_content_len = len(record_data_bytes)
+        record_head_len = self.head_struct.size
+        record_len = record_head_len + record_content_len
+
+        # update data offset
+        offset = self.block_head_struct.size + slot_id * self.slot_struct.size
+        if slot_id < self.block_head_struct.unpack_from(data_block, 0)[1]:
+            beginIndex = self.slot_struct.unpack_from(data_block, offset)[0]
+        else:
+            beginIndex = self._free_space_end(data_block, slot_id) - record_len
+        self.slot_struct.pack_into(data_block, offset, beginIndex)
+
+        # update data
+        record_schema_address = struct.calcsize('!iii')
+        self.head_struct.pack_into(data_block, beginIndex, record_schema_address, record_content_len, update_time, 0)  # 0表示未删除
+        data_block[beginIndex + record_head_len:beginIndex + record_len] = record_data_bytes
+
+    # ------------------------------
+    # to write records into consecutive slots of a data block and set the block head
+    # input:
+    #       data_block: the block buffer
+    #       block_id
+    #       first_slot_id: the slot of the first record
+    #       records: list of record contents
+    #       update_time: the time stamp in the record heads
+    # -------------------------------------
+    def pack_block(self, data_block, block_id, first_slot_id, records, update_time=b'2016-11-16'):
+        for i, record_data_bytes in enumerate(records):
+            self.pack_record(data_block, first_slot_id + i, record_data_bytes, update_time)
+        Number_of_Records = self.block_head_struct.unpack_from(data_block, 0)[1]
+        self.block_head_struct.pack_into(data_block, 0, block_id, max(Number_of_Records, first_slot_id + len(records)))
+
+    # ------------------------------
+    # to decode all the records in one data block in one pass
+    # if the records have the same length and are packed from the end of the block,
+    # which is what insert_record does, they are decoded with one iter_unpack over the record area
+    # input:
+    #       data_block: the content of the block
+    #       block_id
+    # output:
+    #       a list of (position, record) for the records which are not deleted,
+    #       where position is (block_id, slot_id)
+    # -------------------------------------
+    def decode_block(self, data_block, block_id):
+        Number_of_Records = self.block_head_struct.unpack_from(data_block, 0)[1]
+        if Number_of_Records <= 0:
+            return []
+
+        if Number_of_Records not in self._slot_structs:
+            self._slot_structs[Number_of_Records] = struct.Struct('!' + str(Number_of_Records) + 'i')
+            if self.record_len is not None:
+                self._packed_offsets[Number_of_Records] = tuple(
+                    range(BLOCK_SIZE - self.record_len, BLOCK_SIZE - (Number_of_Records + 1) * self.record_len,
+                          -self.record_len))
+        offsets = self._slot_structs[Number_of_Records].unpack_from(data_block, self.block_head_struct.size)
+
+        result = []
+        if self.record_len is None:  # RECORD_FORMAT_VARIABLE, each record is decoded at its offset
+            for slot_id, offset in enumerate(offsets):
+                if self.head_struct.unpack_from(data_block, offset)[3]:  # is_deleted
+                    continue
+                result.append(((block_id, slot_id), self._decode_variable(data_block, offset + self.head_struct.size)))
+            return result
+
+        if offsets == self._packed_offsets[Number_of_Records]:
+            # record i lies at BLOCK_SIZE - (i + 1) * record_len, so the record area is read backwards
+            with memoryview(data_block) as block_view:
+                with block_view[BLOCK_SIZE - Number_of_Records * self.record_len:BLOCK_SIZE] as record_area:
+                    records = list(self.record_struct.iter_unpack(record_area))
+            records.reverse()
+        else:
+            records = [self.record_struct.unpack_from(data_block, offset) for offset in offsets]
+
+        for slot_id, values in enumerate(records):
+            if values[3]:  # is_deleted
+                continue
+            result.append(((block_id, slot_id), self.decode_values(values[4:])))
+        return result
+
+    # ------------------------------
+    # to decode one record of a data block, without decoding the others
+    # input:
+    #       data_block: the content of the block
+    #       slot_id
+    # output:
+    #       the record, or None if the slot does not exist or the record is deleted
+    # -------------------------------------
+    def decode_slot(self, data_block, slot_id):
+        Number_of_Records = self.block_head_struct.unpack_from(data_block, 0)[1]
+        if slot_id < 0 or slot_id >= Number_of_Records:
+            return None
+        offset = self.slot_struct.unpack_from(data_block, self.block_head_struct.size + slot_id * self.slot_struct.size)[0]
+
+        if self.record_len is None:  # RECORD_FORMAT_VARIABLE
+            if self.head_struct.unpack_from(data_block, offset)[3]:  # is_deleted
+                return None
+            return self._decode_variable(data_block, offset + self.head_struct.size)
+
+        values = self.record_struct.unpack_from(data_block, offset)
+        if values[3]:  # is_deleted
+            return None
+        return self.decode_values(values[4:])
+
+    # ------------------------------
+    # to decode a record content made by encode_record(), e.g. a record which is being inserted
+    # output:
+    #       the tuple of the field values
+    # -------------------------------------
+    def decode_content(self, record_data_bytes):
+        if self.record_len is None:  # RECORD_FORMAT_VARIABLE
+            return self._decode_variable(record_data_bytes, 0)
+        return self.decode_values(self.content_struct.unpack(record_data_bytes))
 
 
 # --------------------------------------------
@@ -77,46 +524,46 @@ class Storage(object):
     # input:
     #       tablename
     #       log_manager: the log manager to record the log
+    #       use_mmap: whether scan() decodes the data blocks from a memory map of the file by default
     # -------------------------------------
-    def __init__(self, tablename, log_manager=None):
+    def __init__(self, tablename, log_manager=None, use_mmap=False):
         # print "__init__ of ",Storage.__name__,"begins to execute"
         self.tableName = tool.tryToBytes(tablename)
         self.log_manager = log_manager  # 保存日志管理器的引用
-
-        self.record_list = []
-        self.record_Position = []
-        self.delete_flag_list= []  # to judge whether the record is deleted or not
-
-        if not os.path.exists(tablename + '.dat'.encode('utf-8')):  # the file corresponding to the table does not exist
+        self.use_mmap = use_mmap
+        self._mmap = None  # the read-only map of the file, created by the first scan
+        self._indexes = None  # the open indexes of the table, see _get_indexes()
+        self._index_version = -1  # the version of the index catalog when the indexes were opened
+        self._key_fields = None  # the numbers of the key fields, see _get_key_fields()
+        self._key_version = -1  # the version of the table schemas when the key fields were read
+
+        self.file_name = tablename + '.dat'.encode('utf-8')
+        if not os.path.exists(self.file_name):  # the file corresponding to the table does not exist
             print('table file '.encode('utf-8') + tablename + '.dat does not exists'.encode('utf-8'))
-            self.f_handle = open(tablename + '.dat'.encode('utf-8'), 'wb+')
+            self.f_handle = open(self.file_name, 'wb+')
             self.f_handle.close()
             self.open = False
             print(tablename + '.dat has been created'.encode('utf-8'))
 
-        self.f_handle = open(tablename + '.dat'.encode('utf-8'), 'rb+')
+        # all the blocks of the table are read and written through the shared buffer pool
+        self.pool = buffer_db.get_buffer_pool()
+        self.f_handle = self.pool.open_file(self.file_name)
         print('table file '.encode('utf-8') + tablename + '.dat has been opened'.encode('utf-8'))
         self.open = True
 
-        self.dir_buf = ctypes.create_string_buffer(BLOCK_SIZE)
-        self.f_handle.seek(0)
-        self.dir_buf = self.f_handle.read(BLOCK_SIZE)
-
-        self.dir_buf.strip()
-        my_len = len(self.dir_buf)
         self.field_name_list = []
         beginIndex = 0
 
-        if my_len == 0:  # there is no data in the block 0, we should write meta data into the block 0
+        if self.pool.block_count(self.file_name) == 0:  # there is no data in the block 0, we should write meta data into the block 0
             tablename = tool.tryToStr(tablename)  # ensure tablename is a string
             self.num_of_fields = input( "please input the number of fields in table " + tablename + ":")
 
             if int(self.num_of_fields) > 0:
 
-                self.dir_buf = ctypes.create_string_buffer(BLOCK_SIZE)
+                dir_buf = self.pool.fetch_page(self.file_name, 0)
                 self.block_id = 0
                 self.data_block_num = 0
-                struct.pack_into('!iii', self.dir_buf, beginIndex, 0, 0,
+                struct.pack_into('!iii', dir_buf, beginIndex, 0, 0,
                                  int(self.num_of_fields))  # block_id,number_of_data_blocks,number_of_fields
 
                 beginIndex = beginIndex + struct.calcsize('!iii')
@@ -137,28 +584,34 @@ class Storage(object):
 
                     # to need further modification here
                     field_length = input("please input the length of field " + str(i) + " :")
-                    temp_tuple = (field_name, int(field_type), int(field_length))
-                    self.field_name_list.append(temp_tuple)
                     if isinstance(field_name, str):
                         field_name = field_name.encode('utf-8')
+                    temp_tuple = (field_name, int(field_type), int(field_length))  # the same as read from block 0
+                    self.field_name_list.append(temp_tuple)
 
-                    struct.pack_into('!10sii', self.dir_buf, beginIndex, field_name, int(field_type),
+                    struct.pack_into('!10sii', dir_buf, beginIndex, field_name, int(field_type),
                                      int(field_length))
                     beginIndex = beginIndex + struct.calcsize('!10sii')
 
-                self.f_handle.seek(0)
-                self.f_handle.write(self.dir_buf)
-                self.f_handle.flush()
+                # a new table always uses the latest record format
+                self.record_format = latest_record_format(self.field_name_list)
+                struct.pack_into('!i', dir_buf, RECORD_FORMAT_OFFSET, self.record_format)
+
+                self.pool.unpin_page(self.file_name, 0, True)
+                self.pool.flush_file(self.file_name)
+                self.codec = RecordCodec(self.field_name_list, self.record_format)
 
             else:
                 print('the number of fields should be greater than 0')
-                self.f_handle.close()
+                self.pool.close_file(self.file_name)
                 self.open = False
                 return
 
         else:  # there is something in the file
 
-            self.block_id, self.data_block_num, self.num_of_fields = struct.unpack_from('!iii', self.dir_buf, 0)
+            dir_buf = self.pool.fetch_page(self.file_name, 0)
+            self.block_id, self.data_block_num, self.num_of_fields = struct.unpack_from('!iii', dir_buf, 0)
+            self.record_format, = struct.unpack_from('!i', dir_buf, RECORD_FORMAT_OFFSET)
 
             print('number of fields is ', self.num_of_fields)
             print('data_block_num', self.data_block_num)
@@ -166,60 +619,441 @@ class Storage(object):
 
             # the followins is to read field name, field type and field length into main memory structures
             for i in range(self.num_of_fields):
-                field_name, field_type, field_length = struct.unpack_from('!10sii', self.dir_buf,
+                field_name, field_type, field_length = struct.unpack_from('!10sii', dir_buf,
                                                                           beginIndex + i * struct.calcsize(
                                                                               '!10sii'))  # i means no memory alignment
 
                 temp_tuple = (field_name, field_type, field_length)
                 self.field_name_list.append(temp_tuple)
                 print("the " + str(i) + "th field information (field name,field type,field length) is ", temp_tuple)
-        # print self.field_name_list
-        record_head_len = struct.calcsize('!ii10si')
-        record_content_len = sum(map(lambda x: x[2], self.field_name_list))
-        # print record_content_len
-
-        Flag = 1
-        while Flag <= self.data_block_num:
-            self.f_handle.seek(BLOCK_SIZE * Flag)
-            self.active_data_buf = self.f_handle.read(BLOCK_SIZE)
-            self.block_id, self.Number_of_Records = struct.unpack_from('!ii', self.active_data_buf, 0)
-            print('Block_ID=%s,   Contains %s data' % (self.block_id, self.Number_of_Records))
-            # There exists record
-            if self.Number_of_Records > 0:
-                for i in range(self.Number_of_Records):
-                    self.record_Position.append((Flag, i))
-
-                    # 获取记录偏移量
-                    offset = struct.unpack_from('!i', self.active_data_buf,
-                                    struct.calcsize('!ii') + i * struct.calcsize('!i'))[0]
-            
-                    # 读取记录头部，检查删除标记
-                    record_header = struct.unpack_from('!ii10si', self.active_data_buf, offset)
-                    is_deleted = record_header[3]  # 第4个字段是删除标记
-            
-                    if not is_deleted:  # 只处理未删除的记录
-                        self.delete_flag_list.append(False)  # 未删除标记为False
-                        # 读取记录内容
-                        record = struct.unpack_from('!' + str(record_content_len) + 's', 
-                                          self.active_data_buf,
-                                          offset + record_head_len)[0]
-                
-                        # 解析记录内容
-                        tmp = 0
-                        tmpList = []
-                        for field in self.field_name_list:
-                            t = record[tmp:tmp + field[2]].strip()
-                            tmp = tmp + field[2]
-                            if field[1] == 2:  # int类型
-                                t = int(t)
-                            if field[1] == 3:  # bool类型
-                                t = bool(t)
-                            tmpList.append(t)
-                        self.record_list.append(tuple(tmpList))
-                    else:
-                        self.delete_flag_list.append(True)
-                        self.record_list.append(None)  # 已删除的记录用None表示
-            Flag += 1
+            self.pool.unpin_page(self.file_name, 0)
+            self.codec = RecordCodec(self.field_name_list, self.record_format)
+        # only block 0 is read here, the data blocks are read by scan() when they are needed
+
+    # ------------------------------
+    # to read and decode the records in one data block
+    # in mmap mode the block is decoded from a slice of the map without copying it,
+    # otherwise it is pinned in the buffer pool
+    # input:
+    #       block_id
+    #       use_mmap: whether the block is decoded from the memory map
+    # output:
+    #       a list of (position, record) for the records which are not deleted,
+    #       where position is (block_id, slot_id)
+    # -------------------------------------
+    def _read_block_records(self, block_id, use_mmap):
+        if use_mmap:
+            if self._mmap is None or len(self._mmap) < (block_id + 1) * BLOCK_SIZE:
+                self._remap()  # the table has grown since the file was mapped
+            if self._mmap is not None and len(self._mmap) >= (block_id + 1) * BLOCK_SIZE:
+                with memoryview(self._mmap) as file_view:
+                    with file_view[block_id * BLOCK_SIZE:(block_id + 1) * BLOCK_SIZE] as data_block:
+                        return self.codec.decode_block(data_block, block_id)
+
+        data_block = self.pool.fetch_page(self.file_name, block_id)
+        try:
+            return self.codec.decode_block(data_block, block_id)
+        finally:
+            self.pool.unpin_page(self.file_name, block_id)
+
+    # ------------------------------
+    # to map the whole file into memory again, e.g. after data_block_num grows
+    # the dirty blocks in the buffer pool are written first so that the map sees them
+    # -------------------------------------
+    def _remap(self):
+        self._unmap()
+        self.pool.flush_file(self.file_name)
+        file_size = os.fstat(self.f_handle.fileno()).st_size
+        if file_size > 0:  # an empty file cannot be mapped
+            self._mmap = mmap.mmap(self.f_handle.fileno(), file_size, access=mmap.ACCESS_READ)
+
+    def _unmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    # ------------------------------
+    # to scan the table lazily, one data block at a time
+    # input:
+    #       use_mmap: whether the data blocks are decoded from a memory map of the file,
+    #                 None for the default of the table. the Storage object is shared, so
+    #                 a caller wanting the map asks for it here instead of changing the default
+    # output:
+    #       a generator of (position, record), where position is (block_id, slot_id)
+    #       the deleted records are skipped
+    # -------------------------------------
+    def scan(self, use_mmap=None):
+        if use_mmap is None:
+            use_mmap = self.use_mmap
+        block_id = 1
+        while block_id <= self.data_block_num:
+            for item in self._read_block_records(block_id, use_mmap):
+                yield item
+            block_id += 1
+
+    # ------------------------------
+    # to read the record at a position, e.g. a position found in an index
+    # only the record is decoded, not the whole block
+    # input:
+    #       block_id, slot_id
+    # output:
+    #       the record, or None if the record is deleted or the position is out of the table
+    # -------------------------------------
+    def fetch_record(self, block_id, slot_id):
+        if block_id < 1 or block_id > self.data_block_num:
+            return None
+        data_block = self.pool.fetch_page(self.file_name, block_id)
+        try:
+            return self.codec.decode_slot(data_block, slot_id)
+        finally:
+            self.pool.unpin_page(self.file_name, block_id)
+
+    # ------------------------------
+    # to read the records at some positions
+    # each data block is pinned once, however many of the positions are in it
+    # input:
+    #       positions: (block_id, slot_id) in any order
+    # output:
+    #       a generator of (position, record) in the order of the blocks and slots,
+    #       the deleted records and the positions out of the table are skipped
+    # -------------------------------------
+    def fetch_records(self, positions):
+        slots_of_block = {}
+        for block_id, slot_id in positions:
+            slots_of_block.setdefault(block_id, set()).add(slot_id)
+
+        for block_id in sorted(slots_of_block):
+            if block_id < 1 or block_id > self.data_block_num:
+                continue
+            data_block = self.pool.fetch_page(self.file_name, block_id)
+            try:
+                records = [((block_id, slot_id), self.codec.decode_slot(data_block, slot_id))
+                           for slot_id in sorted(slots_of_block[block_id])]
+            finally:
+                self.pool.unpin_page(self.file_name, block_id)
+            for position, record in records:
+                if record is not None:
+                    yield position, record
+
+    # ------------------------------
+    # to get where new records are put, namely the next slot of the last data block and its free space
+    # output:
+    #       (block_id, slot_id, bytes of free space), block 1 with no record if the table is empty
+    # -------------------------------------
+    def _last_block_space(self):
+        if self.data_block_num == 0:
+            return 1, 0, BLOCK_SIZE - struct.calcsize('!ii')
+        data_block = self.pool.fetch_page(self.file_name, self.data_block_num)
+        Number_of_Records, free_space = self.codec.free_space(data_block)
+        self.pool.unpin_page(self.file_name, self.data_block_num)
+        return self.data_block_num, Number_of_Records, free_space
+
+    # ------------------------------
+    # to read the free space map from block 0
+    # output:
+    #       a list of [block_id, number of reusable slots]
+    # -------------------------------------
+    def _read_fsm(self):
+        meta_block = self.pool.fetch_page(self.file_name, 0)
+        num_of_entries, = struct.unpack_from('!i', meta_block, FSM_OFFSET)
+        if not 0 <= num_of_entries <= FSM_MAX_ENTRIES:  # not a free space map
+            num_of_entries = 0
+        entries = [list(struct.unpack_from('!ii', meta_block, FSM_OFFSET + 4 + i * 8))
+                   for i in range(num_of_entries)]
+        self.pool.unpin_page(self.file_name, 0)
+        return entries
+
+    # ------------------------------
+    # to change the number of reusable slots of a data block in the free space map
+    # a block without reusable slots is removed, a new block is not kept if the map is full
+    # input:
+    #       block_id
+    #       delta: e.g. 1 after a record is deleted, -1 after a deleted slot is reused
+    # -------------------------------------
+    def _update_fsm(self, block_id, delta):
+        entries = self._read_fsm()
+        for entry in entries:
+            if entry[0] == block_id:
+                entry[1] += delta
+                break
+        else:
+            if delta <= 0 or len(entries) >= FSM_MAX_ENTRIES:
+                return
+            entries.append([block_id, delta])
+        entries = [entry for entry in entries if entry[1] > 0]
+
+        meta_block = self.pool.fetch_page(self.file_name, 0)
+        struct.pack_into('!i', meta_block, FSM_OFFSET, len(entries))
+        for i, entry in enumerate(entries):
+            struct.pack_into('!ii', meta_block, FSM_OFFSET + 4 + i * 8, entry[0], entry[1])
+        self.pool.unpin_page(self.file_name, 0, True)
+
+    # ------------------------------
+    # to find deleted slots for new records with the free space map
+    # a slot deleted by a transaction which has not committed is not reused
+    # input:
+    #       contents: list of record contents
+    # output:
+    #       (list of (block_id, slot_id, record content) to be put into deleted slots,
+    #        list of the other record contents)
+    # -------------------------------------
+    def _find_reusable_slots(self, contents):
+        candidates = []  # (block_id, slot_id, space)
+        for block_id, num_of_slots in self._read_fsm():
+            if len(candidates) >= len(contents):
+                break
+            if block_id > self.data_block_num:
+                continue
+            data_block = self.pool.fetch_page(self.file_name, block_id)
+            deleted_slots = self.codec.deleted_slots(data_block)
+            self.pool.unpin_page(self.file_name, block_id)
+            candidates.extend((block_id, slot_id, space) for slot_id, space in deleted_slots
+                              if (self.file_name, block_id, slot_id) not in common_db.global_uncommitted_deletes)
+
+        reused = []
+        others = []
+        for record_data_bytes in contents:
+            record_len = struct.calcsize('!ii10si') + len(record_data_bytes)
+            for i, (block_id, slot_id, space) in enumerate(candidates):
+                if space >= record_len:
+                    reused.append((block_id, slot_id, record_data_bytes))
+                    del candidates[i]
+                    break
+            else:
+                others.append(record_data_bytes)
+        return reused, others
+
+    # ------------------------------
+    # to put records into deleted slots in the cached blocks, and update the free space map
+    # input:
+    #       reused: list of (block_id, slot_id, record content)
+    #       update_time: the time stamp in the record heads
+    # -------------------------------------
+    def _put_into_deleted_slots(self, reused, update_time=b'2016-11-16'):
+        for block_id, slot_id, record_data_bytes in reused:
+            data_block = self.pool.fetch_page(self.file_name, block_id)
+            self.codec.pack_record(data_block, slot_id, record_data_bytes, update_time)
+            self.pool.unpin_page(self.file_name, block_id, True)
+            self._update_fsm(block_id, -1)
+
+    # ------------------------------
+    # the payload of an INSERT log record
+    # 格式: <table_name_len> <table_name> <block_id> <slot_id> <record_content_len> <record_content>
+    # -------------------------------------
+    def _insert_payload(self, block_id, slot_id, record_data_bytes):
+        table_name_bytes = self.tableName
+        payload_format = f'!I{len(table_name_bytes)}sIII{len(record_data_bytes)}s'
+        return struct.pack(
+            payload_format,
+            len(table_name_bytes),
+            table_name_bytes,
+            block_id,
+            slot_id,
+            len(record_data_bytes),  # 记录数据长度
+            record_data_bytes  # 记录数据
+        )
+
+    # ------------------------------
+    # the open indexes of the table, which are opened again when the index catalog has changed
+    # output:
+    #       list of (field indexes, field name, Index object), the field indexes are those of the key fields
+    #       and the included fields of the index, the field name is that in the catalog, see index_db.index_field_names()
+    # -------------------------------------
+    def _get_indexes(self):
+        catalog = catalog_db.get_index_catalog()
+        if self._indexes is None or self._index_version != catalog.version:
+            self._close_indexes()
+            field_names = [field[0].strip() for field in self.field_name_list]
+            self._indexes = []
+            for field_name in catalog.indexed_fields(self.tableName):
+                if all(name in field_names for name in index_db.index_field_names(field_name)):
+                    index = index_db.open_index(self.tableName, field_name, catalog.index_kind(self.tableName, field_name))
+                    self._indexes.append(([field_names.index(name) for name in index.key_field_names() + index.include_field_names()],
+                                          field_name, index))
+            self._index_version = catalog.version
+        return self._indexes
+
+    def _close_indexes(self):
+        for field_idxs, field_name, index in self._indexes or []:
+            index.close()
+        self._indexes = None
+
+    # ------------------------------
+    # the index entries of some records
+    # input:
+    #       records: list of (block_id, slot_id, record), where record is the record content
+    #                made by encode_record() or the tuple of the field values
+    # output:
+    #       list of (Index object, field name, key, payload, block_id, slot_id), see Index.make_entry()
+    # -------------------------------------
+    def _index_changes(self, records):
+        indexes = self._get_indexes()
+        if not indexes:
+            return []
+        changes = []
+        for block_id, slot_id, record in records:
+            values = self.codec.decode_content(record) if isinstance(record, bytes) else record
+            for field_idxs, field_name, index in indexes:
+                key, payload = index.make_entry([values[i] for i in field_idxs])
+                changes.append((index, field_name, key, payload, block_id, slot_id))
+        return changes
+
+    # ------------------------------
+    # to log the changes of the indexes, the caller forces the log with the log records of the data,
+    # so that the recovery redoes and undoes the indexes together with the data blocks
+    # input:
+    #       record_type: log_db.RECORD_TYPE_INDEX_INSERT or log_db.RECORD_TYPE_INDEX_DELETE
+    #       index_changes: made by _index_changes()
+    #       transaction_id
+    #       the included values are logged after the key
+    # -------------------------------------
+    def _log_index_changes(self, record_type, index_changes, transaction_id):
+        for index, field_name, key, payload, block_id, slot_id in index_changes:
+            self.log_manager.log(transaction_id, record_type,
+                                 log_db.pack_index_payload(self.tableName, field_name, block_id, slot_id,
+                                                           key if payload is None else key + payload),
+                                 force=False)
+
+    # ------------------------------
+    # to change the indexes after the data blocks, each index file is flushed once
+    # -------------------------------------
+    def _apply_index_changes(self, record_type, index_changes):
+        for index, field_name, key, payload, block_id, slot_id in index_changes:
+            if record_type == log_db.RECORD_TYPE_INDEX_INSERT:
+                index.insert_key_entry(key, block_id, slot_id, False, payload)
+            else:
+                index.delete_key_entry(key, block_id, slot_id, flush=False)
+        for index in {change[0] for change in index_changes}:
+            self.pool.flush_file(index.file_name)
+
+    # --------------------------------
+    # 仅供恢复时使用 (REDO and UNDO the index changes)。
+    # 使索引中有或者没有一个条目，不记录日志，重复执行的结果相同。
+    # param field_name: 索引的字段名
+    # param key: make_entry() 得到的键，后面是索引包含的字段值 (如果有)
+    # param present: True 表示条目应该存在
+    # --------------------------------
+    def _force_index_entry(self, field_name, key, block_id, slot_id, present):
+        for field_idxs, name, index in self._get_indexes():
+            if name != field_name:
+                continue
+            # the included values take a fixed size at the end, the key may have a variable length
+            payload = None
+            if index.include_codec is not None:
+                key, payload = key[:len(key) - index.include_codec.content_struct.size], \
+                               key[len(key) - index.include_codec.content_struct.size:]
+            found = index.find_key_entry(key, block_id, slot_id)
+            if present and found is None:
+                index.insert_key_entry(key, block_id, slot_id, True, payload)
+            elif not present and found is not None:
+                index.delete_key_entry(key, block_id, slot_id)
+
+    # ------------------------------
+    # to make the indexes of the table again, e.g. after the records have moved
+    # -------------------------------------
+    def _rebuild_indexes(self):
+        for field_idxs, field_name, index in self._get_indexes():
+            index.create_index(field_name)
+
+    # ------------------------------
+    # the primary key and the unique fields of the table, which are declared in the table schema
+    # output:
+    #       list of field numbers, the primary key field comes first
+    # -------------------------------------
+    def _get_key_fields(self):
+        if self._key_fields is None or self._key_version != common_db.global_schema_version:
+            self._key_fields = [i for i in schema_db.read_table_keys(self.tableName) if i < len(self.field_name_list)]
+            self._key_version = common_db.global_schema_version
+        return self._key_fields
+
+    # ------------------------------
+    # to make an index on each key field which has none, when the keys of the table are declared
+    # the index is added to the index catalog, so that a key value is checked with one probe
+    # -------------------------------------
+    def create_key_indexes(self):
+        key_fields = self._get_key_fields()
+        indexed = [field_idxs[0] for field_idxs, field_name, index in self._get_indexes() if len(index.key_field_names()) == 1]
+        field_names = [field[0].strip() for field in self.field_name_list]
+        for i in key_fields:
+            if i not in indexed:
+                index = index_db.Index(self.tableName, field_names[i])
+                index.create_index(field_names[i])
+                index.close()
+                catalog_db.get_index_catalog().add_index(self.tableName, field_names[i])
+
+    # ------------------------------
+    # the indexes on the key fields, made by create_key_indexes()
+    # input:
+    #       field_idx: the key field, None for all of them
+    # output:
+    #       list of (field number, Index or HashIndex object)
+    # -------------------------------------
+    def _get_key_indexes(self, field_idx=None):
+        key_fields = [i for i in self._get_key_fields() if field_idx is None or i == field_idx]
+        if not key_fields:
+            return []
+        key_indexes = {}
+        for field_idxs, field_name, index in self._get_indexes():
+            if len(index.key_field_names()) == 1 and field_idxs[0] in key_fields:
+                key_indexes.setdefault(field_idxs[0], index)
+        return [(i, key_indexes[i]) for i in key_fields if i in key_indexes]
+
+    # ------------------------------
+    # to check that some new records keep the key fields unique, among themselves and with the table
+    # each value is probed in the index of its field, and the records found are read to compare the
+    # whole values, since a long str value may be cut in the index key
+    # input:
+    #       contents: the record contents made by encode_record()
+    # output:
+    #       True, or False if a key value is found twice
+    # -------------------------------------
+    def _check_keys(self, contents):
+        key_indexes = self._get_key_indexes()
+        if not key_indexes:
+            return True
+        values_list = [self.codec.decode_content(record_data_bytes) for record_data_bytes in contents]
+        for field_idx, index in key_indexes:
+            seen = set()
+            for values in values_list:
+                value = values[field_idx]
+                if value in seen or self._find_by_key(field_idx, index, value):
+                    field_name = tool.tryToStr(self.field_name_list[field_idx][0].strip())
+                    print(f'\033[31mduplicate value {tool.tryToStr(value)} of the key field {field_name}\033[0m')
+                    return False
+                seen.add(value)
+        return True
+
+    # ------------------------------
+    # the records which may match the keyword of delete_record(), found with the index on a key field
+    # output:
+    #       list of (position, record), or None if the field is not a key field, then the table is scanned
+    # -------------------------------------
+    def _key_candidates(self, field_idx, keyword):
+        field_type = self.field_name_list[field_idx][1]
+        if field_type == 3:  # a bool key is rare, its keyword is compared as text by a scan
+            return None
+        key_indexes = self._get_key_indexes(field_idx)
+        if not key_indexes:
+            return None
+        if field_type == 2:
+            try:
+                value = int(keyword)
+            except ValueError:
+                return []
+        else:
+            value = tool.tryToBytes(keyword)
+        return self._find_by_key(field_idx, key_indexes[0][1], value)
+
+    # ------------------------------
+    # to find the records whose key field has a value, with one probe of the index on the field
+    # output:
+    #       list of (position, record)
+    # -------------------------------------
+    def _find_by_key(self, field_idx, index, value):
+        positions = index.search(value)
+        if not positions:
+            return []
+        return [(position, record) for position, record in self.fetch_records(positions) if record[field_idx] == value]
 
     # ------------------------------
     # return the record list of the table
@@ -227,7 +1061,15 @@ class Storage(object):
     #       
     # -------------------------------------
     def getRecord(self):
-        return self.record_list
+        return [record for position, record in self.scan()]
+
+    # --------------------------------
+    # to check one record and turn it into the content stored in the file
+    # param insert_record: list, e.g. ['xuyidan','23','123456']
+    # return: the record content (bytes), or None if the record is wrong
+    # -------------------------------
+    def _encode_record(self, insert_record):
+        return self.codec.encode_record(insert_record)
 
     # --------------------------------
     # to insert a record into table
@@ -240,105 +1082,141 @@ class Storage(object):
         # example: ['xuyidan','23','123456']
 
         # step 1 : to check the insert_record is True or False
+        # step2: change insert_record into the record content
+        record_data_bytes = self._encode_record(insert_record)
+        if record_data_bytes is None:
+            return False
+        if not self._check_keys([record_data_bytes]):  # a value of the primary key or a unique field is there already
+            return False
 
-        tmpRecord = []
-        for idx in range(len(self.field_name_list)):
-            insert_record[idx] = insert_record[idx].strip()
-            if self.field_name_list[idx][1] == 0 or self.field_name_list[idx][1] == 1:
-                if len(insert_record[idx]) > self.field_name_list[idx][2]:
-                    return False
-                tmpRecord.append(tool.tryToBytes(insert_record[idx])) # convert to bytes
-            if self.field_name_list[idx][1] == 2:
-                try:
-                    tmpRecord.append(int(insert_record[idx]))
-                except:
-                    return False
-            if self.field_name_list[idx][1] == 3:
-                try:
-                    tmpRecord.append(bool(insert_record[idx]))
-                except:
-                    return False
-            insert_record[idx] = ' ' * (self.field_name_list[idx][2] - len(insert_record[idx])) + insert_record[idx]
+        # Step3-4: To calculate new record Position, a deleted slot found with the free space map
+        # is reused first, otherwise the record goes to the last data block or a new one
+        reused, others = self._find_reusable_slots([record_data_bytes])
+        if reused:
+            last_Position = reused[0][:2]
+        else:
+            block_id, first_slot_id, records = self.codec.split_into_blocks([record_data_bytes],
+                                                                            *self._last_block_space())[0]
+            last_Position = (block_id, first_slot_id)
+            self.data_block_num = max(self.data_block_num, block_id)
+        index_changes = self._index_changes([(last_Position[0], last_Position[1], record_data_bytes)])
 
-        # step2: Add tmpRecord to record_list ; change insert_record into inputstr
-        inputstr = ''.join(insert_record)
+        # Step5: Write the log if log_manager is not None, with the changes of the indexes
+        if self.log_manager:
+            # 构造一个包含足够恢复信息的 payload, 其中的位置就是记录被写入的位置 (包括被重用的槽位)
+            payload = self._insert_payload(last_Position[0], last_Position[1], record_data_bytes)
+            self.log_manager.log(transaction_id, log_db.RECORD_TYPE_INSERT, payload, force=False)
+            self._log_index_changes(log_db.RECORD_TYPE_INDEX_INSERT, index_changes, transaction_id)
+            self.log_manager.force()
+
+        # Step6: Write new record into the cached blocks of file xxx.dat
+        if reused:
+            self._put_into_deleted_slots(reused)
+            self.pool.flush_file(self.file_name)
+            self._apply_index_changes(log_db.RECORD_TYPE_INDEX_INSERT, index_changes)
+            return True
 
-        # Step3: To calculate MaxNum in each Data Blocks
-        record_content_len = len(inputstr)
-        record_head_len = struct.calcsize('!ii10si')  # 增加is_deleted字段
-        record_len = record_head_len + record_content_len
-        MAX_RECORD_NUM = (BLOCK_SIZE - struct.calcsize('!i') - struct.calcsize('!ii')) / (
-                record_len + struct.calcsize('!i'))
+        # update data_block_num
+        meta_block = self.pool.fetch_page(self.file_name, 0)
+        struct.pack_into('!ii', meta_block, 0, 0, self.data_block_num)
+        self.pool.unpin_page(self.file_name, 0, True)
 
-        # Step4: To calculate new record Position
-        if not len(self.record_Position):
-            self.data_block_num += 1
-            self.record_Position.append((1, 0))
-        else:
-            last_Position = self.record_Position[-1]
-            if last_Position[1] == MAX_RECORD_NUM - 1:
-                self.record_Position.append((last_Position[0] + 1, 0))
-                self.data_block_num += 1
-            else:
-                self.record_Position.append((last_Position[0], last_Position[1] + 1))
+        # update data block head, data offset and data
+        data_block = self.pool.fetch_page(self.file_name, last_Position[0])
+        self.codec.pack_block(data_block, last_Position[0], last_Position[1], [record_data_bytes])
+        self.pool.unpin_page(self.file_name, last_Position[0], True)
 
-        last_Position = self.record_Position[-1]
+        # write the changed blocks back in one batch
+        self.pool.flush_file(self.file_name)
+        self._apply_index_changes(log_db.RECORD_TYPE_INDEX_INSERT, index_changes)
+
+        return True
+
+    # --------------------------------
+    # to insert a batch of records into table
+    # the batch is checked as a whole, then whole data blocks are packed in main memory.
+    # one INSERT_BATCH log record is written per data block and the log is forced once,
+    # each new block is written with a single write and the file is flushed once
+    # param rows: list of records, each of which is a list like insert_record()
+    # param transaction_id: the id of the transaction
+    # return: True or False, nothing is inserted if any record is wrong
+    # -------------------------------
+    def insert_records(self, rows, transaction_id=None):
+
+        # step 1: to check all the records before anything is written
+        contents = []
+        for row in rows:
+            record_data_bytes = self._encode_record(list(row))
+            if record_data_bytes is None:
+                return False
+            contents.append(record_data_bytes)
+        if not contents:
+            return True
+        if not self._check_keys(contents):
+            return False
 
-        # Step5: Write the log if log_manager is not None
+        # step 2: the deleted slots found with the free space map are reused first, then the rest
+        # of the batch is split into blocks, each element is (block_id, first_slot_id, records)
+        # the free space of the last data block is used first
+        reused, contents = self._find_reusable_slots(contents)
+        block_batches = self.codec.split_into_blocks(contents, *self._last_block_space()) if contents else []
+        index_changes = self._index_changes(
+            reused + [(block_id, first_slot_id + i, record_data_bytes)
+                      for block_id, first_slot_id, records in block_batches
+                      for i, record_data_bytes in enumerate(records)])
+
+        # step 3: write one INSERT log record per reused slot and one INSERT_BATCH log record per block,
+        # then the INDEX_INSERT log records, the log is forced to disk only once
         if self.log_manager:
-            # 构造一个包含足够恢复信息的 payload
-            # 格式: <table_name_len> <table_name> <block_id> <slot_id> <record_content>
+            for block_id, slot_id, record_data_bytes in reused:
+                self.log_manager.log(transaction_id, log_db.RECORD_TYPE_INSERT,
+                                     self._insert_payload(block_id, slot_id, record_data_bytes), force=False)
+            # 格式: <table_name_len> <table_name> <block_id> <first_slot_id> <number_of_records> <record_content_len> <record_contents>
+            # 变长记录的 record_content_len 为 0，每条记录内容前有它的长度 <I>
             table_name_bytes = self.tableName
-            record_data_bytes = inputstr.encode('utf-8')
-            payload_format = f'!I{len(table_name_bytes)}sIII{len(record_data_bytes)}s'
-            payload = struct.pack(
-                payload_format,
-                len(table_name_bytes),
-                table_name_bytes,
-                last_Position[0], # block_id
-                last_Position[1], # slot_id
-                len(record_data_bytes),   # 记录数据长度
-                record_data_bytes         # 记录数据
-            )
-            self.log_manager.log(transaction_id, log_db.RECORD_TYPE_INSERT, payload)
-
-        # Step6: Write new record into file xxx.dat
-        # update data_block_num
-        self.f_handle.seek(0)
-        self.buf = ctypes.create_string_buffer(struct.calcsize('!ii'))
-        struct.pack_into('!ii', self.buf, 0, 0, self.data_block_num)
-        self.f_handle.write(self.buf)
-        self.f_handle.flush()
-
-        # update data block head
-        self.f_handle.seek(BLOCK_SIZE * last_Position[0])
-        self.buf = ctypes.create_string_buffer(struct.calcsize('!ii'))
-        struct.pack_into('!ii', self.buf, 0, last_Position[0], last_Position[1] + 1)
-        self.f_handle.write(self.buf)
-        self.f_handle.flush()
+            for block_id, first_slot_id, records in block_batches:
+                if self.codec.record_len is None:
+                    record_data_bytes = b''.join(struct.pack('!I', len(record)) + record for record in records)
+                else:
+                    record_data_bytes = b''.join(records)
+                payload = struct.pack(
+                    f'!I{len(table_name_bytes)}sIIII{len(record_data_bytes)}s',
+                    len(table_name_bytes),
+                    table_name_bytes,
+                    block_id,
+                    first_slot_id,
+                    len(records),
+                    0 if self.codec.record_len is None else len(records[0]),
+                    record_data_bytes
+                )
+                self.log_manager.log(transaction_id, log_db.RECORD_TYPE_INSERT_BATCH, payload, force=False)
+            self._log_index_changes(log_db.RECORD_TYPE_INDEX_INSERT, index_changes, transaction_id)
+            self.log_manager.force()
+
+        # step 4: pack the blocks in main memory and write them
+        self._put_into_deleted_slots(reused)
+        for block_id, first_slot_id, records in block_batches:
+            if block_id <= self.data_block_num:  # the last data block, which is changed in the buffer pool
+                data_block = self.pool.fetch_page(self.file_name, block_id)
+            else:
+                data_block = bytearray(BLOCK_SIZE)
+            self.codec.pack_block(data_block, block_id, first_slot_id, records)
 
-        # update data offset
-        offset = struct.calcsize('!ii') + last_Position[1] * struct.calcsize('!i')
-        beginIndex = BLOCK_SIZE - (last_Position[1] + 1) * record_len
-        self.f_handle.seek(BLOCK_SIZE * last_Position[0] + offset)
-        self.buf = ctypes.create_string_buffer(struct.calcsize('!i'))
-        struct.pack_into('!i', self.buf, 0, beginIndex)
-        self.f_handle.write(self.buf)
-        self.f_handle.flush()
+            if block_id <= self.data_block_num:
+                self.pool.unpin_page(self.file_name, block_id, True)
+            else:
+                self.pool.write_page(self.file_name, block_id, data_block)
 
-        # update data
-        record_schema_address = struct.calcsize('!iii')
-        update_time = '2016-11-16'  # update time
-        self.f_handle.seek(BLOCK_SIZE * last_Position[0] + beginIndex)
-        self.buf = ctypes.create_string_buffer(record_len)
-        struct.pack_into('!ii10si', self.buf, 0, record_schema_address, record_content_len, update_time.encode('utf-8'), 0)  # 0表示未删除
-        struct.pack_into('!' + str(record_content_len) + 's', self.buf, record_head_len, inputstr.encode('utf-8'))
-        self.f_handle.write(self.buf.raw)
-        self.f_handle.flush()
-
-        # 将新记录添加到内存列表中
-        self.record_list.append(tuple(tmpRecord))
-        self.delete_flag_list.append(False)
+        # step 5: update data_block_num and write the cached blocks back
+        if block_batches:
+            self.data_block_num = max(self.data_block_num, block_batches[-1][0])
+        meta_block = self.pool.fetch_page(self.file_name, 0)
+        struct.pack_into('!ii', meta_block, 0, 0, self.data_block_num)
+        self.pool.unpin_page(self.file_name, 0, True)
+        self.pool.flush_file(self.file_name)
+
+        # step 6: add the entries of the records to the indexes
+        self._apply_index_changes(log_db.RECORD_TYPE_INDEX_INSERT, index_changes)
 
         return True
 
@@ -372,16 +1250,14 @@ class Storage(object):
             print(f'\033[31m未找到字段名 {field_name.decode()}\033[0m')
             return False
 
-        # 遍历所有记录
-        for i, rec in enumerate(self.record_list):
-            if rec is None:  continue
-
+        # 主键或唯一字段的记录用字段上的索引找到, 其他字段逐块扫描所有未删除的记录
+        candidates = self._key_candidates(field_idx, keyword)
+        for (block_id, record_id), rec in (self.scan() if candidates is None else candidates):
             record_value = tool.convertType(keyword, rec[field_idx])
             if record_value == keyword:
-                # 获取记录在文件中的位置
-                block_id, record_id = self.record_Position[i]
+                index_changes = self._index_changes([(block_id, record_id, rec)])
 
-                # 先写日志
+                # 先写日志, 索引的改变也一起写入
                 if self.log_manager:
                     # Payload 需要包含前像（被删除的记录内容），以便UNDO
                     # 格式: <table_name_len> <table_name> <block_id> <slot_id> <record_content>
@@ -400,16 +1276,24 @@ class Storage(object):
                         len(record_data_bytes),  # 记录数据长度
                         record_data_bytes        # 记录数据
                     )
-                    self.log_manager.log(transaction_id, log_db.RECORD_TYPE_DELETE, payload)
+                    self.log_manager.log(transaction_id, log_db.RECORD_TYPE_DELETE, payload, force=False)
+                    self._log_index_changes(log_db.RECORD_TYPE_INDEX_DELETE, index_changes, transaction_id)
+                    self.log_manager.force()
 
                 # 计算记录头的位置
-                offset = struct.unpack_from('!i', self.active_data_buf,
+                data_block = self.pool.fetch_page(self.file_name, block_id)
+                offset = struct.unpack_from('!i', data_block,
                                           struct.calcsize('!ii') + record_id * struct.calcsize('!i'))[0]
                 # 设置删除标记
-                self.f_handle.seek(BLOCK_SIZE * block_id + offset + struct.calcsize('!ii10s'))
-                self.f_handle.write(struct.pack('!i', 1))  # 1表示已删除
-                self.delete_flag_list[i] = True  # 更新内存中的删除标记
-                self.record_list[i] = None  # 将记录设置为None，表示已删除
+                struct.pack_into('!i', data_block, offset + struct.calcsize('!ii10s'), 1)  # 1表示已删除
+                self.pool.unpin_page(self.file_name, block_id, True)
+
+                # 槽位记入空闲空间表, 在事务提交之前不能被重用
+                if self.log_manager and transaction_id is not None:
+                    common_db.global_uncommitted_deletes[(self.file_name, block_id, record_id)] = transaction_id
+                self._update_fsm(block_id, 1)
+                self.pool.flush_file(self.file_name)
+                self._apply_index_changes(log_db.RECORD_TYPE_INDEX_DELETE, index_changes)
                 return True  # 删除成功
            
         print(f'\033[31m未找到匹配的记录\033[0m')
@@ -418,19 +1302,18 @@ class Storage(object):
     # --------------------------------
     # 仅供恢复时使用 (UNDO an INSERT)。
     # 在指定位置强制设置记录的删除标记为1，不记录日志。
-    # 注意：此方法不会从内存列表中删除记录，只是标记为已删除。
     # param block_id: 记录所在的块ID。
     # param slot_id: 记录在块内的槽位ID (从0开始)。
     # --------------------------------
     def _force_delete_at(self, block_id, slot_id):
         print(f"  [Storage] Forcing delete at Block {block_id}, Slot {slot_id}")
         try:
-            # 1. 计算并定位到目标块
-            block_offset = block_id * BLOCK_SIZE
-            self.f_handle.seek(block_offset)
-
-            # 2. 将整个块读入内存缓冲区，以便安全修改
-            block_buffer = bytearray(self.f_handle.read(BLOCK_SIZE))
+            # 1-2. 从缓冲池中取得目标块，直接在缓存页上修改
+            block_buffer = self.pool.fetch_page(self.file_name, block_id)
+            if slot_id >= self.codec.block_head_struct.unpack_from(block_buffer, 0)[1]:
+                # 槽位不存在: 记录从未写入这个块 (例如块被 PAGE_IMAGE 恢复成了更早的映像)
+                self.pool.unpin_page(self.file_name, block_id)
+                return
 
             # 3. 从块的槽数组中，找到指向记录数据的偏移量
             slot_array_pos = struct.calcsize('!ii') + slot_id * struct.calcsize('!i')
@@ -441,22 +1324,16 @@ class Storage(object):
             # is_deleted 标记位于 'ii10s'之后
             is_deleted_flag_offset = record_offset_in_block + struct.calcsize('!ii10s')
 
-            # 5. 在内存缓冲区中修改删除标记
+            # 5. 在缓存页中修改删除标记
+            is_deleted, = struct.unpack_from('!i', block_buffer, is_deleted_flag_offset)
             struct.pack_into('!i', block_buffer, is_deleted_flag_offset, 1) # 1 表示已删除
 
-            # 6. 将修改后的整个块写回文件
-            self.f_handle.seek(block_offset)
-            self.f_handle.write(block_buffer)
-            self.f_handle.flush()
-
-            # 7. 更新内存中的状态以保持一致
-            # 找到全局记录列表中的位置并更新
-            for i, pos in enumerate(self.record_Position):
-                if pos == (block_id, slot_id):
-                    self.delete_flag_list[i] = True
-                    self.record_list[i] = None
-                    break
-                    
+            # 6. 将修改后的块标记为脏页，更新空闲空间表 (只在标记真正改变时)，并批量写回文件
+            self.pool.unpin_page(self.file_name, block_id, True)
+            if not is_deleted:
+                self._update_fsm(block_id, 1)
+            self.pool.flush_file(self.file_name)
+
         except (IOError, struct.error) as e:
             print(f"\033[31m  [Storage Error] Failed during _force_delete_at: {e}\033[0m")
 
@@ -464,20 +1341,18 @@ class Storage(object):
     # --------------------------------
     # 仅供恢复时使用 (UNDO a DELETE)。
     # 在指定位置将记录的删除标记从1恢复为0，不记录日志。
-    # 注意：此方法不会从内存列表中删除记录，只是标记为未删除。
     # param block_id: 记录所在的块ID。
     # param slot_id: 记录在块内的槽位ID (从0开始)。
-    # param original_record_tuple: 从日志中恢复的原始记录元组，用于更新内存。
     # --------------------------------
-    def _force_undelete_at(self, block_id, slot_id, original_record_tuple):
+    def _force_undelete_at(self, block_id, slot_id):
         print(f"  [Storage] Forcing undelete at Block {block_id}, Slot {slot_id}")
         try:
-            # 1. 计算并定位到目标块
-            block_offset = block_id * BLOCK_SIZE
-            self.f_handle.seek(block_offset)
-
-            # 2. 将整个块读入内存缓冲区
-            block_buffer = bytearray(self.f_handle.read(BLOCK_SIZE))
+            # 1-2. 从缓冲池中取得目标块
+            block_buffer = self.pool.fetch_page(self.file_name, block_id)
+            if slot_id >= self.codec.block_head_struct.unpack_from(block_buffer, 0)[1]:
+                # 槽位不存在: 记录从未写入这个块 (例如块被 PAGE_IMAGE 恢复成了更早的映像)
+                self.pool.unpin_page(self.file_name, block_id)
+                return
 
             # 3. 从槽数组中找到指向记录的偏移量
             slot_array_pos = struct.calcsize('!ii') + slot_id * struct.calcsize('!i')
@@ -486,20 +1361,15 @@ class Storage(object):
             # 4. 计算删除标记在记录头中的位置
             is_deleted_flag_offset = record_offset_in_block + struct.calcsize('!ii10s')
 
-            # 5. 在内存缓冲区中将删除标记恢复为 0
+            # 5. 在缓存页中将删除标记恢复为 0
+            is_deleted, = struct.unpack_from('!i', block_buffer, is_deleted_flag_offset)
             struct.pack_into('!i', block_buffer, is_deleted_flag_offset, 0) # 0 表示未删除
 
-            # 6. 将修改后的整个块写回文件
-            self.f_handle.seek(block_offset)
-            self.f_handle.write(block_buffer)
-            self.f_handle.flush()
-
-            # 7. 更新内存状态以保持一致
-            for i, pos in enumerate(self.record_Position):
-                if pos == (block_id, slot_id):
-                    self.delete_flag_list[i] = False
-                    self.record_list[i] = original_record_tuple
-                    break
+            # 6. 将修改后的块标记为脏页，更新空闲空间表 (只在标记真正改变时)，并批量写回文件
+            self.pool.unpin_page(self.file_name, block_id, True)
+            if is_deleted:
+                self._update_fsm(block_id, -1)
+            self.pool.flush_file(self.file_name)
 
         except (IOError, struct.error) as e:
             print(f"\033[31m  [Storage Error] Failed during _force_undelete_at: {e}\033[0m")
@@ -515,68 +1385,198 @@ class Storage(object):
     # :param record_data_bytes: 记录的完整内容字节串。
     # ----------------------------------------------- 
     def _force_insert_at(self, block_id, slot_id, record_data_bytes):
-        print(f"  [Storage] Forcing insert at Block {block_id}, Slot {slot_id}")
-        try:
-            # 1. 计算记录的总长度 (包括头部)
-            record_content_len = len(record_data_bytes)
-            record_head_len = struct.calcsize('!ii10si')
-            record_len = record_head_len + record_content_len
+        self._force_insert_records_at(block_id, slot_id, [record_data_bytes])
 
-            # 2. 计算并定位到目标块
-            block_offset = block_id * BLOCK_SIZE
-            self.f_handle.seek(block_offset)
+    # -----------------------------------------------
+    # 仅供恢复时使用 (REDO an INSERT_BATCH)。
+    # 从指定槽位开始，在同一个块中强制写入连续的多条记录，不记录日志。
+    # 所有记录在缓存页中修改后一次写回文件。
+    #
+    # :param block_id: 记录所在的块ID。
+    # :param first_slot_id: 第一条记录的槽位ID (从0开始)。
+    # :param records: 记录内容字节串的列表。
+    # -----------------------------------------------
+    def _force_insert_records_at(self, block_id, first_slot_id, records):
+        print(f"  [Storage] Forcing insert at Block {block_id}, Slot {first_slot_id}" +
+              (f"-{first_slot_id + len(records) - 1}" if len(records) > 1 else ""))
+        try:
+            # 1. 从缓冲池中取得目标块
+            block_buffer = self.pool.fetch_page(self.file_name, block_id)
 
-            # 3. 检查块是否存在，如果不存在则创建一个新的空块
+            # 2. 检查块是否存在，如果不存在则创建一个新的空块
             if block_id > self.data_block_num:
                 # 这是一个新块
-                block_buffer = bytearray(BLOCK_SIZE)
+                block_buffer[:] = bytes(BLOCK_SIZE)
                 # 初始化块头 (block_id, num_records=0)
                 struct.pack_into('!ii', block_buffer, 0, block_id, 0)
                 # 更新文件元数据中的总块数
                 self.data_block_num = block_id
-                self.f_handle.seek(struct.calcsize('!i')) # 跳过 block_id=0
-                self.f_handle.write(struct.pack('!i', self.data_block_num))
-            else:
-                # 块已存在，读入缓冲区
-                block_buffer = bytearray(self.f_handle.read(BLOCK_SIZE))
-
-            # 4. 计算记录数据在块内的起始偏移量 (从后往前放)
-            record_offset_in_block = BLOCK_SIZE - (slot_id + 1) * record_len
-
-            # 5. 在缓冲区中构建完整的记录 (头部 + 内容)
-            record_schema_address = struct.calcsize('!iii') 
-            update_time = b'1970-01-01' # 恢复时使用一个默认时间戳
-            # 写入记录头: ptr, len, timestamp, is_deleted=0
-            struct.pack_into('!ii10si', block_buffer, record_offset_in_block,
-                            record_schema_address, record_content_len, update_time, 0) # 0 表示未删除
-            # 写入记录内容
-            struct.pack_into(f'!{record_content_len}s', block_buffer,
-                            record_offset_in_block + record_head_len, record_data_bytes)
-
-            # 6. 更新槽数组，写入指向新记录的指针
-            slot_array_pos = struct.calcsize('!ii') + slot_id * struct.calcsize('!i')
-            struct.pack_into('!i', block_buffer, slot_array_pos, record_offset_in_block)
-
-            # 7. 更新块头中的记录数
-            new_record_count = slot_id + 1
-            struct.pack_into('!ii', block_buffer, 0, block_id, new_record_count)
-
-            # 8. 将修改后的整个块写回文件
-            self.f_handle.seek(block_offset)
-            self.f_handle.write(block_buffer)
-            self.f_handle.flush()
+                meta_block = self.pool.fetch_page(self.file_name, 0)
+                struct.pack_into('!i', meta_block, struct.calcsize('!i'), self.data_block_num) # 跳过 block_id=0
+                self.pool.unpin_page(self.file_name, 0, True)
+
+            # 3. 已存在的槽位中被删除的记录将被覆盖 (即槽位被重用)，它们要从空闲空间表中减去
+            num_of_reused = len([slot_id for slot_id, space in self.codec.deleted_slots(block_buffer)
+                                 if first_slot_id <= slot_id < first_slot_id + len(records)])
+
+            # 4. 在缓存页中写入每条记录 (头部 + 内容) 和指向它的槽，从后往前放，并更新块头中的记录数
+            self.codec.pack_block(block_buffer, block_id, first_slot_id, records,
+                                  b'1970-01-01') # 恢复时使用一个默认时间戳
+
+            # 5. 将修改后的块连同块0一起批量写回文件
+            self.pool.unpin_page(self.file_name, block_id, True)
+            if num_of_reused:
+                self._update_fsm(block_id, -num_of_reused)
+            self.pool.flush_file(self.file_name)
             
         except (IOError, struct.error) as e:
             print(f"\033[31m  [Storage Error] Failed during _force_insert_at: {e}\033[0m")
 
 
-    def show_table_data(self):
+    # -----------------------------------------------
+    # 仅供恢复时使用 (REDO a PAGE_IMAGE)。
+    # 用日志中的映像覆盖整个块，不记录日志。块0的映像中包含新的数据块数。
+    #
+    # :param block_id: 块ID。
+    # :param data: 块的映像 (BLOCK_SIZE 字节)。
+    # -----------------------------------------------
+    def _force_write_page(self, block_id, data):
+        print(f"  [Storage] Forcing page image at Block {block_id}")
+        try:
+            self.pool.write_page(self.file_name, block_id, data)
+            if block_id == 0:
+                self.data_block_num = struct.unpack_from('!ii', data, 0)[1]
+            self.pool.flush_file(self.file_name)
+
+        except (IOError, struct.error) as e:
+            print(f"\033[31m  [Storage Error] Failed during _force_write_page: {e}\033[0m")
+
+    # --------------------------------
+    # to compact the data blocks: the live records are packed densely and the deleted ones are dropped
+    # it can compact a range of blocks at a time, so that a big table is compacted step by step.
+    # the records of the range are packed from the last non-empty block before the range on,
+    # so the blocks emptied by the previous steps are filled first. the empty blocks at the end
+    # of the table are cut off the file.
+    # the file is synced first, then a REORG log record and the images of the new blocks are
+    # forced to the log before any block is written, so the recovery can write the images again.
+    # no transaction should be using the table.
+    # param block_range: (first block id, last block id), all the data blocks if None
+    # param active_transactions: the ids of the transactions which have not ended, only their deletes
+    #                            keep the table from being compacted. all the deletes do if None
+    # return: (reclaimed bytes, reclaimed blocks), or None if the table cannot be compacted now
+    # -------------------------------
+    def vacuum(self, block_range=None, active_transactions=None):
+        first_block, last_block = block_range if block_range else (1, self.data_block_num)
+        last_block = min(last_block, self.data_block_num)
+        if first_block < 1 or first_block > last_block:
+            return 0, 0
+        if any(slot[0] == self.file_name and (active_transactions is None or deleter in active_transactions)
+               for slot, deleter in common_db.global_uncommitted_deletes.items()):
+            print('\033[31mthe table has deletes which are not committed, it cannot be compacted now\033[0m')
+            return None
+
+        # step 1: the blocks emptied by the previous steps are filled first
+        while first_block > 1 and self._record_count(first_block - 1) == 0:
+            first_block -= 1
+        if first_block > 1:
+            first_block -= 1  # the last non-empty block is packed again with the range
+
+        # step 2: read the records of the blocks, the deleted ones are dropped
+        contents = []
+        reclaimed_bytes = 0
+        num_of_used_blocks = 0
+        for block_id in range(first_block, last_block + 1):
+            data_block = self.pool.fetch_page(self.file_name, block_id)
+            records = self.codec.record_contents(data_block)
+            self.pool.unpin_page(self.file_name, block_id)
+            for is_deleted, record_data_bytes in records:
+                if is_deleted:
+                    reclaimed_bytes += self.codec.record_space(record_data_bytes)
+                else:
+                    contents.append(record_data_bytes)
+            if records:
+                num_of_used_blocks += 1
+
+        # step 3: pack them into new images of the blocks, the blocks left over are empty
+        images = {}
+        for block_id, first_slot_id, records in self.codec.split_into_blocks(
+                contents, first_block, 0, BLOCK_SIZE - struct.calcsize('!ii')):
+            images[block_id] = bytearray(BLOCK_SIZE)
+            self.codec.pack_block(images[block_id], block_id, 0, records)
+        num_of_packed_blocks = len(images)
+        new_block_num = self.data_block_num
+        if last_block == self.data_block_num:  # the empty blocks at the end are cut off
+            new_block_num = max(images, default=first_block - 1)
+        if reclaimed_bytes == 0 and num_of_packed_blocks == num_of_used_blocks and new_block_num == self.data_block_num:
+            return 0, 0  # the blocks are packed already
+        for block_id in range(first_block, new_block_num + 1):
+            if block_id not in images and block_id <= last_block:
+                images[block_id] = bytearray(BLOCK_SIZE)
+                struct.pack_into('!ii', images[block_id], 0, block_id, 0)
+
+        # the free space map keeps no block of the range, which has no deleted record now
+        meta_block = self.pool.fetch_page(self.file_name, 0)
+        meta_image = bytearray(meta_block)
+        self.pool.unpin_page(self.file_name, 0)
+        entries = [entry for entry in self._read_fsm() if not first_block <= entry[0] <= last_block]
+        struct.pack_into('!ii', meta_image, 0, 0, new_block_num)
+        struct.pack_into('!i', meta_image, FSM_OFFSET, len(entries))
+        for i, entry in enumerate(entries):
+            struct.pack_into('!ii', meta_image, FSM_OFFSET + 4 + i * 8, entry[0], entry[1])
+        images[0] = meta_image
+
+        # step 4: sync the file, so the older log records of the table are not needed any more,
+        # then log the reorganization and the images
+        self.pool.flush_file(self.file_name, sync=True)
+        if self.log_manager:
+            self.log_manager.log(0, log_db.RECORD_TYPE_REORG, log_db.pack_table_payload(self.tableName), force=False)
+            for block_id in sorted(images):
+                self.log_manager.log(0, log_db.RECORD_TYPE_PAGE_IMAGE,
+                                     log_db.pack_page_image_payload(self.tableName, block_id, images[block_id]),
+                                     force=False)
+            self.log_manager.force()
+
+        # step 5: write the blocks and cut the file, the file is synced so that the recovery
+        # does not need the images once the table is changed again
+        old_block_num = self.data_block_num
+        for block_id in sorted(images):
+            self.pool.write_page(self.file_name, block_id, images[block_id])
+        self.data_block_num = new_block_num
+        self.pool.flush_file(self.file_name, sync=True)
+        if new_block_num < old_block_num:
+            self._unmap()
+            self.pool.truncate_file(self.file_name, new_block_num + 1)
+
+        # step 6: the records have moved, so the indexes are made again, then the recovery does not need to
+        self._rebuild_indexes()
+        if self.log_manager:
+            self.log_manager.log(0, log_db.RECORD_TYPE_REORG_DONE, log_db.pack_table_payload(self.tableName))
+
+        reclaimed_blocks = num_of_used_blocks - num_of_packed_blocks
+        print(f'blocks {first_block}-{last_block} compacted: {reclaimed_bytes} bytes and {reclaimed_blocks} blocks '
+              f'reclaimed, the table has {new_block_num} data blocks')
+        return reclaimed_bytes, reclaimed_blocks
+
+    # ------------------------------
+    # to get the number of records (including deleted ones) in a data block
+    # -------------------------------------
+    def _record_count(self, block_id):
+        data_block = self.pool.fetch_page(self.file_name, block_id)
+        Number_of_Records = self.codec.block_head_struct.unpack_from(data_block, 0)[1]
+        self.pool.unpin_page(self.file_name, block_id)
+        return Number_of_Records
+
+    # ------------------------------
+    # to show the records of the table
+    # input:
+    #       use_mmap: see scan()
+    # -------------------------------------
+    def show_table_data(self, use_mmap=None):
         print('|    '.join(map(lambda x: x[0].decode('utf-8').strip(), self.field_name_list)))  # show the structure
 
-        # the following is to show the data of the table
-        for record, is_deleted in list(zip(self.record_list, self.delete_flag_list)):
-            if not is_deleted:
-                print(record)
+        # the following is to show the data of the table, block by block
+        for position, record in self.scan(use_mmap):
+            print(record)
 
     # --------------------------------
     # to delete  the data file
@@ -587,9 +1587,11 @@ class Storage(object):
     # -----------------------------------
     def delete_table_data(self, tableName):
 
-        # step 1: identify whether the file is still open
+        # step 1: identify whether the file is still open, its cached blocks are thrown away
+        self._close_indexes()
         if self.open == True:
-            self.f_handle.close()
+            self._unmap()
+            self.pool.discard_file(self.file_name)
             self.open = False
 
         # step 2: remove the file from os   
@@ -611,12 +1613,104 @@ class Storage(object):
     # ----------------------------------------
     # destructor
     # ------------------------------------------------
-    def __del__(self):  # write the metahead information in head object to file
+    def __del__(self):
+        self.close()
 
+    # ----------------------------------------
+    # to close the table file, the metahead information in head object is written to file
+    # ------------------------------------------------
+    def close(self):
+
+        self._close_indexes()
         if self.open == True:
-            self.f_handle.seek(0)
-            self.buf = ctypes.create_string_buffer(struct.calcsize('!ii'))
-            struct.pack_into('!ii', self.buf, 0, 0, self.data_block_num)
-            self.f_handle.write(self.buf)
-            self.f_handle.flush()
-            self.f_handle.close()
+            self._unmap()
+            meta_block = self.pool.fetch_page(self.file_name, 0)
+            struct.pack_into('!ii', meta_block, 0, 0, self.data_block_num)
+            self.pool.unpin_page(self.file_name, 0, True)
+            self.pool.close_file(self.file_name)  # the dirty blocks are written back when the file is closed
+            self.open = False
+
+
+# --------------------------------------------
+# to convert a table file into the latest record format, see latest_record_format()
+# the live records are packed into the blocks of a temporary file, which then replaces the table file.
+# the positions of the records change, so a REORG log record tells the recovery to ignore
+# the older log records of the table. no transaction should be using the table.
+# input:
+#       tablename
+#       log_manager: the log manager to record the REORG log
+# output:
+#       (number of data blocks before, number of data blocks after), or None if nothing is converted
+# --------------------------------------------
+def convert_table_format(tablename, log_manager=None):
+    tablename = tool.tryToBytes(tablename)
+    if not os.path.exists(tablename + '.dat'.encode('utf-8')):
+        print('table file '.encode('utf-8') + tablename + '.dat does not exists'.encode('utf-8'))
+        return None
+    catalog_db.get_table_registry().invalidate(tablename)  # the open table must not use the old file
+
+    storage = Storage(tablename)
+    if not storage.open:
+        return None
+    record_format = latest_record_format(storage.field_name_list)
+    if storage.record_format == record_format:
+        print('table file '.encode('utf-8') + tablename + ' is already in the latest format'.encode('utf-8'))
+        return None
+
+    codec = RecordCodec(storage.field_name_list, record_format)
+    old_block_num = storage.data_block_num
+    new_block_num = 0
+
+    # step 1: write the converted records into the temporary file, block 0 is written at last
+    tmp_file_name = storage.file_name + '.tmp'.encode('utf-8')
+    with open(tmp_file_name, 'wb') as tmp_handle:
+        free_space = BLOCK_SIZE - struct.calcsize('!ii')
+        records = []
+        for position, record in storage.scan():
+            record_data_bytes = codec.encode_values(record)
+            if codec.record_space(record_data_bytes) > free_space:  # the block is full
+                new_block_num += 1
+                data_block = bytearray(BLOCK_SIZE)
+                codec.pack_block(data_block, new_block_num, 0, records)
+                tmp_handle.seek(new_block_num * BLOCK_SIZE)
+                tmp_handle.write(data_block)
+                free_space = BLOCK_SIZE - struct.calcsize('!ii')
+                records = []
+            records.append(record_data_bytes)
+            free_space -= codec.record_space(record_data_bytes)
+        if records:
+            new_block_num += 1
+            data_block = bytearray(BLOCK_SIZE)
+            codec.pack_block(data_block, new_block_num, 0, records)
+            tmp_handle.seek(new_block_num * BLOCK_SIZE)
+            tmp_handle.write(data_block)
+
+        dir_buf = bytearray(storage.pool.fetch_page(storage.file_name, 0))
+        storage.pool.unpin_page(storage.file_name, 0)
+        struct.pack_into('!ii', dir_buf, 0, 0, new_block_num)
+        struct.pack_into('!i', dir_buf, FSM_OFFSET, 0)  # the records are packed, no slot is free
+        struct.pack_into('!i', dir_buf, RECORD_FORMAT_OFFSET, record_format)
+        tmp_handle.seek(0)
+        tmp_handle.write(dir_buf)
+        tmp_handle.flush()
+        os.fsync(tmp_handle.fileno())
+
+    # step 2: close the old file without writing anything into it
+    storage._unmap()
+    storage.pool.discard_file(storage.file_name)
+    storage.open = False
+
+    # step 3: log the reorganization, then replace the table file
+    if log_manager:
+        log_manager.log(0, log_db.RECORD_TYPE_REORG, log_db.pack_table_payload(tablename))
+    os.replace(tmp_file_name, storage.file_name)
+
+    # step 4: the records have moved, so the indexes are made again, then the recovery does not need to
+    registry = catalog_db.get_table_registry()
+    registry.acquire(tablename)._rebuild_indexes()
+    registry.release(tablename)
+    if log_manager:
+        log_manager.log(0, log_db.RECORD_TYPE_REORG_DONE, log_db.pack_table_payload(tablename))
+
+    print('table file '.encode('utf-8') + tablename + ' has been converted into the latest format'.encode('utf-8'))
+    return old_block_num, new_block_num
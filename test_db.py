@@ -1,7 +1,25 @@
 import os
+import io
+import bisect
+import random
+import threading
+import struct
+import contextlib
+import tempfile
+import ply.lex as lex
+import ply.yacc as yacc
 import log_db
 import transaction_db
 import storage_db
+import catalog_db
+import common_db
+import bench_db
+import buffer_db
+import index_db
+import schema_db
+import lex_db
+import parser_db
+import query_plan_db
 
 def test_committed_transaction_survives_crash():
     print("--- Running Test: Committed Transaction ---")
@@ -51,6 +69,983 @@ def test_uncommitted_transaction_rolls_back():
     os._exit(1)
 
 
+# ------------------------------------------------
+# 以下的检查不需要 input()，每个检查都在一个新的临时目录中进行:
+#       python -m pytest test_db.py -k "not survives_crash and not rolls_back"
+# 崩溃的模拟: 丢掉内存中的表、缓冲池和日志管理器，再用新的日志管理器执行恢复
+# ------------------------------------------------
+FIELDS = [(b'name', 0, 10), (b'age', 2, 10)]
+
+
+# -----------------------
+# 丢掉内存中的所有状态，就像程序重新启动一样
+# -----------------------
+def reset_globals():
+    if common_db.global_table_registry is not None:
+        common_db.global_table_registry.close_all()
+    common_db.global_table_registry = None
+    common_db.global_buffer_pool = None
+    common_db.global_index_catalog = None
+    common_db.global_plan_cache = None
+    common_db.global_uncommitted_deletes = {}
+
+
+@contextlib.contextmanager
+def new_database():
+    old_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        reset_globals()
+        try:
+            yield
+        finally:
+            reset_globals()
+            os.chdir(old_dir)
+
+
+# -----------------------
+# 创建一张表 (不询问字段)，返回它的 Storage 对象
+# -----------------------
+def open_table(log_manager, table_name=b'people', fields=FIELDS):
+    if not os.path.exists(table_name + b'.dat'):
+        bench_db.create_table_file(table_name, fields)
+    return catalog_db.get_table_registry().acquire(table_name, log_manager)
+
+
+# -----------------------
+# 读出一个文件的内容，用于模拟崩溃时还没有写回磁盘的块
+# -----------------------
+def read_file(file_name):
+    with open(file_name, 'rb') as f_handle:
+        return f_handle.read()
+
+
+# -----------------------
+# 模拟崩溃并恢复，返回新的日志管理器
+# files: 文件名 -> 崩溃时磁盘上的内容，即之后的修改都没有写回
+# -----------------------
+def crash_and_recover(log_manager, files=None):
+    reset_globals()
+    log_manager.log_file.close()
+    log_manager.log_file = None
+    for file_name, data in (files or {}).items():
+        with open(file_name, 'wb') as f_handle:
+            f_handle.write(data)
+    log_manager = log_db.LogManager()
+    log_manager.recover()
+    return log_manager
+
+
+def test_insert_batch_recovery():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        rows = [['n%d' % i, str(i)] for i in range(300)]  # 几个数据块
+
+        # 已提交的批量插入，数据块没有写回就崩溃了: 重做
+        before = read_file(b'people.dat')
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records(rows, tx_id)
+        transaction_manager.commit(tx_id)
+        assert storage.data_block_num > 1
+        log_manager = crash_and_recover(log_manager, {b'people.dat': before})
+        storage = open_table(log_manager)
+        assert sorted(storage.getRecord()) == sorted((name.encode(), int(age)) for name, age in rows)
+
+        # 没有提交的批量插入已经写回了: 撤销
+        # 事务ID由启动时间决定，同一秒内的新事务管理器会重复使用ID，所以继续使用原来的
+        transaction_manager.log_manager = log_manager
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['x%d' % i, str(i)] for i in range(200)], tx_id)
+        log_manager = crash_and_recover(log_manager)
+        storage = open_table(log_manager)
+        assert len(storage.getRecord()) == len(rows)
+
+
+# -----------------------
+# 表中每条记录的位置，名字 -> (block_id, slot_id)
+# -----------------------
+def positions(storage):
+    return {record[0]: position for position, record in storage.scan()}
+
+
+def test_slot_reuse():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['a', '1'], ['b', '2'], ['c', '3']], tx_id)
+        transaction_manager.commit(tx_id)
+
+        # 已提交的删除留下的槽位被下一次插入重用
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:b', tx_id)
+        transaction_manager.commit(tx_id)
+        assert storage._read_fsm() == [[1, 1]]
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['d', '4'], tx_id)
+        transaction_manager.commit(tx_id)
+        assert positions(storage)[b'd'] == (1, 1)
+        assert storage._read_fsm() == []
+
+        # 没有提交的删除的槽位不能被重用，中止之后记录回到原来的槽位，插入的记录被删除
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:c', tx_id)
+        assert storage.insert_record(['e', '5'], tx_id)
+        assert positions(storage)[b'e'] == (1, 3)
+        transaction_manager.abort(tx_id)
+        assert positions(storage) == {b'a': (1, 0), b'd': (1, 1), b'c': (1, 2)}
+        assert storage._read_fsm() == [[1, 1]]
+        assert common_db.global_uncommitted_deletes == {}
+
+        # 中止之后的删除和重用照常进行，中止的事务在重用的槽位中插入的记录也被删除
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:c', tx_id)
+        transaction_manager.commit(tx_id)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['f', '6'], ['g', '7']], tx_id)
+        assert positions(storage)[b'f'] == (1, 2) or positions(storage)[b'g'] == (1, 2)
+        transaction_manager.abort(tx_id)
+        assert positions(storage) == {b'a': (1, 0), b'd': (1, 1)}
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['h', '8'], tx_id)
+        transaction_manager.commit(tx_id)
+        assert positions(storage)[b'h'] in [(1, 2), (1, 3)]
+
+
+def test_vacuum_recovery():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['n%d' % i, str(i)] for i in range(300)], tx_id)
+        transaction_manager.commit(tx_id)
+        tx_id = transaction_manager.begin_transaction()
+        for i in range(0, 300, 2):
+            assert storage.delete_record('name:n%d' % i, tx_id)
+        transaction_manager.commit(tx_id)
+        records = sorted(storage.getRecord())
+        create_index(b'people', b'name')
+
+        # 压缩写入的块没有写回就崩溃了: 重做块映像 (REORG 之前的日志都不再重做)，再重建索引
+        before = read_file(b'people.dat')
+        assert storage.vacuum(None, transaction_manager.active_transactions)[1] > 0
+        data_block_num = storage.data_block_num
+        log_manager, rebuilt = crash_and_count_rebuilds(log_manager, {b'people.dat': before})
+        storage = open_table(log_manager)
+        assert storage.data_block_num == data_block_num
+        assert sorted(storage.getRecord()) == records
+        assert rebuilt == [b'people']
+        assert index_search(storage, b'n1') == [positions(storage)[b'n1']]
+
+        # 压缩之后表又被修改了: 块映像不再重做，不会覆盖之后的修改，早已完成的压缩也不再重建索引
+        transaction_manager.log_manager = log_manager
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['x', '1000'], tx_id)
+        transaction_manager.commit(tx_id)
+        log_manager, rebuilt = crash_and_count_rebuilds(log_manager)
+        storage = open_table(log_manager)
+        assert sorted(storage.getRecord()) == sorted(records + [(b'x', 1000)])
+        assert rebuilt == []
+
+
+# -----------------------
+# 模拟崩溃并恢复，同时记下恢复中重建了索引的表
+# -----------------------
+def crash_and_count_rebuilds(log_manager, files=None):
+    rebuilt = []
+    rebuild_indexes = storage_db.Storage._rebuild_indexes
+    storage_db.Storage._rebuild_indexes = lambda storage: rebuilt.append(storage.tableName) or rebuild_indexes(storage)
+    try:
+        return crash_and_recover(log_manager, files), rebuilt
+    finally:
+        storage_db.Storage._rebuild_indexes = rebuild_indexes
+
+
+# -----------------------
+# 在表的一个字段上建立索引，和 main_db.py 的选项 9 一样
+# -----------------------
+def create_index(table_name, field_name, kind=index_db.INDEX_KIND_BTREE):
+    index = index_db.open_index(table_name, field_name, kind)
+    index.create_index(field_name)
+    index.close()
+    catalog_db.get_index_catalog().add_index(table_name, field_name, kind)
+
+
+# -----------------------
+# 在表的第一个索引中查找一个值，返回记录的位置
+# -----------------------
+def index_search(storage, value):
+    return sorted(storage._get_indexes()[0][2].search(value))
+
+
+def test_index_maintenance():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['a', '1'], ['b', '2']], tx_id)
+        transaction_manager.commit(tx_id)
+        create_index(b'people', b'name')
+
+        # 插入和删除时索引随之改变
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['c', '3'], tx_id)
+        assert storage.delete_record('name:a', tx_id)
+        transaction_manager.commit(tx_id)
+        assert index_search(storage, b'c') == [positions(storage)[b'c']]
+        assert index_search(storage, b'a') == []
+        assert index_search(storage, b'b') == [positions(storage)[b'b']]
+
+        # 中止的删除的索引条目被加回去，中止的插入的索引条目被去掉
+        expected = {name: index_search(storage, name) for name in (b'b', b'c')}
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:c', tx_id)
+        assert storage.insert_record(['z', '26'], tx_id)
+        transaction_manager.abort(tx_id)
+        assert index_search(storage, b'c') == expected[b'c']
+        assert index_search(storage, b'z') == []
+
+        # 没有提交的插入和删除，连同它们的索引条目一起被撤销
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['d', '4'], ['e', '5']], tx_id)
+        assert storage.delete_record('name:b', tx_id)
+        assert index_search(storage, b'b') == []
+        log_manager = crash_and_recover(log_manager)
+        storage = open_table(log_manager)
+        assert index_search(storage, b'd') == index_search(storage, b'e') == []
+        assert {name: index_search(storage, name) for name in (b'b', b'c')} == expected
+
+
+def test_duplicate_keys_rejected():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        # 和 main_db.py 的选项 1 一样声明主键和唯一字段，再建立它们的索引
+        open(schema_db.Schema.fileName, 'wb').close()
+        schema = schema_db.Schema()
+        assert schema.appendTable(b'people', storage.getFieldList(), b'name', [b'age'])
+        del schema
+        storage.create_key_indexes()
+
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['a', '1'], tx_id)
+        assert not storage.insert_record(['a', '2'], tx_id)  # 主键重复
+        assert not storage.insert_record(['b', '1'], tx_id)  # 唯一字段重复
+        assert not storage.insert_records([['c', '3'], ['c', '4']], tx_id)  # 批量插入中重复
+        assert storage.insert_records([['c', '3'], ['d', '4']], tx_id)
+        transaction_manager.commit(tx_id)
+        assert sorted(storage.getRecord()) == [(b'a', 1), (b'c', 3), (b'd', 4)]
+
+        # 中止的插入的值不再占用键，可以再插入
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['e', '5'], tx_id)
+        transaction_manager.abort(tx_id)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['e', '5'], tx_id)
+        assert not storage.insert_record(['e', '6'], tx_id)
+        transaction_manager.commit(tx_id)
+        assert sorted(storage.getRecord()) == [(b'a', 1), (b'c', 3), (b'd', 4), (b'e', 5)]
+
+        # 删除之后这个值可以再插入
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:a', tx_id)
+        assert storage.insert_record(['a', '2'], tx_id)
+        transaction_manager.commit(tx_id)
+        assert sorted(storage.getRecord()) == [(b'a', 2), (b'c', 3), (b'd', 4), (b'e', 5)]
+
+
+def test_registry_shares_tables():
+    with new_database():
+        registry = catalog_db.get_table_registry()
+        storage = open_table(None)
+        assert storage.insert_records([['a', '1'], ['b', '2']])
+
+        # 同一张表只打开一次，一个使用者要内存映射不会改变其他使用者的扫描方式
+        assert registry.acquire(b'people') is storage
+        assert list(storage.scan(use_mmap=True)) == list(storage.scan())
+        assert not storage.use_mmap
+        registry.release(b'people')
+        registry.release(b'people')
+        assert registry.tables[b'people'][1] == 0
+        registry.close_all()
+        assert open_table(None) is not storage
+
+
+def test_convert_table_format():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager, b'old', [(b'name', 0, 10), (b'note', 1, 20), (b'age', 2, 10), (b'ok', 3, 5)])
+        assert storage.record_format == storage_db.RECORD_FORMAT_TEXT  # bench_db 建立的表文件是旧的格式
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['n%d' % i, 'note %d' % i, str(i - 100), str(i % 2 == 0)] for i in range(200)], tx_id)
+        assert storage.delete_record('name:n3', tx_id)
+        transaction_manager.commit(tx_id)
+        create_index(b'old', b'age')
+        records = sorted(storage.getRecord())
+
+        assert storage_db.convert_table_format(b'old', log_manager) is not None
+        storage = open_table(log_manager, b'old')
+        assert storage.record_format == storage_db.RECORD_FORMAT_VARIABLE
+        assert sorted(storage.getRecord()) == records
+        assert [record for position, record in storage.fetch_records(index_search(storage, -90))] == \
+               [(b'n10', b'note 10', -90, True)]
+        assert storage_db.convert_table_format(b'old', log_manager) is None  # 已经是最新的格式
+
+
+def test_vacuum_after_abort():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['a', '1'], ['b', '2'], ['c', '3']], tx_id)
+        transaction_manager.commit(tx_id)
+
+        # 中止的删除不会让表一直不能压缩
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:a', tx_id)
+        assert storage.vacuum(None, transaction_manager.active_transactions) is None
+        transaction_manager.abort(tx_id)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:b', tx_id)
+        transaction_manager.commit(tx_id)
+
+        assert storage.vacuum(None, transaction_manager.active_transactions)[0] > 0
+        assert sorted(storage.getRecord()) == [(b'a', 1), (b'c', 3)]
+
+
+
+# -----------------------
+# 和 main_db.py 的选项 5 一样分析并生成查询计划，返回读取表的结点 (TableScan, IndexScan 或 IndexOnlyScan)
+# -----------------------
+def plan_query(sql):
+    lex_db.set_lex_handle()
+    parser_db.set_handle()
+    lex_db.tokenize_sql(sql)
+    common_db.global_syn_tree = common_db.global_parser.parse(sql, lexer=common_db.global_lexer)
+    query_plan_db.construct_logical_tree()
+    node = common_db.global_logical_tree
+    while node.value not in ('TableScan', 'IndexScan', 'IndexOnlyScan'):
+        node = node.children[0]
+    return node
+
+
+# -----------------------
+# 执行生成的查询计划，返回打印出的结果行，每行是字段值的字符串的列表
+# use_cache: 和 main_db.py 的选项 5 一样先在计划缓存中找查询计划，找不到时生成计划并放进缓存
+# -----------------------
+def run_query(sql, use_cache=False):
+    if not (use_cache and query_plan_db.use_cached_plan(sql)):
+        plan_query(sql)
+        if use_cache:
+            query_plan_db.cache_plan(sql)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        query_plan_db.execute_logical_tree()
+    rows = [line for line in output.getvalue().splitlines() if line.startswith('| ')][1:]  # 第一行是表头
+    return sorted([value.strip() for value in row.strip('| ').split(' | ')] for row in rows)
+
+
+def test_access_path_choice():
+    with new_database():
+        storage = open_table(None, b'emp', [(b'name', 0, 10), (b'dept', 0, 10), (b'age', 2, 10)])
+        assert storage.insert_records([['n%04d' % i, 'd%d' % (i % 50), str(i % 100)] for i in range(3000)])
+        create_index(b'emp', b'name')
+        create_index(b'emp', b'age')
+
+        # 计划时只从树估计索引范围内的条目数，不读叶子结点的条目，索引只在执行时读一次
+        range_scans = []
+        range_scan = index_db.Index.range_scan
+        index_db.Index.range_scan = lambda index, *args: range_scans.append(args) or range_scan(index, *args)
+        try:
+            assert plan_query("select * from emp where name = 'n0042'").value == 'IndexScan'
+            assert plan_query("select * from emp where name >= 'n0040' and name < 'n0050'").value == 'IndexScan'
+            assert range_scans == []
+        finally:
+            index_db.Index.range_scan = range_scan
+
+        # 范围内的记录分散在很多数据块中时读整张表，查询的字段都在索引中时只读索引
+        assert plan_query("select * from emp where age = 5").value == 'TableScan'
+        assert plan_query("select age from emp where age > 5").value == 'IndexOnlyScan'
+        assert plan_query("select * from emp where dept = 'd7'").value == 'TableScan'
+
+        assert run_query("select * from emp where name >= 'n0040' and name < 'n0043'") == \
+               [["b'n0040'", "b'd40'", '40'], ["b'n0041'", "b'd41'", '41'], ["b'n0042'", "b'd42'", '42']]
+        assert run_query("select * from emp where age = 5 and name < 'n0300'") == \
+               [["b'n0005'", "b'd5'", '5'], ["b'n0105'", "b'd5'", '5'], ["b'n0205'", "b'd5'", '5']]
+
+        # 估计的条目数和真正的条目数相同，因为每层的结点都和两条路径上较满的结点一样大
+        index = index_db.open_index(b'emp', b'age')
+        for bounds in [(5, 5), (5, 7), (None, 10), (90, None), (None, None), (7, 5)]:
+            assert index.estimate_range(*bounds) == len(list(index.range_scan(*bounds)))
+        index.close()
+
+
+
+def test_record_formats_decode_alike():
+    fields = [(b'name', 0, 10), (b'note', 1, 20), (b'age', 2, 10), (b'small', 2, 5), (b'ok', 3, 5)]
+    rows = [['a', 'x', '0', '0', 'True'],
+            ['ten chars!', 'a note of 20 chars..', '-922337203', '-1234', 'False'],
+            ['  padded', '', '-1', '-1', 'false'],
+            ['b', 'short', '123456789', '9999', '1']]
+    codecs = [storage_db.RecordCodec(fields, record_format) for record_format in
+              (storage_db.RECORD_FORMAT_TEXT, storage_db.RECORD_FORMAT_BINARY, storage_db.RECORD_FORMAT_VARIABLE)]
+
+    # 同一批记录用三种格式写入数据块，解码出来的值相同，str 字段去掉了补齐用的字节
+    results = []
+    for codec in codecs:
+        contents = [codec.encode_record(row) for row in rows]
+        data_block = bytearray(common_db.BLOCK_SIZE)
+        codec.pack_block(data_block, 1, 0, contents)
+        records = [record for position, record in codec.decode_block(data_block, 1)]
+        assert records == [codec.decode_slot(data_block, slot_id) for slot_id in range(len(rows))]
+        assert records == [codec.decode_content(content) for content in contents]
+        results.append(records)
+    assert results[0] == results[1] == results[2]
+    assert results[0][1] == (b'ten chars!', b'a note of 20 chars..', -922337203, -1234, False)
+    assert results[0][2] == (b'padded', b'', -1, -1, False)
+
+
+
+def test_small_buffer_pool():
+    with new_database():
+        pool = common_db.global_buffer_pool = buffer_db.BufferPool(4)
+        storage = open_table(None)
+        for i in range(600):
+            assert storage.insert_record(['n%d' % i, str(i)])
+        assert storage.data_block_num > 4
+
+        # 页面被替换时，修改过的块先写回文件
+        assert len(pool.page_table) <= 4
+        data_block = read_file(b'people.dat')[common_db.BLOCK_SIZE:2 * common_db.BLOCK_SIZE]
+        assert storage.codec.decode_block(data_block, 1)[0] == ((1, 0), (b'n0', 0))
+
+        # 打开表只读块 0，扫描时才一块一块地读数据块
+        catalog_db.get_table_registry().close_all()
+        misses = pool.num_of_misses
+        storage = open_table(None)
+        assert pool.num_of_misses == misses + 1
+        records = storage.scan()
+        assert next(records) == ((1, 0), (b'n0', 0))
+        assert pool.num_of_misses == misses + 2
+        assert [record for position, record in records][-1] == (b'n599', 599)
+        assert sorted(storage.getRecord()) == sorted((b'n%d' % i, i) for i in range(600))
+
+
+
+def test_mmap_scan():
+    with new_database():
+        storage = open_table(None)
+        assert storage.insert_records([['n%d' % i, str(i)] for i in range(500)])
+        assert list(storage.scan(use_mmap=True)) == list(storage.scan())
+
+        # 映射之后表又变大了，还有没有写回的块: 重新映射，先写回修改过的块
+        for i in range(500, 800):
+            assert storage.insert_record(['n%d' % i, str(i)])
+        assert storage.delete_record('name:n7', None)
+        records = list(storage.scan())
+        assert len(records) == 799
+        assert list(storage.scan(use_mmap=True)) == records
+
+
+
+def test_record_codec():
+    with new_database():
+        storage = open_table(None, b'old', [(b'name', 0, 10), (b'age', 2, 10)])
+        assert storage.insert_records([['n%d' % i, str(i - 50)] for i in range(400)])
+        assert storage.delete_record('name:n5', None)
+
+        # 一次 iter_unpack 解码整块，和原来逐个字段解码的结果相同 (原来的解码把 bool 都当作 True，所以不比较 bool 字段)
+        for block_id in range(1, storage.data_block_num + 1):
+            data_block = storage.pool.fetch_page(storage.file_name, block_id)
+            try:
+                assert storage.codec.decode_block(data_block, block_id) == \
+                       bench_db.legacy_decode_block(storage.field_name_list, data_block, block_id)
+            finally:
+                storage.pool.unpin_page(storage.file_name, block_id)
+
+    # 二进制的格式能存下字段类型的整个范围，存不下的值被拒绝
+    fields = [(b'small', 2, 5), (b'big', 2, 10), (b'ok', 3, 1), (b'note', 1, 8)]
+    for record_format in (storage_db.RECORD_FORMAT_BINARY, storage_db.RECORD_FORMAT_VARIABLE):
+        codec = storage_db.RecordCodec(fields, record_format)
+        for row, values in [(['-2147483648', '-9223372036854775808', 'True', ''], (-2 ** 31, -2 ** 63, True, b'')),
+                            (['2147483647', '9223372036854775807', '0', '8 bytes!'], (2 ** 31 - 1, 2 ** 63 - 1, False, b'8 bytes!'))]:
+            assert codec.decode_content(codec.encode_record(row)) == values
+        assert codec.encode_record(['2147483648', '0', 'True', '']) is None
+        assert codec.encode_record(['0', '0', 'maybe', '']) is None
+        assert codec.encode_record(['0', '0', 'True', '9 bytes!!']) is None
+    assert len(storage_db.RecordCodec(fields, storage_db.RECORD_FORMAT_VARIABLE).encode_record(['0', '0', '1', 'a'])) < \
+           len(storage_db.RecordCodec(fields, storage_db.RECORD_FORMAT_BINARY).encode_record(['0', '0', '1', 'a']))
+
+
+
+def test_variable_length_records():
+    with new_database():
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        fields = [(b'name', 0, 10), (b'note', 1, 200)]
+        bench_db.create_table_file(b'notes', fields)
+        with open(b'notes.dat', 'rb+') as f_handle:
+            f_handle.seek(storage_db.RECORD_FORMAT_OFFSET)
+            f_handle.write(struct.pack('!i', storage_db.RECORD_FORMAT_VARIABLE))
+        storage = open_table(log_manager, b'notes')
+        text_table = open_table(None, b'text_notes', fields)
+        rows = [['n%d' % i, 'x' * (i % 7) if i % 50 else 'long-' * 40] for i in range(300)]
+
+        # varstr 只占它的值的字节，所以一块能放下更多的记录
+        before = read_file(b'notes.dat')
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records(rows, tx_id)
+        transaction_manager.commit(tx_id)
+        assert text_table.insert_records(rows)
+        assert storage.data_block_num * 4 <= text_table.data_block_num
+        records = sorted((name.encode(), note.encode()) for name, note in rows)
+        assert sorted(storage.getRecord()) == sorted(text_table.getRecord()) == records
+
+        # 删除的短记录的槽位放不下长的值，新记录放在别处，旁边的记录不受影响
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.delete_record('name:n1', tx_id)
+        transaction_manager.commit(tx_id)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['m', 'long-' * 40], tx_id)
+        transaction_manager.commit(tx_id)
+        assert positions(storage)[b'm'] != (1, 1)
+        records = sorted(record for record in records if record[0] != b'n1') + [(b'm', b'long-' * 40)]
+        assert sorted(storage.getRecord()) == sorted(records)
+
+        # 数据块没有写回就崩溃了: 重做之后记录的长度和值都不变
+        log_manager = crash_and_recover(log_manager, {b'notes.dat': before})
+        storage = open_table(log_manager, b'notes')
+        assert storage.record_format == storage_db.RECORD_FORMAT_VARIABLE
+        assert sorted(storage.getRecord()) == sorted(records)
+
+
+
+def test_registry_across_operations():
+    with new_database():
+        log_manager = log_db.LogManager()
+        registry = catalog_db.get_table_registry()
+        storage = open_table(None)
+        assert storage.insert_records([['a', '1'], ['b', '2']])
+
+        # 查询使用同一个打开的表，看得到还没有写回的记录，用完之后归还
+        assert run_query("select * from people where age > 1") == [["b'b'", '2']]
+        assert registry.tables[b'people'] == [storage, 1]
+        assert registry.acquire(b'people', log_manager) is storage
+        assert storage.log_manager is log_manager
+        registry.release(b'people')
+
+        # 删除表时关闭它，删除它的文件和索引
+        create_index(b'people', b'name')
+        assert registry.drop(b'people')
+        assert b'people' not in registry.tables
+        assert not os.path.exists(b'people.dat')
+        assert catalog_db.get_index_catalog().indexed_fields(b'people') == []
+        assert open_table(None) is not storage
+
+
+
+# -----------------------
+# 在一张空表上建立一个索引，之后逐个插入条目，返回 Index 对象
+# -----------------------
+def empty_index(field, compressed=None):
+    bench_db.create_table_file(b'keys', [field])
+    index = index_db.Index(b'keys', field[0], compressed=compressed)
+    index.create_index(field[0])
+    return index
+
+
+def test_index_splits():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        index = empty_index((b'id', 2, 10))
+        values = list(range(-30000, 30000, 2)) + [100] * 400  # 一个键的条目跨过几个叶子结点
+        random.Random(11).shuffle(values)
+        for i, value in enumerate(values):
+            assert index.insert_index_entry(value, i // 100 + 1, i % 100, False)
+
+        # 结点分裂之后树仍然平衡有序，内部结点能找到每个键
+        assert index.num_of_levels >= 3
+        entries = bench_db.check_index_tree(index)
+        assert len(entries) == len(values)
+        assert len(index.search(100)) == 401
+        for i, value in enumerate(values[:500]):
+            assert (i // 100 + 1, i % 100) in index.search(value)
+        assert index.search(101) == [] and index.search(-30002) == []
+
+        # 删除一个键的所有条目，其他键不受影响
+        for i, value in enumerate(values):
+            if value == 100:
+                assert index.delete_index_entry(value, i // 100 + 1, i % 100, False)
+        assert index.search(100) == []
+        assert index.search(98) != [] and index.search(102) != []
+        assert len(bench_db.check_index_tree(index)) == len(values) - 401
+        index.close()
+
+
+
+def test_index_bulk_load():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None)
+        ages = [random.Random(12).randrange(-500, 500) for i in range(5000)]
+        assert storage.insert_records([['n%d' % i, str(age)] for i, age in enumerate(ages)])
+        table_entries = sorted((age, position) for position, (name, age) in storage.scan())
+
+        # 分成很多段排序再归并，叶子结点按键的顺序放在块 1,2,...，每个结点填到 fill_factor
+        index = index_db.Index(b'people', b'age')
+        assert index.create_index(b'age', 0.5, 300) == len(ages)
+        entries = bench_db.check_index_tree(index)
+        decode = index.key_decoders()[0]
+        assert [(decode(key), tuple(ptr)) for key, ptr in entries] == table_entries
+        leaf_sizes = [len(index.read_node(block_id)[1]) for block_id in range(1, len(entries) // 100 + 1)]
+        assert set(leaf_sizes) == {index.max_leaf_keys // 2}
+
+        # 之后插入的条目放进留下的空间，满了再分裂
+        for i in range(3000):
+            assert index.insert_index_entry(0, 1000 + i // 100, i % 100, False)
+        assert len(bench_db.check_index_tree(index)) == len(ages) + 3000
+        assert len(index.search(0)) == ages.count(0) + 3000
+        index.close()
+
+
+
+def test_index_range_scan():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None)
+        ages = [random.Random(13).randrange(-300, 300) for i in range(3000)]
+        assert storage.insert_records([['n%04d' % i, str(age)] for i, age in enumerate(ages)])
+        create_index(b'people', b'age')
+        create_index(b'people', b'name')
+        records = {position: record for position, record in storage.scan()}
+        age_index, name_index = [index for field_name, kind, index in storage._get_indexes()]
+
+        # 范围内的条目按键的顺序给出，和逐条检查记录的结果相同
+        def check(index, field, low, high, low_inclusive=True, high_inclusive=True):
+            found = list(index.range_scan(low, high, low_inclusive, high_inclusive))
+            keys = [records[position][field] for position in found]
+            assert keys == sorted(keys)
+            assert sorted(found) == sorted(position for position, record in records.items()
+                                           if (low is None or record[field] > low or low_inclusive and record[field] == low)
+                                           and (high is None or record[field] < high or high_inclusive and record[field] == high))
+            return found
+
+        assert len(check(age_index, 1, -100, 100)) > 500  # 跨过很多叶子结点
+        check(age_index, 1, -100, 100, False, False)
+        check(age_index, 1, None, -250)
+        check(age_index, 1, 250, None, False)
+        assert check(age_index, 1, None, None) != []
+        assert check(age_index, 1, 7, 7) == sorted(age_index.search(7))
+        assert check(age_index, 1, 500, 600) == check(age_index, 1, 10, -10) == []
+        check(name_index, 0, b'n0100', b'n2000', True, False)
+        check(name_index, 0, b'n2999', None)
+
+
+
+def test_ordered_int_and_bool_keys():
+    values = [-2 ** 63, -10 ** 12, -100, -11, -10, -9, -1, 0, 1, 9, 10, 11, 100, 10 ** 12, 2 ** 63 - 1]
+    for variable in (False, True):
+        keys = [index_db.make_key(value, 2, variable) for value in values]
+        assert keys == sorted(keys) and len(set(keys)) == len(keys)
+        assert index_db.make_key(False, 3, variable) < index_db.make_key(True, 3, variable)
+    assert index_db.is_key_cut(2 ** 63, 2) and not index_db.is_key_cut(2 ** 63 - 1, 2)
+
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None, b'people', [(b'name', 0, 10), (b'age', 2, 10), (b'ok', 3, 5)])
+        assert storage.insert_records([['n%d' % i, str(i - 20), str(i % 3 == 0)] for i in range(40)])
+        create_index(b'people', b'age')
+        create_index(b'people', b'ok')
+        age_index, ok_index = [index for field_name, kind, index in storage._get_indexes()]
+
+        # 负数和位数不同的数按值的顺序排列，范围扫描不会漏掉或多出记录
+        ages = [storage.fetch_record(*position)[1] for position in age_index.range_scan(-11, 9)]
+        assert ages == list(range(-11, 10))
+        assert [storage.fetch_record(*position)[1] for position in age_index.range_scan(None, -15, True, False)] == \
+               list(range(-20, -15))
+        assert len(list(ok_index.range_scan(True, True))) == 14
+        assert len(list(ok_index.range_scan(None, False))) == 26
+
+
+
+def test_node_binary_search():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None, b'people', [(b'name', 0, 30), (b'age', 2, 10)])
+        rng = random.Random(16)
+        assert storage.insert_records([['common prefix %d' % rng.randrange(2000), str(rng.randrange(-500, 500))]
+                                       for i in range(4000)])
+        create_index(b'people', b'age')
+        age_index = storage._get_indexes()[0][2]
+
+        # bisect 只解码比较到的键，找到的条目和原来解开整个结点的查找相同
+        for value in range(-520, 520, 3):
+            assert sorted(age_index.search(value)) == sorted(bench_db.legacy_index_search(age_index, value))
+
+        # 两种结点格式中 key_position() 和对整个结点的键做 bisect 的结果相同
+        name_index = index_db.Index(b'people', b'name', compressed=True)
+        name_index.create_index(b'name')
+        for index in (age_index, name_index):
+            probes = [index.make_entry((value,))[0] for value in
+                      ([-501, -7, 0, 3, 499, 500] if index is age_index else
+                       [b'', b'common prefix 1', b'common prefix 1000', b'common prefix 5', b'zzz'])]
+            node_ptrs = [index.root_node_ptr]
+            while node_ptrs:
+                block_id = node_ptrs.pop()
+                node_type, key_list, ptr_list, last_ptr = index.read_node(block_id)
+                if node_type == index_db.INTERNAL_NODE_TYPE:
+                    node_ptrs += ptr_list + [last_ptr]
+                node_block = index.pool.fetch_page(index.file_name, block_id)
+                try:
+                    keys = index.node_keys(node_block, node_type, len(key_list))
+                    for key in probes + key_list[::7]:
+                        assert index.key_position(keys, key) == bisect.bisect_left(key_list, key)
+                        assert index.key_position(keys, key, True) == bisect.bisect_right(key_list, key)
+                finally:
+                    index.pool.unpin_page(index.file_name, block_id)
+        name_index.close()
+
+
+def test_pinned_upper_levels():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None)
+        assert storage.insert_records([['n%d' % i, str(i)] for i in range(5000)])
+        index = index_db.Index(b'people', b'age')
+        index.create_index(b'age', 0.05)  # 很空的结点，树有四层
+        assert index.num_of_levels == 4
+        pool = index.pool
+        table_positions = positions(storage)
+
+        # 上面两层的结点第一次读过之后一直固定在缓冲池中，再次查找时只取下面几层的块
+        assert index.search(10) == [table_positions[b'n10']]
+        assert index.root_node_ptr in index.pinned_nodes
+        assert len(index.pinned_nodes) == 2
+        for value in (77, 2500, 4999):
+            index.search(value)
+            fetches = pool.num_of_hits + pool.num_of_misses
+            assert index.search(value) == [table_positions[b'n%d' % value]]
+            assert pool.num_of_hits + pool.num_of_misses - fetches <= index.num_of_levels - index_db.PINNED_LEVELS + 1
+        assert len(index.pinned_nodes) <= 2 + 3
+
+        # 重建索引之后固定的旧结点被放开，关闭索引时所有的结点都被放开
+        index.create_index(b'age')
+        assert index.num_of_levels == 2
+        assert index.search(4999) == [table_positions[b'n4999']]
+        index.close()
+        assert all(pool.pin_count[pool.page_table[page]] == 0 for page in pool.page_table if page[0] == index.file_name)
+
+
+
+def test_hash_index():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        log_manager = log_db.LogManager()
+        transaction_manager = transaction_db.TransactionManager(log_manager)
+        storage = open_table(log_manager)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_records([['n%d' % i, str(i % 1000 if i % 10 else 7)] for i in range(6000)], tx_id)
+        transaction_manager.commit(tx_id)
+        create_index(b'people', b'age', index_db.INDEX_KIND_HASH)
+        index = storage._get_indexes()[0][2]
+        assert isinstance(index, index_db.HashIndex) and index.global_depth > 0
+
+        # 等值查找只读键所在的桶和它的溢出桶，结果和逐条检查记录相同
+        def expected(age):
+            return sorted(position for position, record in storage.scan() if record[1] == age)
+        for age in (0, 1, 7, 123, 999, 1000, -1):
+            assert sorted(index.search(age)) == expected(age)
+        assert len(index.search(7)) > 600  # 一个键的条目放不进一个桶
+        assert list(index.range_scan(3, 4)) == []
+
+        # 插入、删除和中止都维护哈希索引
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['x', '5000'], tx_id)
+        assert storage.delete_record('name:n1', tx_id)
+        transaction_manager.commit(tx_id)
+        tx_id = transaction_manager.begin_transaction()
+        assert storage.insert_record(['y', '5001'], tx_id)
+        transaction_manager.abort(tx_id)
+        assert index.search(5000) == [positions(storage)[b'x']]
+        assert index.search(5001) == [] and index.search(1) == expected(1)
+
+        # 等值条件使用哈希索引，范围条件不能使用它
+        assert plan_query("select * from people where age = 123").value == 'IndexScan'
+        assert plan_query("select * from people where age > 998").value == 'TableScan'
+        assert run_query("select * from people where age = 5000") == [["b'x'", '5000']]
+
+
+
+def test_composite_covering_index():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None, b'emp', [(b'name', 0, 10), (b'dept', 0, 10), (b'age', 2, 10), (b'bio', 0, 40)])
+        rng = random.Random(20)
+        assert storage.insert_records([['n%d' % i, 'd%d' % rng.randrange(20), str(rng.randrange(18, 70)), 'bio %d' % i]
+                                       for i in range(3000)])
+        index = index_db.Index(b'emp', b'dept,age', [b'name'])
+        index.create_index(b'dept,age')
+        catalog_db.get_index_catalog().add_index(b'emp', b'dept,age')
+        assert index.covered_fields() == [b'dept', b'age', b'name']
+        records = {position: record for position, record in storage.scan()}
+
+        # 只有前面的键字段的界限找到以它们开头的所有条目，下一个键字段的界限缩小范围
+        def expected(dept, low_age=None, high_age=None):
+            return sorted(position for position, (name, record_dept, age, bio) in records.items()
+                          if record_dept == dept and (low_age is None or age >= low_age)
+                          and (high_age is None or age < high_age))
+        assert sorted(index.range_scan((b'd3',), (b'd3',))) == expected(b'd3')
+        assert sorted(index.range_scan((b'd3', 30), (b'd3', 40), True, False)) == expected(b'd3', 30, 40)
+        assert sorted(index.range_scan((b'd3', 60), (b'd3',))) == expected(b'd3', 60)
+
+        # 叶子结点中的键和包含的字段就是记录中的值，不用读数据块
+        for position, values in index.covered_scan((b'd5', 20), (b'd5', 25)):
+            name, dept, age, bio = records[position]
+            assert values == (dept, age, name)
+        index.close()
+
+        assert plan_query("select name from emp where dept = 'd3' and age >= 30").value == 'IndexOnlyScan'
+        assert plan_query("select bio from emp where dept = 'd3' and age >= 30").value in ('IndexScan', 'TableScan')
+        assert run_query("select name, age from emp where dept = 'd3' and age >= 30") == \
+               sorted([str(records[position][0]), str(records[position][2])] for position in expected(b'd3', 30))
+
+
+
+def test_compressed_index_splits():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        index = empty_index((b'url', 0, 60), True)
+        rng = random.Random(21)
+        values = ['http://example.com/items/%d%s' % (i, 'x' * rng.randrange(10)) for i in range(6000)]
+        values += ['http://example.com/items/42'] * 300
+        rng.shuffle(values)
+        for i, value in enumerate(values):
+            assert index.insert_index_entry(value, i // 100 + 1, i % 100, False)
+
+        # 长的 str 键整个保存，前 10 个字节相同的值也能分开
+        assert index.compressed and index.num_of_levels >= 2
+        entries = bench_db.check_index_tree(index)
+        assert sorted(index.key_parts(key)[0].rstrip(b'\x00') for key, ptr in entries) == sorted(v.encode() for v in values)
+        for i, value in enumerate(values[:300]):
+            found = index.search(value)
+            assert (i // 100 + 1, i % 100) in found
+            assert len(found) == values.count(value)
+        assert index.search('http://example.com/items/') == []
+
+        # 删除之后其他键不受影响，结点仍然有序
+        for i, value in enumerate(values):
+            if i % 3 == 0:
+                assert index.delete_index_entry(value, i // 100 + 1, i % 100, False)
+        assert len(bench_db.check_index_tree(index)) == len(values) - len(values[::3])
+        for i, value in enumerate(values[:300]):
+            assert ((i // 100 + 1, i % 100) in index.search(value)) == (i % 3 != 0)
+        index.close()
+
+
+
+def test_concurrent_index_access():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        index = empty_index((b'id', 2, 10))
+        for value in range(0, 20000, 2):  # 偶数的键
+            assert index.insert_index_entry(value, value // 2 + 1, 0, False)
+        failures = []
+
+        def look_up(values):
+            for value in values:
+                if index.search(value) != [(value // 2 + 1, 0)]:
+                    failures.append(value)
+
+        def insert(values):
+            for value in values:
+                if not index.insert_index_entry(value, value // 2 + 1, 1, False):
+                    failures.append(value)
+
+        # 几个线程插入各自的奇数键，同时另外几个线程查找已有的键，结点分裂时查找也不会出错
+        odd_values = list(range(1, 20000, 2))
+        random.Random(22).shuffle(odd_values)
+        threads = [threading.Thread(target=insert, args=(odd_values[i::3],)) for i in range(3)]
+        threads += [threading.Thread(target=look_up, args=(list(range(2 * i, 20000, 8)),)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert failures == []
+
+        entries = bench_db.check_index_tree(index)
+        assert len(entries) == 20000
+        assert all(index.search(value) == [(value // 2 + 1, value % 2)] for value in range(0, 20000, 97))
+        index.close()
+
+
+
+# -----------------------
+# 语法树的内容，用于比较两棵树
+# -----------------------
+def tree_value(node):
+    if isinstance(node, common_db.Node):
+        return node.value, node.var, [tree_value(child) for child in node.children]
+    return node
+
+
+def test_parser_made_once():
+    queries = ["select * from emp",
+               "select name, age from emp where age = 42",
+               "select emp.name, dept.title from emp, dept where emp.age > 30 and dept.title = 'sales'"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        lex_db.set_lex_handle()
+        parser_db.set_handle()
+        lexer, parser = common_db.global_lexer, common_db.global_parser
+        lex_db.set_lex_handle()
+        parser_db.set_handle()
+        assert common_db.global_lexer is lexer and common_db.global_parser is parser
+
+        # 从保存的分析表得到的分析器和重新生成分析表的分析器得到相同的语法树
+        new_parser = yacc.yacc(module=parser_db, debug=False, write_tables=False, tabmodule='no_such_parsetab',
+                               errorlog=yacc.NullLogger())
+        for sql in queries:
+            lex_db.tokenize_sql(sql)
+            syn_tree = parser.parse(sql, lexer=lexer)
+            assert syn_tree is not None
+            assert tree_value(syn_tree) == tree_value(new_parser.parse(sql, lexer=lex.lex(module=lex_db)))
+
+        # 出错的查询之后词法分析器被重置，下一个查询照常分析
+        parser.parse("select from where", lexer=lexer)
+        lex_db.set_lex_handle()
+        assert tree_value(parser.parse(queries[1], lexer=lexer)) == \
+               tree_value(new_parser.parse(queries[1], lexer=lex.lex(module=lex_db)))
+
+
+
+def test_plan_cache():
+    with new_database(), contextlib.redirect_stdout(io.StringIO()):
+        storage = open_table(None)
+        assert storage.insert_records([['n%d' % i, str(i % 50)] for i in range(2000)])
+        create_index(b'people', b'name')
+        cache = query_plan_db.get_plan_cache()
+
+        # 同样形状的查询使用缓存的计划，新的值放进计划的条件和索引范围中
+        assert run_query("select * from people where name = 'n5'", True) == [["b'n5'", '5']]
+        assert run_query("select * from people where name = 'n1234'", True) == [["b'n1234'", '34']]
+        access_node = common_db.global_logical_tree
+        while access_node.value != 'IndexScan':
+            access_node = access_node.children[0]
+        assert access_node.var == ['name', 'n1234', 'n1234', True, True]
+        assert run_query("select name from people where name = 'n77'", True) == [["b'n77'"]]
+        assert (cache.num_of_hits, cache.num_of_misses) == (1, 2)
+
+        # 索引改变之后缓存的计划不再使用，新的计划用上新的索引
+        assert run_query("select * from people where age = 3", True) == \
+               sorted([["b'n%d'" % i, '3'] for i in range(3, 2000, 50)])
+        assert plan_query("select * from people where age = 3").value == 'TableScan'
+        create_index(b'people', b'age')
+        hits = cache.num_of_hits
+        assert run_query("select * from people where age = 4", True) == \
+               sorted([["b'n%d'" % i, '4'] for i in range(4, 2000, 50)])
+        assert cache.num_of_hits == hits
+        assert run_query("select * from people where age = 5", True) == \
+               sorted([["b'n%d'" % i, '5'] for i in range(5, 2000, 50)])
+        assert cache.num_of_hits == hits + 1
+
+
 if __name__ == '__main__':
     # test_committed_transaction_survives_crash()
     test_uncommitted_transaction_rolls_back()
\ No newline at end of file
@@ -28,6 +28,19 @@ def tryToStr(value):
         return value.decode('utf-8').strip()
     return str(value).strip()
 
+# ------------------------------------------------
+# 将表示布尔值的文本转换为bool类型
+# :param value: str或bytes, 例如 'True', 'false', '1', '0'
+# :return: True或False, 无法识别时返回None
+# ------------------------------------------------
+def parseBool(value):
+    value = tryToStr(value).lower()
+    if value in ('true', 't', 'yes', 'y', '1'):
+        return True
+    if value in ('false', 'f', 'no', 'n', '0', ''):
+        return False
+    return None
+
 # ------------------------------------------------
 # 将第二个参数转换为第一个参数的类型
 # :param target: 目标对象(用于获取目标类型)
@@ -13,6 +13,7 @@
 import time
 import threading
 import log_db 
+import storage_db
 
 # -----------------------
 # 初始化事务管理器
@@ -76,6 +77,9 @@ class TransactionManager:
         
         # 2. 从活动事务列表中移除
         self.active_transactions.remove(transaction_id)
+
+        # 3. 该事务删除的记录所在的槽位从此可以被重用
+        storage_db.release_deleted_slots(transaction_id)
         
         print(f"[TX Manager] Transaction {transaction_id} committed.")
 
@@ -89,10 +93,17 @@ class TransactionManager:
             print(f"[TX Manager] Warning: Attempted to abort a non-active transaction {transaction_id}.")
             return
 
-        # 1. 记录 ABORT 日志，告知恢复系统，这个事务的所有修改都应该被撤销
+        # 1. 从后往前撤销该事务的插入和删除，连同索引的改变
+        #    在 ABORT 日志之前撤销，这样中途崩溃时恢复会把这些修改撤销完
+        self.log_manager.rollback(transaction_id)
+
+        # 2. 记录 ABORT 日志，告知恢复系统，这个事务的所有修改都应该被撤销
         self.log_manager.log(transaction_id, log_db.RECORD_TYPE_ABORT)
         
-        # 2. 从活动事务列表中移除
+        # 3. 从活动事务列表中移除
         self.active_transactions.remove(transaction_id)
+
+        # 4. 被撤销的删除所在的槽位不再记为未提交
+        storage_db.release_deleted_slots(transaction_id)
         
         print(f"[TX Manager] Transaction {transaction_id} aborted.")
\ No newline at end of file